@@ -1,7 +1,17 @@
 from flask import Flask
 from flask_login import LoginManager
 from config import config
-from app.models import db, User
+from app.models import db
+from app.identity import load_identity
+from app.database import engine_options, init_engine
+from app.replica import REPLICA_BIND, replica_bind_options, init_replica_routing
+from app.migrations import check_schema
+from app.migrations.cli import db_cli
+from app.instrumentation import init_instrumentation
+from app.reservations import reservations_cli
+from app.jobs.cli import jobs_cli
+from app.http_cache import init_http_cache
+from app.uploads import init_uploads
 import os
 
 
@@ -34,7 +44,20 @@ def create_app(config_name='development'):
         print(f"Warning: cannot create upload folder {app.config.get('UPLOAD_FOLDER')}")
     
     # Initialize extensions
+    binds = dict(app.config.get('SQLALCHEMY_BINDS') or {})
+    if isinstance(binds.get(REPLICA_BIND), str):
+        binds[REPLICA_BIND] = replica_bind_options(app.config, binds[REPLICA_BIND])
+    app.config['SQLALCHEMY_BINDS'] = binds
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config)
     db.init_app(app)
+    with app.app_context():
+        for engine in db.engines.values():
+            init_engine(app, engine)
+    # First, so its after_request handler (compression) runs last
+    init_http_cache(app)
+    init_uploads(app)
+    init_replica_routing(app, db)
+    instrumented = init_instrumentation(app, db)
     
     # Setup Flask-Login
     login_manager = LoginManager()
@@ -45,7 +68,10 @@ def create_app(config_name='development'):
     
     @login_manager.user_loader
     def load_user(user_id):
-        return User.query.get(int(user_id))
+        identity = load_identity(int(user_id))
+        if identity is None or not identity.is_active:
+            return None
+        return identity
     
     # Register blueprints
     from app.routes.auth import auth_bp
@@ -62,6 +88,8 @@ def create_app(config_name='development'):
     from app.routes.alerts import alerts_bp
     from app.routes.master import master_bp
     from app.routes.admin import admin_bp
+    from app.routes.health import health_bp
+    from app.routes.jobs import jobs_bp
     
     app.register_blueprint(auth_bp)
     app.register_blueprint(dashboard_bp)
@@ -77,9 +105,17 @@ def create_app(config_name='development'):
     app.register_blueprint(master_bp)
     app.register_blueprint(admin_bp)
     app.register_blueprint(users_bp)
+    app.register_blueprint(health_bp)
+    app.register_blueprint(jobs_bp)
+    if instrumented:
+        from app.routes.metrics import metrics_bp
+        app.register_blueprint(metrics_bp)
     
-    # Create database tables
+    # Check the schema version (default bind only; the replica follows the primary)
     with app.app_context():
-        db.create_all()
+        check_schema(app, db)
+    app.cli.add_command(db_cli)
+    app.cli.add_command(reservations_cli)
+    app.cli.add_command(jobs_cli)
     
     return app, login_manager
@@ -0,0 +1,258 @@
+"""Two-level cache for dashboard and accounting tiles.
+
+`cached(company_id, metric, compute, tags, max_age)` looks a value up in the
+process's LRU (`CACHE_MEMORY_SIZE` entries), then in the shared backend when
+`CACHE_BACKEND` is set, and calls `compute` on a miss:
+
+- `sqlite`: a cache file (`CACHE_PATH`) shared by the processes on one host
+- `redis://...`: any Redis-compatible server, for several hosts (needs the
+  `redis` package)
+- `package.module:ClassName`: constructed with the app; implements the
+  get/set/incr/mget subset of the Redis client that `SQLiteBackend` mimics
+
+Keys are per company and metric. Every entry records the versions of its
+tags ('sales', 'purchases', 'expenses', 'stock') when it was computed. Write
+paths call `invalidate(company_id, *tags)`; the tags are bumped once the
+session commits (nothing happens on rollback), which makes every entry
+carrying them a miss. Tag versions live in the shared backend, so one bump
+reaches every process; without a backend it only reaches the writer's
+process. `max_age` is the staleness bound on top of that: no entry is served
+once it is older, whether or not an invalidation arrived.
+
+A shared backend that fails is logged and treated as a miss; pages never
+fail because of the cache.
+"""
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from importlib import import_module
+from flask import current_app, has_app_context
+from sqlalchemy import event
+from app.replica import RoutingSession
+
+KEY_PREFIX = 'tiles:'
+
+
+class LRU:
+    """Thread-safe least-recently-used dict of at most `size` entries"""
+
+    def __init__(self, size):
+        self.size = size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key, entry):
+        if self.size <= 0:
+            return
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+
+class SQLiteBackend:
+    """Shared cache in a local SQLite file (CACHE_PATH), with Redis client semantics"""
+
+    def __init__(self, app):
+        self.path = app.config['CACHE_PATH']
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value BLOB, expires_at REAL)')
+            conn.execute('CREATE INDEX IF NOT EXISTS ix_cache_expires_at ON cache (expires_at)')
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        return _Transaction(conn)
+
+    def mget(self, keys):
+        if not keys:
+            return []
+        with self._connect() as conn:
+            rows = dict(conn.execute(
+                'SELECT key, value FROM cache WHERE key IN ({}) AND (expires_at IS NULL OR expires_at > ?)'.format(
+                    ', '.join('?' * len(keys))), (*keys, time.time())))
+        return [rows.get(key) for key in keys]
+
+    def get(self, key):
+        return self.mget([key])[0]
+
+    def set(self, key, value, ex=None):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute('DELETE FROM cache WHERE expires_at <= ?', (now,))
+            conn.execute('INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, ?)',
+                         (key, value, now + ex if ex else None))
+
+    def incr(self, key):
+        with self._connect() as conn:
+            conn.execute('INSERT INTO cache (key, value) VALUES (?, 1) '
+                         'ON CONFLICT (key) DO UPDATE SET value = CAST(value AS INTEGER) + 1', (key,))
+            return conn.execute('SELECT value FROM cache WHERE key = ?', (key,)).fetchone()[0]
+
+
+class _Transaction:
+    """BEGIN IMMEDIATE ... COMMIT around a block, then close the connection"""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute('BEGIN IMMEDIATE')
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            self.conn.execute('ROLLBACK' if exc_type else 'COMMIT')
+        finally:
+            self.conn.close()
+
+
+def _redis_backend(app):
+    import redis
+    return redis.Redis.from_url(app.config['CACHE_BACKEND'])
+
+
+def load_backend(app):
+    name = app.config.get('CACHE_BACKEND') or ''
+    if not name:
+        return None
+    if name == 'sqlite':
+        return SQLiteBackend(app)
+    if name.startswith(('redis://', 'rediss://', 'unix://')):
+        return _redis_backend(app)
+    module, _, attr = name.partition(':')
+    return getattr(import_module(module), attr)(app)
+
+
+class Cache:
+    """The LRU and shared backend of one app"""
+
+    def __init__(self, app):
+        self.memory = LRU(app.config.get('CACHE_MEMORY_SIZE', 1024))
+        self.shared = load_backend(app)
+        self.default_max_age = app.config.get('CACHE_TILE_MAX_AGE', 60)
+        self.logger = app.logger
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def _shared_call(self, method, *args, **kwargs):
+        try:
+            return getattr(self.shared, method)(*args, **kwargs)
+        except Exception as e:
+            self.logger.warning('Shared cache %s failed: %s', method, e)
+            raise _Unavailable() from e
+
+    def tag_versions(self, company_id, tags):
+        keys = [_tag_key(company_id, tag) for tag in tags]
+        if self.shared is None:
+            with self._lock:
+                versions = [self._versions.get(key, 0) for key in keys]
+        else:
+            versions = [int(v or 0) for v in self._shared_call('mget', keys)]
+        return tuple(zip(tags, versions))
+
+    def bump(self, company_id, tags):
+        for tag in tags:
+            key = _tag_key(company_id, tag)
+            if self.shared is None:
+                with self._lock:
+                    self._versions[key] = self._versions.get(key, 0) + 1
+            else:
+                try:
+                    self._shared_call('incr', key)
+                except _Unavailable:
+                    pass
+
+    def get_or_compute(self, company_id, metric, compute, tags=(), max_age=None):
+        max_age = self.default_max_age if max_age is None else max_age
+        key = f'{KEY_PREFIX}{company_id}:{metric}'
+        try:
+            versions = self.tag_versions(company_id, tags)
+        except _Unavailable:
+            return compute()
+
+        now = time.time()
+        entry = self.memory.get(key)
+        if entry is None and self.shared is not None:
+            try:
+                raw = self._shared_call('get', key)
+            except _Unavailable:
+                raw = None
+            if raw is not None:
+                entry = pickle.loads(raw)
+                self.memory.set(key, entry)
+        if entry is not None:
+            stored_at, stored_versions, value = entry
+            if stored_versions == versions and now - stored_at <= max_age:
+                return value
+
+        # Versions were read before computing, so a write committed meanwhile
+        # still makes this entry a miss next time
+        value = compute()
+        entry = (now, versions, value)
+        self.memory.set(key, entry)
+        if self.shared is not None and max_age > 0:
+            try:
+                self._shared_call('set', key, pickle.dumps(entry), ex=max(int(max_age), 1))
+            except _Unavailable:
+                pass
+        return value
+
+
+class _Unavailable(Exception):
+    pass
+
+
+def _tag_key(company_id, tag):
+    return f'{KEY_PREFIX}{company_id}:tag:{tag}'
+
+
+def get_cache(app=None):
+    app = app or current_app._get_current_object()
+    cache = app.extensions.get('cache')
+    if cache is None:
+        cache = app.extensions['cache'] = Cache(app)
+    return cache
+
+
+def cached(company_id, metric, compute, tags=(), max_age=None):
+    """`compute()` for a company's metric, served from cache while its tags are unchanged
+    and it is at most `max_age` seconds old (CACHE_TILE_MAX_AGE by default)"""
+    return get_cache().get_or_compute(company_id, metric, compute, tags, max_age)
+
+
+def invalidate(company_id, *tags):
+    """Drop the company's cached values carrying any of `tags` once the session commits"""
+    from app.models import db
+    db.session.info.setdefault('cache_tags', set()).update((company_id, tag) for tag in tags)
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _bump_on_commit(session_):
+    pending = session_.info.pop('cache_tags', None)
+    if not pending or not has_app_context():
+        return
+    cache = get_cache()
+    by_company = {}
+    for company_id, tag in pending:
+        by_company.setdefault(company_id, []).append(tag)
+    for company_id, tags in by_company.items():
+        cache.bump(company_id, sorted(tags))
+
+
+@event.listens_for(RoutingSession, 'after_transaction_end')
+def _forget_on_rollback(session_, transaction):
+    if transaction.parent is None:
+        session_.info.pop('cache_tags', None)
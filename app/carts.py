@@ -0,0 +1,100 @@
+"""Server-side POS carts that hold stock while a sale is rung up.
+
+Each line is priced from the product when it is added and holds its
+quantity through a stock reservation (app/reservations.py) until the cart
+expires (`CART_TTL` after its last change) or is checked out, so two
+terminals can't both sell the last strip. Checkout of a cart only commits
+lines that were validated as they were added.
+
+A line whose hold lapsed holds nothing; the next change to the cart
+re-reserves it before the holds are renewed.
+"""
+from datetime import datetime, timedelta
+from app.models import db, Cart, CartLine
+from app.reservations import lock_products, holds, drop_expired, reserve, renew, release
+
+CART_TTL = timedelta(minutes=15)
+HOLDER = 'cart'
+
+
+def open_cart(company_id, user_id=None):
+    cart = Cart(company_id=company_id, user_id=user_id, status='open', expires_at=datetime.utcnow() + CART_TTL)
+    db.session.add(cart)
+    db.session.flush()
+    return cart
+
+
+def get_cart(company_id, cart_id, lock=False):
+    query = Cart.query.filter_by(id=cart_id, company_id=company_id)
+    if lock:
+        query = query.with_for_update()
+    return query.first()
+
+
+def set_line(cart, product_id, quantity):
+    """Set the quantity of a product in the cart (0 removes it) and renew the holds"""
+    now = datetime.utcnow()
+    lines = {line.product_id: line for line in cart.lines}
+    held = holds(HOLDER, cart.id)
+    lapsed = {pid for pid in lines if pid not in held or held[pid].expires_at <= now}
+    # Lock every product whose hold changes, in id order like checkout
+    products = {p.id: p for p in lock_products(cart.company_id, lapsed | {product_id})}
+    product = products.get(product_id)
+    if product is None or (quantity > 0 and not product.is_active):
+        raise ValueError('Invalid product')
+    drop_expired(products.values(), now)
+    
+    expires_at = now + CART_TTL
+    for pid in sorted(products):
+        wanted = quantity if pid == product_id else lines[pid].quantity
+        reserve(products[pid], HOLDER, cart.id, max(wanted, 0), expires_at)
+    renew(HOLDER, cart.id, expires_at)
+    
+    line = lines.get(product_id)
+    if quantity <= 0:
+        if line is not None:
+            cart.lines.remove(line)
+    elif line is None:
+        cart.lines.append(CartLine(product=product, quantity=quantity, unit_price=product.selling_price,
+                                   tax_percentage=product.tax_percentage))
+    else:
+        line.quantity = quantity
+    cart.expires_at = expires_at
+    db.session.flush()
+
+
+def cart_holds(cart_id):
+    """Units the cart holds, by product id"""
+    return {pid: reservation.quantity for pid, reservation in holds(HOLDER, cart_id).items()}
+
+
+def release_cart(cart_id, products=()):
+    """Release the cart's holds; `products` are rows already locked by the caller"""
+    release(HOLDER, cart_id, products)
+
+
+def add_line(cart, product_id, quantity=1):
+    """Add units of a product to the cart"""
+    line = next((line for line in cart.lines if line.product_id == product_id), None)
+    set_line(cart, product_id, (line.quantity if line else 0) + quantity)
+
+
+def cart_payload(cart, include_tax=True):
+    subtotal = sum(line.unit_price * line.quantity for line in cart.lines)
+    tax_amount = sum(line.unit_price * line.quantity * (line.tax_percentage or 0) / 100
+                     for line in cart.lines) if include_tax else 0
+    return {
+        'id': cart.id,
+        'status': cart.status,
+        'expires_at': cart.expires_at.isoformat(),
+        'sale_id': cart.sale_id,
+        'lines': [{
+            'product_id': line.product_id,
+            'name': line.product.product_name,
+            'quantity': line.quantity,
+            'unit_price': line.unit_price,
+            'tax_percentage': line.tax_percentage,
+        } for line in cart.lines],
+        'subtotal': subtotal,
+        'tax_amount': tax_amount,
+    }
@@ -0,0 +1,103 @@
+"""Product catalog snapshots for the POS client.
+
+The POS page downloads the company's active products once and searches them
+in the browser. The snapshot is a compact row list (`CATALOG_FIELDS` order)
+served gzip-compressed with an ETag, so an unchanged catalog revalidates with
+a 304 instead of being re-sent.
+
+The catalog version is the newest `Product.updated_date`, which every stock,
+reservation, price or status change bumps (`onupdate`). Clients pass the version they hold
+to the changes endpoint and receive the rows updated since, plus the ids of
+products deactivated since. The window is widened by `DELTA_OVERLAP` so a
+transaction that committed late with an older timestamp is still picked up;
+clients apply rows as upserts, so repeats are harmless.
+"""
+import gzip
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from sqlalchemy import select, func, case
+from app.models import db, Product
+
+CATALOG_FIELDS = ('id', 'name', 'barcode', 'sku', 'price', 'mrp', 'tax_percentage', 'quantity', 'batch_number')
+DELTA_OVERLAP = timedelta(seconds=60)
+SNAPSHOT_CACHE_SIZE = 32
+
+# quantity is available to sell: on hand less reserved (app/reservations.py)
+_COLUMNS = (Product.id, Product.product_name, Product.barcode, Product.sku, Product.selling_price, Product.mrp,
+            Product.tax_percentage, Product.quantity - Product.reserved_quantity, Product.batch_number)
+
+_snapshots = OrderedDict()  # etag -> gzipped snapshot
+_lock = threading.Lock()
+
+
+def catalog_version(company_id):
+    """(newest updated_date, active product count) for the company"""
+    newest, count = db.session.execute(
+        select(func.max(Product.updated_date), func.count(case((Product.is_active == True, 1))))
+        .where(Product.company_id == company_id)
+    ).one()
+    return newest, count or 0
+
+
+def version_token(newest):
+    return newest.isoformat() if newest else ''
+
+
+def parse_version(token):
+    """Datetime for a version token, '' for an empty catalog, None when malformed"""
+    if token == '':
+        return ''
+    try:
+        return datetime.fromisoformat(token)
+    except (TypeError, ValueError):
+        return None
+
+
+def catalog_etag(company_id, newest, count):
+    digest = hashlib.sha1(f'{company_id}:{version_token(newest)}:{count}'.encode()).hexdigest()[:20]
+    return f'catalog-{digest}'
+
+
+def catalog_rows(company_id, since=None):
+    """Active product rows, optionally only those updated at or after `since`"""
+    query = select(*_COLUMNS).where(Product.company_id == company_id, Product.is_active == True)
+    if since:
+        query = query.where(Product.updated_date >= since - DELTA_OVERLAP)
+    return [list(row) for row in db.session.execute(query.order_by(Product.id))]
+
+
+def removed_ids(company_id, since):
+    """Ids of products deactivated at or after `since`"""
+    if not since:
+        return []
+    return db.session.execute(
+        select(Product.id).where(
+            Product.company_id == company_id,
+            Product.is_active == False,
+            Product.updated_date >= since - DELTA_OVERLAP
+        ).order_by(Product.id)
+    ).scalars().all()
+
+
+def snapshot(company_id, newest, count, etag):
+    """Gzipped JSON snapshot for this catalog version, built once per version"""
+    with _lock:
+        body = _snapshots.get(etag)
+        if body is not None:
+            _snapshots.move_to_end(etag)
+            return body
+    payload = {
+        'version': version_token(newest),
+        'count': count,
+        'fields': CATALOG_FIELDS,
+        'rows': catalog_rows(company_id),
+    }
+    body = gzip.compress(json.dumps(payload, separators=(',', ':')).encode(), compresslevel=6)
+    with _lock:
+        _snapshots[etag] = body
+        while len(_snapshots) > SNAPSHOT_CACHE_SIZE:
+            _snapshots.popitem(last=False)
+    return body
@@ -0,0 +1,199 @@
+"""Database engine profiles.
+
+`engine_options` picks pool settings for the configured backend and
+`init_engine` installs per-connection setup. For SQLite that means the
+`SQLITE_PRAGMAS` from config (WAL, busy timeout, cache sizing, foreign keys)
+and, for write requests, `BEGIN IMMEDIATE` so concurrent terminals queue on
+the busy timeout instead of failing with "database is locked" when a read
+transaction tries to upgrade to a write. Code outside a request (the job
+workers) asks for the same by setting `g.sqlite_write_lock`.
+
+For PostgreSQL it means a sized, pre-pinged, recycled pool per environment
+(`DB_POOL_*`), an `application_name` so sessions are identifiable in
+`pg_stat_activity`, and an optional `statement_timeout`. `copy_rows_from`
+and `copy_query_to` expose `COPY` for bulk loads and exports; callers keep
+a portable fallback for other backends.
+"""
+import csv
+import io
+from flask import g, request, has_app_context, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+READ_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+REPORTED_SQLITE_PRAGMAS = ('journal_mode', 'busy_timeout', 'synchronous', 'cache_size',
+                           'mmap_size', 'foreign_keys', 'temp_store', 'wal_autocheckpoint')
+
+
+def backend_name(uri):
+    return make_url(uri).get_backend_name()
+
+
+def is_memory_sqlite(uri):
+    url = make_url(uri)
+    return url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:')
+
+
+def engine_options(config):
+    """SQLALCHEMY_ENGINE_OPTIONS for the configured database, explicit settings win"""
+    uri = config['SQLALCHEMY_DATABASE_URI']
+    backend = backend_name(uri)
+    options = {}
+    if backend == 'postgresql':
+        connect_args = {'application_name': config.get('DB_APPLICATION_NAME', 'pharmacy')}
+        if config.get('DB_STATEMENT_TIMEOUT_MS'):
+            connect_args['options'] = '-c statement_timeout=%d' % config['DB_STATEMENT_TIMEOUT_MS']
+        options = {
+            'pool_size': config.get('DB_POOL_SIZE', 5),
+            'max_overflow': config.get('DB_MAX_OVERFLOW', 5),
+            'pool_timeout': config.get('DB_POOL_TIMEOUT', 30),
+            'pool_recycle': config.get('DB_POOL_RECYCLE', 1800),
+            'pool_pre_ping': config.get('DB_POOL_PRE_PING', True),
+            'connect_args': connect_args,
+        }
+    elif backend == 'sqlite' and not is_memory_sqlite(uri):
+        options = {
+            'pool_size': config.get('SQLITE_POOL_SIZE', 10),
+            'max_overflow': config.get('SQLITE_MAX_OVERFLOW', 10),
+            'pool_timeout': config.get('SQLITE_POOL_TIMEOUT', 30),
+            'connect_args': {
+                'timeout': config.get('SQLITE_PRAGMAS', {}).get('busy_timeout', 5000) / 1000.0,
+                'check_same_thread': False,
+            },
+        }
+    options.update(config.get('SQLALCHEMY_ENGINE_OPTIONS') or {})
+    return options
+
+
+def _wants_write_lock():
+    if has_app_context() and 'sqlite_write_lock' in g:
+        return g.sqlite_write_lock
+    return has_request_context() and request.method not in READ_METHODS
+
+
+def _install_sqlite_profile(engine, pragmas, memory, immediate_writes):
+    @event.listens_for(engine, 'connect')
+    def _on_connect(dbapi_connection, connection_record):
+        # Let SQLAlchemy's 'begin' event issue BEGIN instead of pysqlite
+        dbapi_connection.isolation_level = None
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            if memory and name in ('journal_mode', 'mmap_size'):
+                continue
+            cursor.execute(f'PRAGMA {name}={value}')
+        cursor.close()
+
+    @event.listens_for(engine, 'begin')
+    def _on_begin(connection):
+        if immediate_writes and _wants_write_lock():
+            connection.exec_driver_sql('BEGIN IMMEDIATE')
+        else:
+            connection.exec_driver_sql('BEGIN')
+
+
+def init_engine(app, engine):
+    """Install backend-specific connection setup on an engine"""
+    if engine.dialect.name == 'sqlite':
+        _install_sqlite_profile(
+            engine,
+            app.config.get('SQLITE_PRAGMAS', {}),
+            is_memory_sqlite(str(engine.url)),
+            app.config.get('SQLITE_IMMEDIATE_WRITES', True)
+        )
+
+
+def database_health(engine):
+    """Backend, pool status and effective connection settings"""
+    info = {'backend': engine.dialect.name, 'pool': engine.pool.status()}
+    with engine.connect() as conn:
+        if engine.dialect.name == 'sqlite':
+            info['pragmas'] = {
+                name: conn.exec_driver_sql(f'PRAGMA {name}').scalar()
+                for name in REPORTED_SQLITE_PRAGMAS
+            }
+        elif engine.dialect.name == 'postgresql':
+            info['server_version'] = conn.exec_driver_sql('SHOW server_version').scalar()
+            info['statement_timeout'] = conn.exec_driver_sql('SHOW statement_timeout').scalar()
+        else:
+            conn.exec_driver_sql('SELECT 1')
+    return info
+
+
+MAINTENANCE_STATEMENTS = {
+    'sqlite': {'analyze': ['ANALYZE', 'PRAGMA optimize'],
+               'vacuum': ['VACUUM', 'PRAGMA wal_checkpoint(TRUNCATE)']},
+    'postgresql': {'analyze': ['ANALYZE'], 'vacuum': ['VACUUM (ANALYZE)']},
+}
+
+
+def run_maintenance(engine, operation):
+    """Run 'analyze' or 'vacuum' for the backend, outside any transaction.
+
+    Returns the statements run (none on backends without an entry). On SQLite,
+    VACUUM waits for the write lock and rewrites the whole file.
+    """
+    statements = MAINTENANCE_STATEMENTS.get(engine.dialect.name, {}).get(operation, [])
+    if not statements:
+        return []
+    raw = engine.raw_connection()
+    driver = raw.driver_connection
+    postgres = engine.dialect.name == 'postgresql'
+    try:
+        if postgres:
+            driver.autocommit = True
+        cursor = raw.cursor()
+        for statement in statements:
+            cursor.execute(statement)
+        cursor.close()
+    finally:
+        if postgres:
+            driver.autocommit = False
+        raw.close()
+    return statements
+
+
+def supports_copy(session):
+    """True when the session's connection can run COPY (PostgreSQL via psycopg2)"""
+    bind = session.get_bind()
+    return bind.dialect.name == 'postgresql' and bind.dialect.driver == 'psycopg2'
+
+
+def _dbapi_cursor(session):
+    # The raw psycopg2 connection behind the session's current transaction
+    return session.connection().connection.dbapi_connection.cursor()
+
+
+def copy_rows_from(session, table, columns, rows):
+    """Bulk-load `rows` (sequences in `columns` order) into `table` with COPY FROM STDIN.
+
+    Runs inside the session's transaction, so it commits or rolls back with it.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow(['\\N' if value is None else value for value in row])
+    buffer.seek(0)
+    sql = "COPY {} ({}) FROM STDIN WITH (FORMAT csv, NULL '\\N')".format(
+        table, ', '.join(columns))
+    cursor = _dbapi_cursor(session)
+    try:
+        cursor.copy_expert(sql, buffer)
+    finally:
+        cursor.close()
+
+
+def copy_query_to(session, statement, out, header=None):
+    """Write the rows of a SQLAlchemy select to the binary file `out` as CSV via COPY TO STDOUT"""
+    compiled = statement.compile(dialect=session.get_bind().dialect,
+                                 compile_kwargs={'render_postcompile': True})
+    cursor = _dbapi_cursor(session)
+    try:
+        query = cursor.mogrify(str(compiled), compiled.params).decode()
+        if header:
+            line = io.StringIO()
+            csv.writer(line).writerow(header)
+            out.write(line.getvalue().encode())
+        cursor.copy_expert('COPY ({}) TO STDOUT WITH (FORMAT csv)'.format(query), out)
+    finally:
+        cursor.close()
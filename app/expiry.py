@@ -0,0 +1,140 @@
+"""Expiry buckets.
+
+`ProductExpiry` has one row per active product with an expiry date: the
+date, the days left and the bucket those fall in ('expired', '30', '60', '90'
+or 'later', see `bucket_for`). `ExpirySummary` counts each company's products
+per bucket, so the dashboard tiles are a single keyed lookup.
+
+Days left move every day, so each company is rebuilt once per (UTC) day by the
+scheduled `inventory.refresh_expiry` task, shortly after midnight. Between
+rebuilds, the write paths that change a product's expiry date or status
+(adding, editing, deleting, bulk imports, purchases, stock adjustments) call
+`refresh_products`, which replaces those products' rows and moves the summary
+counts by the difference. The expiry reports and alerts select products
+through these rows too (`expiring_products`), so a write path that skips the
+refresh hides its products from them until the next rebuild. Their
+thresholds are compared with `expiry_date`, so a stale `days_left` only
+affects the tiles.
+"""
+from collections import Counter
+from datetime import datetime, timedelta
+from sqlalchemy.exc import IntegrityError
+from app.models import db, Company, Product, ProductExpiry, ExpirySummary
+from app.jobs import task
+
+SUMMARY_COLUMNS = {'expired': 'expired', '30': 'within_30', '60': 'within_60', '90': 'within_90'}
+
+
+def bucket_for(days_left):
+    if days_left < 0:
+        return 'expired'
+    for limit in (30, 60, 90):
+        if days_left <= limit:
+            return str(limit)
+    return 'later'
+
+
+def _utc_today():
+    return datetime.utcnow().date()
+
+
+def _as_date(value):
+    return value.date() if isinstance(value, datetime) else value
+
+
+def _expiry_rows(company_id, product_ids=None, today=None):
+    query = db.session.query(Product.id, Product.expiry_date).filter(
+        Product.company_id == company_id,
+        Product.is_active == True,
+        Product.expiry_date.isnot(None)
+    )
+    if product_ids is not None:
+        query = query.filter(Product.id.in_(product_ids))
+    rows = []
+    for product_id, expiry_date in query:
+        expiry_date = _as_date(expiry_date)
+        days_left = (expiry_date - today).days
+        rows.append({'product_id': product_id, 'company_id': company_id, 'expiry_date': expiry_date,
+                     'days_left': days_left, 'bucket': bucket_for(days_left), 'as_of': today})
+    return rows
+
+
+def _store_summary(company_id, counts, today):
+    summary = db.session.get(ExpirySummary, company_id)
+    if summary is None:
+        summary = ExpirySummary(company_id=company_id)
+        db.session.add(summary)
+    for bucket, column in SUMMARY_COLUMNS.items():
+        setattr(summary, column, counts.get(bucket, 0))
+    summary.as_of = today
+
+
+def rebuild_company(company_id, today=None):
+    """Recompute every row and the summary of a company; the caller commits"""
+    today = today or _utc_today()
+    ProductExpiry.query.filter_by(company_id=company_id).delete(synchronize_session=False)
+    rows = _expiry_rows(company_id, today=today)
+    if rows:
+        db.session.execute(ProductExpiry.__table__.insert(), rows)
+    _store_summary(company_id, Counter(r['bucket'] for r in rows), today)
+    db.session.flush()
+
+
+def refresh_products(company_id, product_ids):
+    """Refresh the rows of products whose expiry date or status changed; the caller commits"""
+    product_ids = set(product_ids)
+    if not product_ids:
+        return
+    summary = db.session.get(ExpirySummary, company_id)
+    today = summary.as_of if summary else _utc_today()
+    old = Counter(bucket for (bucket,) in db.session.query(ProductExpiry.bucket).filter(
+        ProductExpiry.product_id.in_(product_ids)))
+    ProductExpiry.query.filter(ProductExpiry.product_id.in_(product_ids)).delete(synchronize_session=False)
+    rows = _expiry_rows(company_id, product_ids, today)
+    if rows:
+        db.session.execute(ProductExpiry.__table__.insert(), rows)
+    new = Counter(r['bucket'] for r in rows)
+
+    if summary is None:
+        # First change for this company: count everything once
+        try:
+            with db.session.begin_nested():
+                rebuild_company(company_id)
+        except IntegrityError:
+            pass
+        return
+    deltas = {getattr(ExpirySummary, column): getattr(ExpirySummary, column) + (new[bucket] - old[bucket])
+              for bucket, column in SUMMARY_COLUMNS.items() if new[bucket] != old[bucket]}
+    if deltas:
+        ExpirySummary.query.filter_by(company_id=company_id).update(deltas, synchronize_session=False)
+        db.session.expire(summary)
+
+
+def expiry_counts(company_id):
+    """{'expired', 'within_30', 'within_60', 'within_90'} for the dashboard tiles"""
+    summary = db.session.get(ExpirySummary, company_id)
+    if summary is not None:
+        return {column: getattr(summary, column) for column in SUMMARY_COLUMNS.values()}
+    return dict.fromkeys(SUMMARY_COLUMNS.values(), 0)
+
+
+def expiring_products(company_id, within_days):
+    """Active products expiring within `within_days` (including expired ones), soonest first"""
+    limit = _utc_today() + timedelta(days=within_days)
+    return Product.query.join(ProductExpiry, ProductExpiry.product_id == Product.id).filter(
+        ProductExpiry.company_id == company_id,
+        ProductExpiry.expiry_date <= limit
+    ).order_by(ProductExpiry.expiry_date, Product.id).all()
+
+
+@task('inventory.refresh_expiry')
+def refresh_expiry_job(ctx):
+    """Rebuild the companies whose buckets are from an earlier day"""
+    today = _utc_today()
+    current = {cid for (cid,) in db.session.query(ExpirySummary.company_id).filter(ExpirySummary.as_of >= today)}
+    company_ids = [cid for (cid,) in db.session.query(Company.id).order_by(Company.id) if cid not in current]
+    for i, company_id in enumerate(company_ids, start=1):
+        rebuild_company(company_id, today)
+        db.session.commit()
+        ctx.progress(100 * i // len(company_ids))
+    return {'message': f'Rebuilt expiry buckets for {len(company_ids)} companies.'}
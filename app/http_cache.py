@@ -0,0 +1,234 @@
+"""HTTP caching and compression.
+
+- Text responses (HTML, CSS, JS, JSON, CSV, SVG) of at least
+  `COMPRESS_MIN_SIZE` bytes are compressed with brotli when the `brotli`
+  package is installed and the client accepts it, gzip otherwise. A
+  compressed response's ETag gets a `-br`/`-gz` suffix, as the POS catalog's
+  does, and bodies with an ETag are compressed once per version.
+- Static files carry a strong ETag, the SHA-256 of their content.
+  `asset_url` adds that digest to the URL (`?v=`) and such URLs are cached for
+  a year (`STATIC_VERSIONED_MAX_AGE`); unversioned static files revalidate on
+  every use. Uploads are not static files: `/uploads` serves them to
+  logged-in users (app/uploads.py), and `static/uploads`, where they used to
+  live, answers 404.
+- Read-only pages answer conditional GETs: the view computes an ETag from the
+  `updated_date` of what it renders (`page_etag`), returns `not_modified(etag)`
+  when the client already has it and wraps the page in `revalidated`.
+- Third-party CSS/JS in `VENDOR_ASSETS` is served from `static/vendor` once
+  `flask assets vendor` has downloaded it; until then `vendor_url` keeps
+  pointing at the CDN.
+"""
+import gzip
+import hashlib
+import mimetypes
+import os
+import threading
+import urllib.request
+from collections import OrderedDict
+import click
+from flask import current_app, request, session, url_for, abort, send_file
+from flask.cli import AppGroup
+from flask_login import current_user
+from werkzeug.security import safe_join
+
+try:
+    import brotli
+except ImportError:  # optional: gzip only
+    brotli = None
+
+COMPRESSIBLE_MIMETYPES = {
+    'text/html', 'text/css', 'text/plain', 'text/csv', 'text/javascript', 'application/javascript',
+    'application/json', 'image/svg+xml',
+}
+ETAG_SUFFIXES = {'br': '-br', 'gzip': '-gz'}
+COMPRESSED_CACHE_SIZE = 64
+VENDOR_DIR = 'vendor'
+UPLOADS_DIR = 'uploads'
+
+assets_cli = AppGroup('assets', help='Static assets.')
+
+_digests = {}  # path -> (mtime_ns, size, sha256)
+_compressed = OrderedDict()  # (etag, encoding) -> body
+_lock = threading.Lock()
+
+
+def file_digest(path):
+    """SHA-256 of a file's content, recomputed only when its mtime or size changes"""
+    stat = os.stat(path)
+    with _lock:
+        cached = _digests.get(path)
+    if cached and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+        return cached[2]
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 16), b''):
+            sha.update(chunk)
+    digest = sha.hexdigest()
+    with _lock:
+        _digests[path] = (stat.st_mtime_ns, stat.st_size, digest)
+    return digest
+
+
+def _version(digest):
+    return digest[:12]
+
+
+def asset_url(filename):
+    """URL of a static file with its content version, cacheable for a year"""
+    path = safe_join(current_app.static_folder, filename)
+    if path is None or not os.path.isfile(path):
+        return url_for('static', filename=filename)
+    return url_for('static', filename=filename, v=_version(file_digest(path)))
+
+
+def vendor_url(name):
+    """Self-hosted copy of a VENDOR_ASSETS entry when downloaded, its CDN URL otherwise"""
+    filename = f'{VENDOR_DIR}/{name}'
+    if os.path.isfile(os.path.join(current_app.static_folder, filename)):
+        return asset_url(filename)
+    return current_app.config['VENDOR_ASSETS'][name]
+
+
+def _accepted_encoding():
+    if brotli is not None and 'br' in request.accept_encodings:
+        return 'br'
+    if 'gzip' in request.accept_encodings:
+        return 'gzip'
+    return None
+
+
+def _is_compressible(mimetype):
+    return mimetype in COMPRESSIBLE_MIMETYPES
+
+
+def not_modified(etag):
+    """A 304 response when the client's copy of a page matches `etag`, otherwise None"""
+    if session.get('_flashes'):
+        # The page would show (and consume) pending messages
+        return None
+    return _not_modified(etag, True)
+
+
+def _not_modified(etag, compressible):
+    encoding = _accepted_encoding() if compressible else None
+    variant = etag + ETAG_SUFFIXES.get(encoding, '')
+    if not request.if_none_match.contains(variant):
+        return None
+    response = current_app.response_class(status=304)
+    response.set_etag(variant)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    if compressible:
+        response.vary.add('Accept-Encoding')
+    return response
+
+
+def page_etag(template, *parts):
+    """ETag for a page rendered by `template` from `parts` (ids and updated dates)
+    for the current user; template edits change it too"""
+    source = current_app.jinja_env.get_template(template).filename
+    key = [template, os.path.getmtime(source) if source else '', current_user.get_id(),
+           getattr(current_user, 'role', ''), getattr(current_user, 'username', ''), *parts]
+    return hashlib.sha1('|'.join(map(str, key)).encode()).hexdigest()
+
+
+def revalidated(body, etag):
+    """Response for a page that browsers keep and revalidate with `etag` on every visit"""
+    response = current_app.make_response(body)
+    response.set_etag(etag)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+
+def serve_static(filename):
+    """Static files with content ETags, compression and cache lifetimes"""
+    path = safe_join(current_app.static_folder, filename)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+    if os.path.relpath(path, current_app.static_folder).split(os.sep)[0] == UPLOADS_DIR:
+        abort(404)
+    etag = file_digest(path)
+    mimetype = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+    compressible = _is_compressible(mimetype)
+
+    response = _not_modified(etag, compressible) if request.if_none_match else None
+    if response is None:
+        if compressible:
+            with open(path, 'rb') as f:
+                response = current_app.response_class(f.read(), mimetype=mimetype)
+            response.set_etag(etag)
+        else:
+            response = send_file(path, mimetype=mimetype, etag=etag, conditional=True)
+    response.cache_control.no_cache = None
+    response.cache_control.private = None
+    versioned = request.args.get('v') == _version(etag)
+    if versioned:
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+        response.cache_control.max_age = current_app.config['STATIC_VERSIONED_MAX_AGE']
+    else:
+        response.cache_control.public = True
+        response.cache_control.no_cache = True
+    return response
+
+
+def _compress(body, encoding, level):
+    if encoding == 'br':
+        return brotli.compress(body, quality=min(level, 11))
+    return gzip.compress(body, compresslevel=level)
+
+
+def compress_response(response):
+    """after_request: compress text responses for clients that accept it"""
+    if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+            or 'Content-Encoding' in response.headers or not _is_compressible(response.mimetype)):
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = _accepted_encoding()
+    if encoding is None:
+        return response
+    body = response.get_data()
+    if len(body) < current_app.config.get('COMPRESS_MIN_SIZE', 500):
+        return response
+
+    etag, weak = response.get_etag()
+    key = (etag, encoding) if etag and not weak else None
+    with _lock:
+        compressed = _compressed.get(key) if key else None
+    if compressed is None:
+        compressed = _compress(body, encoding, current_app.config.get('COMPRESS_LEVEL', 6))
+        if key:
+            with _lock:
+                _compressed[key] = compressed
+                while len(_compressed) > COMPRESSED_CACHE_SIZE:
+                    _compressed.popitem(last=False)
+    response.set_data(compressed)
+    response.headers['Content-Encoding'] = encoding
+    if etag:
+        response.set_etag(etag + ETAG_SUFFIXES[encoding], weak)
+    return response
+
+
+def init_http_cache(app):
+    """Serve static files through `serve_static`, compress responses, add the template helpers"""
+    app.view_functions['static'] = serve_static
+    app.after_request(compress_response)
+    app.jinja_env.globals.update(asset_url=asset_url, vendor_url=vendor_url)
+    app.cli.add_command(assets_cli)
+
+
+@assets_cli.command('vendor')
+def vendor_command():
+    """Download VENDOR_ASSETS into static/vendor so pages stop using the CDN."""
+    for name, url in current_app.config['VENDOR_ASSETS'].items():
+        target = os.path.join(current_app.static_folder, VENDOR_DIR, name)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        try:
+            with urllib.request.urlopen(url, timeout=60) as remote:
+                data = remote.read()
+        except OSError as e:
+            raise click.ClickException(f'{name}: {e}')
+        with open(target, 'wb') as f:
+            f.write(data)
+        click.echo(f'{name:<45} {len(data):>9} bytes')
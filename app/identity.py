@@ -0,0 +1,94 @@
+"""Cached identity for Flask-Login.
+
+`load_user` runs on every request. Instead of returning an ORM `User` (and
+then lazily loading `user.company` from templates) it returns a compact
+`Identity` built from one joined query and kept in a short-TTL process
+cache. Flask-Login already memoises the loaded user for the rest of the
+request, so a cache hit costs no queries at all.
+
+Write paths that change users or companies call `invalidate_user` /
+`invalidate_company`; other worker processes pick the change up when their
+entry expires (`IDENTITY_CACHE_TTL` seconds).
+"""
+import threading
+import time
+from flask import current_app
+from flask_login import UserMixin
+from app.models import db, User, Company
+
+DEFAULT_TTL = 30
+
+_cache = {}
+_lock = threading.Lock()
+
+
+class CompanyInfo:
+    """Company display fields needed on every page"""
+    __slots__ = ('id', 'company_name', 'logo_path', 'is_active')
+
+    def __init__(self, id, company_name, logo_path, is_active):
+        self.id = id
+        self.company_name = company_name
+        self.logo_path = logo_path
+        self.is_active = is_active
+
+
+class Identity(UserMixin):
+    """Read-only stand-in for the logged-in User.
+
+    Load the ORM `User` explicitly (`User.query.get(current_user.id)`) when
+    it has to be modified.
+    """
+
+    def __init__(self, id, company_id, role, username, active, last_login, company):
+        self.id = id
+        self.company_id = company_id
+        self.role = role
+        self.username = username
+        self.active = active
+        self.last_login = last_login
+        self.company = company
+
+    @property
+    def is_active(self):
+        return bool(self.active)
+
+
+def _fetch(user_id):
+    row = db.session.query(
+        User.id, User.company_id, User.role, User.username, User.is_active, User.last_login,
+        Company.company_name, Company.logo_path, Company.is_active.label('company_active')
+    ).outerjoin(Company, User.company_id == Company.id).filter(User.id == user_id).first()
+    if row is None:
+        return None
+    company = None
+    if row.company_name is not None:
+        company = CompanyInfo(row.company_id, row.company_name, row.logo_path, row.company_active)
+    return Identity(row.id, row.company_id, row.role, row.username, row.is_active, row.last_login, company)
+
+
+def load_identity(user_id):
+    """Identity for a user id, from the process cache when still fresh"""
+    ttl = current_app.config.get('IDENTITY_CACHE_TTL', DEFAULT_TTL)
+    now = time.monotonic()
+    with _lock:
+        entry = _cache.get(user_id)
+    if entry and entry[0] > now:
+        return entry[1]
+
+    identity = _fetch(user_id)
+    if identity is not None and ttl:
+        with _lock:
+            _cache[user_id] = (now + ttl, identity)
+    return identity
+
+
+def invalidate_user(user_id):
+    with _lock:
+        _cache.pop(user_id, None)
+
+
+def invalidate_company(company_id):
+    with _lock:
+        for user_id in [uid for uid, (_, ident) in _cache.items() if ident.company_id == company_id]:
+            del _cache[user_id]
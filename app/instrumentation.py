@@ -0,0 +1,246 @@
+"""Opt-in request and query instrumentation (`INSTRUMENTATION_ENABLED`).
+
+SQLAlchemy cursor events time every statement and Flask's request signals
+collect them per request. For each request this records:
+
+- the number of queries and total DB time
+- the slowest statements
+- the endpoint latency
+
+Totals are aggregated per endpoint in process memory and served at `/metrics`
+in Prometheus text format. Each gunicorn worker keeps its own counters, so
+scrape workers individually or sum them.
+
+A request that issues more than `QUERY_BUDGET` queries logs a warning with
+its slowest statements. When `SERVER_TIMING_HEADER` is set, responses also
+carry a `Server-Timing` header for the browser dev tools.
+"""
+import threading
+import time
+from flask import g, request, has_request_context, request_started, request_finished, got_request_exception
+from sqlalchemy import event
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+STATEMENT_PREVIEW = 300
+
+
+class EndpointStats:
+    """Accumulated counters for one endpoint"""
+    __slots__ = ('requests', 'errors', 'latency_sum', 'latency_buckets', 'queries', 'query_buckets',
+                 'db_time', 'over_budget', 'max_queries')
+
+    def __init__(self):
+        self.requests = {}  # (method, status) -> count
+        self.errors = 0
+        self.latency_sum = 0.0
+        self.latency_buckets = [0] * len(LATENCY_BUCKETS)
+        self.queries = 0
+        self.query_buckets = [0] * len(QUERY_COUNT_BUCKETS)
+        self.db_time = 0.0
+        self.over_budget = 0
+        self.max_queries = 0
+
+    @property
+    def count(self):
+        return sum(self.requests.values())
+
+
+_stats = {}
+_lock = threading.Lock()
+
+
+def _observe(buckets, bounds, value):
+    for i, bound in enumerate(bounds):
+        if value <= bound:
+            buckets[i] += 1
+
+
+# -- SQLAlchemy ----------------------------------------------------------
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    # SQLite's explicit BEGIN (app/database.py) is implicit on other backends; don't count it
+    if not statement.startswith('BEGIN'):
+        conn.info['_query_start'] = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.pop('_query_start', None)
+    if started is None or not has_request_context():
+        return
+    stats = g.get('_request_stats')
+    if stats is None:
+        return
+    elapsed = time.perf_counter() - started
+    stats['queries'] += 1
+    stats['db_time'] += elapsed
+    slowest = stats['slowest']
+    if len(slowest) < stats['keep'] or elapsed > slowest[-1][0]:
+        slowest.append((elapsed, statement[:STATEMENT_PREVIEW]))
+        slowest.sort(key=lambda s: s[0], reverse=True)
+        del slowest[stats['keep']:]
+
+
+def instrument_engine(engine):
+    event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+
+
+# -- Flask ---------------------------------------------------------------
+
+def _request_started(app, **extra):
+    g._request_stats = {
+        'start': time.perf_counter(),
+        'queries': 0,
+        'db_time': 0.0,
+        'slowest': [],
+        'keep': app.config.get('INSTRUMENTATION_SLOWEST', 3),
+    }
+
+
+def _request_failed(app, exception, **extra):
+    stats = g.get('_request_stats')
+    if stats is not None:
+        stats['error'] = True
+
+
+def _request_finished(app, response, **extra):
+    stats = g.pop('_request_stats', None)
+    endpoint = request.endpoint or 'unmatched'
+    if stats is None or endpoint == 'static':
+        return
+    latency = time.perf_counter() - stats['start']
+    record_request(endpoint, request.method, response.status_code, latency,
+                   stats['queries'], stats['db_time'], stats.get('error', False))
+
+    budget = app.config.get('QUERY_BUDGET', 0)
+    if budget and stats['queries'] > budget:
+        with _lock:
+            _stats[endpoint].over_budget += 1
+        app.logger.warning(
+            'Query budget exceeded: %s %s issued %d queries (budget %d), db %.1f ms, total %.1f ms; slowest: %s',
+            request.method, request.path, stats['queries'], budget, stats['db_time'] * 1000, latency * 1000,
+            ' | '.join(f'{elapsed * 1000:.1f} ms {sql!r}' for elapsed, sql in stats['slowest'])
+        )
+
+    if app.config.get('SERVER_TIMING_HEADER'):
+        response.headers['Server-Timing'] = 'db;dur={:.1f};desc="{} queries", app;dur={:.1f}'.format(
+            stats['db_time'] * 1000, stats['queries'], latency * 1000)
+
+
+def record_request(endpoint, method, status, latency, queries, db_time, error=False):
+    """Add one finished request to the per-endpoint counters"""
+    with _lock:
+        stats = _stats.get(endpoint)
+        if stats is None:
+            stats = _stats[endpoint] = EndpointStats()
+        key = (method, status)
+        stats.requests[key] = stats.requests.get(key, 0) + 1
+        stats.errors += 1 if error or status >= 500 else 0
+        stats.latency_sum += latency
+        _observe(stats.latency_buckets, LATENCY_BUCKETS, latency)
+        stats.queries += queries
+        _observe(stats.query_buckets, QUERY_COUNT_BUCKETS, queries)
+        stats.db_time += db_time
+        stats.max_queries = max(stats.max_queries, queries)
+
+
+def reset_stats():
+    with _lock:
+        _stats.clear()
+
+
+def endpoint_summary():
+    """Per-endpoint averages, heaviest first (for logs and ad-hoc inspection)"""
+    with _lock:
+        rows = [{
+            'endpoint': endpoint,
+            'requests': s.count,
+            'avg_queries': s.queries / s.count if s.count else 0,
+            'max_queries': s.max_queries,
+            'avg_db_ms': s.db_time * 1000 / s.count if s.count else 0,
+            'avg_latency_ms': s.latency_sum * 1000 / s.count if s.count else 0,
+            'over_budget': s.over_budget,
+        } for endpoint, s in _stats.items()]
+    return sorted(rows, key=lambda r: r['avg_queries'], reverse=True)
+
+
+# -- Prometheus ----------------------------------------------------------
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _histogram(lines, name, labels, bounds, buckets, total, count):
+    for bound, value in zip(bounds, buckets):
+        lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {value}')
+    lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {count}')
+    lines.append(f'{name}_sum{{{labels}}} {total}')
+    lines.append(f'{name}_count{{{labels}}} {count}')
+
+
+def render_metrics(engines=None):
+    """All counters in Prometheus text exposition format"""
+    with _lock:
+        snapshot = sorted(((endpoint, {
+            'requests': dict(s.requests),
+            'count': s.count,
+            'errors': s.errors,
+            'latency_sum': s.latency_sum,
+            'latency_buckets': list(s.latency_buckets),
+            'queries': s.queries,
+            'query_buckets': list(s.query_buckets),
+            'db_time': s.db_time,
+            'over_budget': s.over_budget,
+        }) for endpoint, s in _stats.items()), key=lambda item: item[0])
+
+    lines = ['# HELP pharmacy_http_requests_total Finished HTTP requests.',
+             '# TYPE pharmacy_http_requests_total counter']
+    for endpoint, data in snapshot:
+        for (method, status), value in sorted(data['requests'].items()):
+            lines.append(f'pharmacy_http_requests_total{{endpoint="{_label(endpoint)}",method="{method}",'
+                         f'status="{status}"}} {value}')
+
+    def per_endpoint(name, kind, help_text, key):
+        lines.extend([f'# HELP {name} {help_text}', f'# TYPE {name} {kind}'])
+        for endpoint, data in snapshot:
+            lines.append(f'{name}{{endpoint="{_label(endpoint)}"}} {data[key]}')
+
+    per_endpoint('pharmacy_http_request_errors_total', 'counter', 'Requests that raised or returned 5xx.', 'errors')
+
+    lines += ['# HELP pharmacy_http_request_duration_seconds Request latency.',
+              '# TYPE pharmacy_http_request_duration_seconds histogram']
+    for endpoint, data in snapshot:
+        _histogram(lines, 'pharmacy_http_request_duration_seconds', f'endpoint="{_label(endpoint)}"',
+                   LATENCY_BUCKETS, data['latency_buckets'], data['latency_sum'], data['count'])
+
+    lines += ['# HELP pharmacy_db_queries_per_request SQL statements issued per request.',
+              '# TYPE pharmacy_db_queries_per_request histogram']
+    for endpoint, data in snapshot:
+        _histogram(lines, 'pharmacy_db_queries_per_request', f'endpoint="{_label(endpoint)}"',
+                   QUERY_COUNT_BUCKETS, data['query_buckets'], data['queries'], data['count'])
+
+    per_endpoint('pharmacy_db_time_seconds_total', 'counter', 'Time spent executing SQL.', 'db_time')
+    per_endpoint('pharmacy_query_budget_exceeded_total', 'counter', 'Requests over QUERY_BUDGET.', 'over_budget')
+
+    if engines:
+        lines += ['# HELP pharmacy_db_pool_checked_out Connections currently checked out.',
+                  '# TYPE pharmacy_db_pool_checked_out gauge']
+        for bind, engine in engines.items():
+            checked_out = getattr(engine.pool, 'checkedout', None)
+            if checked_out is not None:
+                lines.append(f'pharmacy_db_pool_checked_out{{bind="{_label(bind or "default")}"}} {checked_out()}')
+    return '\n'.join(lines) + '\n'
+
+
+def init_instrumentation(app, db):
+    """Hook engine events and request signals when INSTRUMENTATION_ENABLED is set"""
+    if not app.config.get('INSTRUMENTATION_ENABLED'):
+        return False
+    with app.app_context():
+        for engine in db.engines.values():
+            instrument_engine(engine)
+    request_started.connect(_request_started, app)
+    request_finished.connect(_request_finished, app)
+    got_request_exception.connect(_request_failed, app)
+    return True
@@ -0,0 +1,253 @@
+"""Background jobs.
+
+Long-running work (bulk imports, exports, PDF rendering, alert generation)
+runs in worker processes instead of web requests:
+
+    job = enqueue('inventory.import_products', company_id=..., user_id=..., path=...)
+
+adds a `Job` row and publishes it to the broker (app/jobs/brokers.py).
+`flask jobs work` starts a pool of worker processes (app/jobs/worker.py)
+that claim jobs, run the registered task and record progress, result and
+errors on the row, which `/jobs/<id>` reports. A task that raises is retried
+with exponential backoff until it has run `max_attempts` times; raising
+`JobFailed` fails the job at once.
+
+Tasks are functions registered with `@task(name)`. They run in an app
+context, take a `JobContext` plus the job's keyword arguments, and return a
+JSON-serialisable result; `ctx.save_file` stores a file for download. Any GET
+view can be moved onto a job with `@background_view`: requesting it with
+`?background=1` renders it in a worker and sends the browser to the job page.
+
+With `JOBS_INLINE` (the testing config) jobs run synchronously at enqueue.
+"""
+import json
+import mimetypes
+import os
+import traceback
+from datetime import datetime, timedelta
+from functools import wraps
+from urllib.parse import urlencode
+from flask import current_app, g, request, redirect, url_for
+from flask_login import current_user, login_user
+from sqlalchemy import or_, and_
+from werkzeug.http import parse_options_header
+from werkzeug.utils import secure_filename
+from app.models import db, Job
+from app.jobs.brokers import load_broker
+
+TASKS = {}
+RETRY_BACKOFF_SECONDS = 30
+
+
+class JobFailed(Exception):
+    """Raised by a task to fail its job without retrying"""
+
+
+def task(name, max_attempts=3):
+    """Register a task function under `name`"""
+    def decorator(f):
+        TASKS[name] = (f, max_attempts)
+        return f
+    return decorator
+
+
+class JobContext:
+    """Handed to a running task"""
+
+    def __init__(self, job, broker=None):
+        self.job = job
+        self.broker = broker
+
+    def progress(self, percent, message=None):
+        """Record progress; this commits the session, so call it between units of work"""
+        self.job.progress = int(max(0, min(percent, 100)))
+        if message is not None:
+            self.job.message = message[:255]
+        db.session.commit()
+        if self.broker is not None:
+            self.broker.touch(self.job.id)
+
+    def save_file(self, filename, data):
+        """Store the job's downloadable result"""
+        folder = os.path.join(current_app.config['JOB_FILES_FOLDER'], str(self.job.id))
+        os.makedirs(folder, exist_ok=True)
+        path = os.path.join(folder, secure_filename(filename) or 'result')
+        with open(path, 'wb') as f:
+            f.write(data)
+        self.job.result_file = path
+        return path
+
+
+def get_broker(app=None):
+    app = app or current_app._get_current_object()
+    broker = app.extensions.get('jobs')
+    if broker is None:
+        broker = app.extensions['jobs'] = load_broker(app)
+    return broker
+
+
+def enqueue(name, company_id=None, user_id=None, unique_key=None, run_after=None, **kwargs):
+    """Create a job for task `name` and publish it
+
+    With `unique_key`, a queued or running job with the same key is returned
+    instead of creating another one.
+    """
+    if name not in TASKS:
+        raise KeyError(f'Unknown task {name}')
+    if unique_key:
+        existing = Job.query.filter(Job.unique_key == unique_key, Job.status.in_(('queued', 'running'))).first()
+        if existing is not None:
+            return existing
+    job = Job(task=name, company_id=company_id, user_id=user_id, unique_key=unique_key, args=json.dumps(kwargs),
+              max_attempts=TASKS[name][1], run_after=run_after or datetime.utcnow())
+    db.session.add(job)
+    db.session.flush()
+    job_id, run_after = job.id, job.run_after
+    db.session.commit()
+
+    app = current_app._get_current_object()
+    if app.config.get('JOBS_INLINE'):
+        # A fresh app context gets its own session, as a worker would; the
+        # caller's session must stay out of a transaction until it's done
+        with app.app_context():
+            for _ in range(TASKS[name][1]):
+                if run_job(job_id) != 'queued':
+                    break
+    else:
+        get_broker(app).publish(job_id, run_after)
+    return job
+
+
+def run_job(job_id, broker=None):
+    """Run a claimed job; returns its new status, or None if it couldn't be started"""
+    now = datetime.utcnow()
+    stale = now - timedelta(seconds=current_app.config['JOB_VISIBILITY_TIMEOUT'])
+    started = Job.query.filter(
+        Job.id == job_id,
+        or_(Job.status == 'queued', and_(Job.status == 'running', Job.updated_date < stale))
+    ).update({Job.status: 'running', Job.attempts: Job.attempts + 1, Job.started_date: now,
+              Job.updated_date: now}, synchronize_session=False)
+    db.session.commit()
+    job = db.session.get(Job, job_id)
+    if not started:
+        # Finished, deleted or running elsewhere; a live claim is acked by its own worker
+        if broker is not None and (job is None or job.status != 'running'):
+            broker.ack(job_id)
+        return None
+
+    func = TASKS.get(job.task, (None, None))[0]
+    try:
+        if func is None:
+            raise JobFailed(f'Unknown task {job.task}')
+        result = func(JobContext(job, broker), **json.loads(job.args or '{}'))
+        job = db.session.get(Job, job_id)
+        job.status = 'succeeded'
+        job.progress = 100
+        job.result = json.dumps(result) if result is not None else None
+        job.error = None
+        job.finished_date = datetime.utcnow()
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        job = db.session.get(Job, job_id)
+        job.error = traceback.format_exc()[-4000:]
+        if not isinstance(e, JobFailed) and job.attempts < job.max_attempts:
+            job.status = 'queued'
+            job.run_after = datetime.utcnow() + timedelta(seconds=RETRY_BACKOFF_SECONDS * 2 ** (job.attempts - 1))
+            job.message = f'Retrying after error: {e}'[:255]
+        else:
+            job.status = 'failed'
+            job.finished_date = datetime.utcnow()
+            job.message = str(e)[:255]
+        db.session.commit()
+        current_app.logger.warning('Job %s (%s) attempt %s failed: %s', job.id, job.task, job.attempts, e)
+        if job.status == 'queued':
+            if broker is not None:
+                broker.publish(job.id, job.run_after)
+            return job.status
+    if broker is not None:
+        broker.ack(job_id)
+    return job.status
+
+
+def purge_jobs(older_than):
+    """Delete finished jobs (and their files) finished before `older_than`"""
+    jobs = Job.query.filter(Job.status.in_(('succeeded', 'failed')), Job.finished_date < older_than).all()
+    for job in jobs:
+        if job.result_file and os.path.exists(job.result_file):
+            os.remove(job.result_file)
+            try:
+                os.rmdir(os.path.dirname(job.result_file))
+            except OSError:
+                pass
+        db.session.delete(job)
+    db.session.commit()
+    return len(jobs)
+
+
+def job_payload(job):
+    result = json.loads(job.result) if job.result else None
+    next_endpoint = result.get('next') if isinstance(result, dict) else None
+    return {
+        'id': job.id,
+        'task': job.task,
+        'status': job.status,
+        'progress': job.progress or 0,
+        'message': job.message,
+        'attempts': job.attempts,
+        'max_attempts': job.max_attempts,
+        'result': result,
+        'download_url': url_for('jobs.download', job_id=job.id) if job.result_file else None,
+        'next_url': url_for(next_endpoint) if next_endpoint else None,
+        'created': job.created_date.isoformat() if job.created_date else None,
+        'started': job.started_date.isoformat() if job.started_date else None,
+        'finished': job.finished_date.isoformat() if job.finished_date else None,
+    }
+
+
+def background_view(f):
+    """Let a GET view run as a job: `?background=1` enqueues it and redirects to the job page"""
+    @wraps(f)
+    def wrapped(*args, **kwargs):
+        if not request.args.get('background'):
+            return f(*args, **kwargs)
+        params = request.args.to_dict(flat=False)
+        params.pop('background')
+        path = request.path + ('?' + urlencode(params, doseq=True) if params else '')
+        job = enqueue('views.render', company_id=current_user.company_id, user_id=current_user.id,
+                      unique_key=f'view:{current_user.id}:{path}'[:255], path=path)
+        return redirect(url_for('jobs.job_page', job_id=job.id))
+    return wrapped
+
+
+@task('views.render', max_attempts=2)
+def render_view(ctx, path):
+    """Render a GET view as the job's user and keep the response as the job's file"""
+    from app.identity import load_identity
+    app = current_app._get_current_object()
+    # No user: deleted since the job was queued
+    identity = load_identity(ctx.job.user_id) if ctx.job.user_id is not None else None
+    if identity is None or not identity.is_active:
+        raise JobFailed('User is no longer active')
+    # The view reads in its own transaction, without the worker's write lock
+    db.session.commit()
+    write_lock = g.pop('sqlite_write_lock', None)
+    try:
+        with app.test_request_context(path):
+            login_user(identity)
+            response = app.full_dispatch_request()
+            response.direct_passthrough = False  # send_file responses
+            data = response.get_data()
+    finally:
+        if write_lock is not None:
+            g.sqlite_write_lock = write_lock
+        db.session.commit()
+    if response.status_code != 200:
+        raise JobFailed(f'The page returned status {response.status_code}')
+    filename = parse_options_header(response.headers.get('Content-Disposition', ''))[1].get('filename')
+    if not filename:
+        base = path.split('?')[0].rstrip('/').rsplit('/', 1)[-1] or 'result'
+        filename = base + (mimetypes.guess_extension(response.mimetype) or '')
+    ctx.save_file(filename, data)
+    return {'filename': filename, 'mimetype': response.mimetype, 'size': len(data)}
+
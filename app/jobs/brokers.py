@@ -0,0 +1,136 @@
+"""Job brokers: how workers find the next job to run.
+
+The `job` table is the record of every job; a broker only hands job ids to
+workers. A claim that isn't acknowledged within the visibility timeout
+(a worker died mid-job) is handed out again, and `run_job` only starts a
+job it can move from queued (or stale running) to running, so a job never
+runs twice at once.
+
+- `SQLiteBroker` (default): a queue in a local SQLite file, for a single
+  host running the web and worker processes. Needs no outside service.
+- `DatabaseBroker`: polls the job table in the application database, for
+  workers on several hosts sharing a PostgreSQL database.
+
+Other brokers plug in through `JOB_BROKER = 'package.module:ClassName'`;
+they are constructed with the app and implement publish/claim/touch/ack.
+"""
+import os
+import sqlite3
+import time
+from datetime import datetime, timedelta
+from importlib import import_module
+from sqlalchemy import or_
+
+
+class Broker:
+    """Interface every broker implements"""
+
+    def __init__(self, app):
+        self.visibility_timeout = app.config.get('JOB_VISIBILITY_TIMEOUT', 300)
+
+    def publish(self, job_id, run_after=None):
+        """Make a job available to workers at run_after (a naive UTC datetime) or now"""
+        raise NotImplementedError
+
+    def claim(self, worker):
+        """Id of the next available job, now claimed by `worker`, or None"""
+        raise NotImplementedError
+
+    def touch(self, job_id):
+        """Extend the claim on a running job"""
+
+    def ack(self, job_id):
+        """Forget a job that finished or was rescheduled"""
+
+
+class SQLiteBroker(Broker):
+    """Queue in a local SQLite file (JOB_BROKER_PATH)"""
+
+    def __init__(self, app):
+        super().__init__(app)
+        self.path = app.config['JOB_BROKER_PATH']
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS job_queue (job_id INTEGER PRIMARY KEY, '
+                         'available_at REAL NOT NULL, claimed_by TEXT, claimed_at REAL)')
+            conn.execute('CREATE INDEX IF NOT EXISTS ix_job_queue_available ON job_queue (available_at)')
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        return _Transaction(conn)
+
+    def publish(self, job_id, run_after=None):
+        available_at = time.time()
+        if run_after is not None:
+            available_at += max((run_after - datetime.utcnow()).total_seconds(), 0)
+        with self._connect() as conn:
+            conn.execute('INSERT OR REPLACE INTO job_queue (job_id, available_at) VALUES (?, ?)',
+                         (job_id, available_at))
+
+    def claim(self, worker):
+        now = time.time()
+        with self._connect() as conn:
+            row = conn.execute(
+                'SELECT job_id FROM job_queue WHERE available_at <= ? AND '
+                '(claimed_at IS NULL OR claimed_at < ?) ORDER BY available_at LIMIT 1',
+                (now, now - self.visibility_timeout)).fetchone()
+            if row is None:
+                return None
+            conn.execute('UPDATE job_queue SET claimed_by = ?, claimed_at = ? WHERE job_id = ?',
+                         (worker, now, row[0]))
+            return row[0]
+
+    def touch(self, job_id):
+        with self._connect() as conn:
+            conn.execute('UPDATE job_queue SET claimed_at = ? WHERE job_id = ?', (time.time(), job_id))
+
+    def ack(self, job_id):
+        with self._connect() as conn:
+            conn.execute('DELETE FROM job_queue WHERE job_id = ?', (job_id,))
+
+
+class _Transaction:
+    """BEGIN IMMEDIATE ... COMMIT around a block, then close the connection"""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute('BEGIN IMMEDIATE')
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            self.conn.execute('ROLLBACK' if exc_type else 'COMMIT')
+        finally:
+            self.conn.close()
+
+
+class DatabaseBroker(Broker):
+    """Workers poll the job table itself; publish and ack are no-ops"""
+
+    def publish(self, job_id, run_after=None):
+        pass
+
+    def claim(self, worker):
+        from app.models import db, Job
+        now = datetime.utcnow()
+        stale = now - timedelta(seconds=self.visibility_timeout)
+        job_id = db.session.query(Job.id).filter(or_(
+            (Job.status == 'queued') & (Job.run_after <= now),
+            (Job.status == 'running') & (Job.updated_date < stale)
+        )).order_by(Job.run_after, Job.id).limit(1).with_for_update(skip_locked=True).scalar()
+        db.session.commit()
+        return job_id
+
+
+BROKERS = {'sqlite': SQLiteBroker, 'database': DatabaseBroker}
+
+
+def load_broker(app):
+    name = app.config.get('JOB_BROKER') or 'sqlite'
+    if name in BROKERS:
+        return BROKERS[name](app)
+    module, _, attr = name.partition(':')
+    return getattr(import_module(module), attr)(app)
@@ -0,0 +1,54 @@
+"""`flask jobs ...` commands for the background job workers"""
+import os
+from datetime import datetime, timedelta
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from app.models import Job
+from app.jobs import purge_jobs, maintenance  # noqa: F401 (registers the scheduled tasks)
+from app.jobs.scheduler import next_runs
+from app.jobs.worker import run_pool
+
+jobs_cli = AppGroup('jobs', help='Background jobs.')
+
+
+@jobs_cli.command('work')
+@click.option('--processes', '-p', type=int, default=2, show_default=True, help='Worker processes.')
+@click.option('--poll', 'poll_interval', type=float, default=1.0, show_default=True,
+              help='Seconds to wait when the queue is empty.')
+@click.option('--burst', is_flag=True, help='Exit once the queue is empty.')
+def work_command(processes, poll_interval, burst):
+    """Run job workers."""
+    run_pool(os.environ.get('FLASK_ENV', 'development'), processes, poll_interval, burst, log=click.echo)
+
+
+@jobs_cli.command('list')
+@click.option('--limit', type=int, default=20, show_default=True)
+def list_command(limit):
+    """Show the most recent jobs."""
+    for job in Job.query.order_by(Job.id.desc()).limit(limit):
+        click.echo(f'{job.id:>6}  {job.status:<9}  {job.progress or 0:>3}%  {job.task}  {job.message or ""}')
+
+
+@jobs_cli.command('purge')
+@click.option('--days', type=int, default=None, help='Keep jobs finished in the last DAYS days.')
+def purge_command(days):
+    """Delete old finished jobs and their files."""
+    days = current_app.config['JOB_RETENTION_DAYS'] if days is None else days
+    click.echo(f'Deleted {purge_jobs(datetime.utcnow() - timedelta(days=days))} job(s).')
+
+
+@jobs_cli.command('schedule')
+def schedule_command():
+    """Show the scheduled tasks and when they run next."""
+    for name, spec, next_run in next_runs(current_app):
+        click.echo(f'{name:<28} {spec:<16} next {next_run:%Y-%m-%d %H:%M}')
+
+
+@jobs_cli.command('enqueue')
+@click.argument('task_name')
+def enqueue_command(task_name):
+    """Queue a task now, e.g. one from the schedule."""
+    from app.jobs import enqueue
+    job = enqueue(task_name)
+    click.echo(f'Queued job {job.id} ({job.status}).')
@@ -0,0 +1,47 @@
+"""Maintenance tasks run by the scheduler (`JOB_SCHEDULE`)"""
+from datetime import datetime, timedelta
+from flask import current_app
+from app.models import db, Company
+from app.database import run_maintenance
+from app.stock import take_snapshot
+from app.jobs import task, purge_jobs
+
+
+def _company_ids():
+    return [cid for (cid,) in db.session.query(Company.id).order_by(Company.id)]
+
+
+@task('inventory.snapshot_stock')
+def snapshot_stock_job(ctx):
+    """Fold the day's stock movements into a snapshot run for every company"""
+    company_ids = _company_ids()
+    rows = 0
+    for i, company_id in enumerate(company_ids, start=1):
+        rows += take_snapshot(company_id)
+        ctx.progress(100 * i // len(company_ids))
+    return {'message': f'Wrote {rows} snapshot row(s) for {len(company_ids)} companies.'}
+
+
+def _maintenance(operation):
+    # End the job's own transaction: VACUUM needs the database to itself
+    db.session.commit()
+    return {'statements': run_maintenance(db.engine, operation)}
+
+
+@task('maintenance.analyze', max_attempts=1)
+def analyze_job(ctx):
+    """Refresh the query planner's statistics"""
+    return _maintenance('analyze')
+
+
+@task('maintenance.vacuum', max_attempts=1)
+def vacuum_job(ctx):
+    """Reclaim space left by deleted rows"""
+    return _maintenance('vacuum')
+
+
+@task('jobs.purge', max_attempts=1)
+def purge_jobs_job(ctx):
+    """Delete finished jobs past their retention"""
+    days = current_app.config['JOB_RETENTION_DAYS']
+    return {'message': f'Deleted {purge_jobs(datetime.utcnow() - timedelta(days=days))} job(s).'}
@@ -0,0 +1,118 @@
+"""Cron-style schedule for maintenance jobs.
+
+`JOB_SCHEDULE` maps task names to five-field cron specs (minute hour
+day-of-month month day-of-week, in server local time; `*`, lists, ranges and
+`*/n` steps). Every job worker calls `run_due` about every
+`SCHEDULER_INTERVAL` seconds, and each due slot is enqueued exactly once: a
+worker claims it by moving the task's `JobSchedule.last_run_at` forward with a
+compare-and-set UPDATE, so one leader per slot is elected through the
+database however many workers or hosts are running.
+
+A task first seen by the scheduler starts counting from that moment. After
+downtime, only the latest missed slot runs, once.
+"""
+from datetime import datetime, timedelta
+from sqlalchemy.exc import IntegrityError
+from app.models import db, JobSchedule
+from app.jobs import enqueue
+
+SCHEDULER_INTERVAL = 30
+FIELD_RANGES = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+
+
+def _parse_field(spec, low, high):
+    values = set()
+    for part in spec.split(','):
+        step = 1
+        if '/' in part:
+            part, step = part.split('/', 1)
+            step = int(step)
+        if part == '*':
+            start, end = low, high
+        elif '-' in part:
+            start, end = (int(v) for v in part.split('-', 1))
+        else:
+            start = end = int(part)
+            if step > 1:
+                end = high
+        if start < low or end > high or start > end or step < 1:
+            raise ValueError(f'Cron field {spec!r} out of range {low}-{high}')
+        values.update(range(start, end + 1, step))
+    return values
+
+
+class Cron:
+    """A parsed five-field cron spec"""
+
+    def __init__(self, spec):
+        fields = spec.split()
+        if len(fields) != 5:
+            raise ValueError(f'Cron spec {spec!r} needs 5 fields')
+        self.minutes, self.hours, self.days, self.months, weekdays = (
+            _parse_field(field, low, high) for field, (low, high) in zip(fields, FIELD_RANGES))
+        # Sunday is 0 or 7
+        self.weekdays = {d % 7 for d in weekdays}
+        self.any_day = fields[2] == '*'
+        self.any_weekday = fields[4] == '*'
+
+    def _day_matches(self, t):
+        day = t.day in self.days
+        weekday = (t.weekday() + 1) % 7 in self.weekdays
+        if self.any_day or self.any_weekday:
+            return day and weekday
+        # Both restricted: either matches, as in cron
+        return day or weekday
+
+    def next_after(self, t):
+        """The first matching minute after `t`"""
+        t = t.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = t + timedelta(days=366 * 5)
+        while t < limit:
+            if t.month not in self.months or not self._day_matches(t):
+                t = t.replace(hour=0, minute=0) + timedelta(days=1)
+            elif t.hour not in self.hours:
+                t = t.replace(minute=0) + timedelta(hours=1)
+            elif t.minute not in self.minutes:
+                t += timedelta(minutes=1)
+            else:
+                return t
+        raise ValueError('Cron spec never matches')
+
+
+def run_due(app, now=None):
+    """Enqueue the scheduled tasks that are due; returns their names"""
+    now = now or datetime.now()
+    enqueued = []
+    for name, spec in (app.config.get('JOB_SCHEDULE') or {}).items():
+        cron = Cron(spec)
+        entry = db.session.get(JobSchedule, name)
+        if entry is None:
+            try:
+                db.session.add(JobSchedule(name=name, last_run_at=now.replace(second=0, microsecond=0)))
+                db.session.commit()
+            except IntegrityError:
+                db.session.rollback()
+            continue
+        previous = entry.last_run_at
+        slot = cron.next_after(previous)
+        if slot > now:
+            continue
+        while (following := cron.next_after(slot)) <= now:
+            slot = following
+        claimed = JobSchedule.query.filter_by(name=name, last_run_at=previous).update(
+            {JobSchedule.last_run_at: slot}, synchronize_session=False)
+        db.session.commit()
+        if claimed:
+            enqueue(name, unique_key=f'schedule:{name}')
+            enqueued.append(name)
+    return enqueued
+
+
+def next_runs(app, now=None):
+    """[(task, spec, next run)] for the configured schedule"""
+    now = now or datetime.now()
+    runs = []
+    for name, spec in (app.config.get('JOB_SCHEDULE') or {}).items():
+        entry = db.session.get(JobSchedule, name)
+        runs.append((name, spec, Cron(spec).next_after(entry.last_run_at if entry else now)))
+    return runs
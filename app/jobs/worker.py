@@ -0,0 +1,83 @@
+"""Worker processes for background jobs.
+
+`run_pool` starts `processes` worker processes (spawned, so each builds its
+own app, engine and broker connection) and restarts any that die. Each worker
+claims a job from the broker, runs it and claims the next; when the queue is
+empty it sleeps `poll_interval` seconds. With `burst` the workers exit once
+the queue is empty instead. Every worker also enqueues the scheduled tasks
+that are due (app/jobs/scheduler.py) about every `SCHEDULER_INTERVAL` seconds.
+"""
+import multiprocessing
+import os
+import socket
+import time
+from flask import g
+
+
+def work(app, worker, poll_interval=1.0, burst=False):
+    """Claim and run jobs until the queue is empty (burst) or forever"""
+    from app.models import db
+    from app.jobs import get_broker, run_job
+    from app.jobs.scheduler import run_due, SCHEDULER_INTERVAL
+    broker = get_broker(app)
+    next_tick = time.monotonic()
+    while True:
+        with app.app_context():
+            # Jobs mostly write: take SQLite's write lock at BEGIN like write requests do
+            g.sqlite_write_lock = True
+            try:
+                if time.monotonic() >= next_tick:
+                    next_tick = time.monotonic() + SCHEDULER_INTERVAL
+                    run_due(app)
+                job_id = broker.claim(worker)
+                if job_id is not None:
+                    run_job(job_id, broker)
+                    continue
+            except Exception:
+                db.session.rollback()
+                app.logger.exception('Job worker %s failed', worker)
+            finally:
+                db.session.remove()
+        if burst:
+            return
+        time.sleep(poll_interval)
+
+
+def _worker_main(config_name, poll_interval, burst):
+    from app import create_app
+    app, _ = create_app(config_name)
+    work(app, f'{socket.gethostname()}:{os.getpid()}', poll_interval, burst)
+
+
+def run_pool(config_name, processes=2, poll_interval=1.0, burst=False, log=print):
+    """Run `processes` workers until interrupted (or, with burst, until the queue drains)"""
+    if processes <= 1:
+        _worker_main(config_name, poll_interval, burst)
+        return
+    context = multiprocessing.get_context('spawn')
+    workers = {}
+
+    def start(index):
+        process = context.Process(target=_worker_main, args=(config_name, poll_interval, burst),
+                                  name=f'job-worker-{index}')
+        process.start()
+        workers[index] = process
+        log(f'Started job worker {index} (pid {process.pid})')
+
+    for index in range(processes):
+        start(index)
+    try:
+        while workers:
+            time.sleep(1)
+            for index, process in list(workers.items()):
+                if process.is_alive():
+                    continue
+                del workers[index]
+                if not burst:
+                    log(f'Job worker {index} exited with code {process.exitcode}; restarting')
+                    start(index)
+    except KeyboardInterrupt:
+        for process in workers.values():
+            process.terminate()
+        for process in workers.values():
+            process.join()
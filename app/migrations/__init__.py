@@ -0,0 +1,166 @@
+"""Versioned schema migrations.
+
+Migrations are modules in `app/migrations/versions/` named `NNNN_description.py`
+with an `upgrade(ops)` function (see `app.migrations.ops.Operations`). The
+applied versions are recorded in the `schema_version` table.
+
+At startup `check_schema` only reads the latest version row:
+
+- fresh database: `create_all` from the models, stamped at the newest version
+- database created before versioning (tables but no `schema_version`):
+  upgraded from version 0, starting with the `0001_baseline` migration
+- older database: upgraded when `MIGRATE_ON_STARTUP` is set, otherwise a
+  warning asks for `flask db upgrade`
+
+PostgreSQL upgrades hold an advisory lock so only one process migrates.
+"""
+import importlib
+import os
+import pkgutil
+import re
+from datetime import datetime
+from sqlalchemy import MetaData, Table, Column, Integer, String, DateTime, func, select, inspect
+from sqlalchemy.exc import IntegrityError, OperationalError, ProgrammingError
+from app.migrations.ops import Operations
+
+PG_LOCK_ID = 7305001
+
+_meta = MetaData()
+schema_version = Table(
+    'schema_version', _meta,
+    Column('version', Integer, primary_key=True),
+    Column('name', String(255), nullable=False),
+    Column('applied_date', DateTime, nullable=False),
+)
+
+VERSIONS_DIR = os.path.join(os.path.dirname(__file__), 'versions')
+_NAME = re.compile(r'^(\d{4})_(\w+)$')
+
+
+class Migration:
+    def __init__(self, version, name, module):
+        self.version = version
+        self.name = name
+        self.module = module
+
+    @property
+    def description(self):
+        return (self.module.__doc__ or self.name).strip().splitlines()[0]
+
+
+def load_migrations():
+    """All migrations, ordered by version"""
+    migrations = []
+    for info in pkgutil.iter_modules([VERSIONS_DIR]):
+        match = _NAME.match(info.name)
+        if match:
+            module = importlib.import_module(f'app.migrations.versions.{info.name}')
+            migrations.append(Migration(int(match.group(1)), info.name, module))
+    migrations.sort(key=lambda m: m.version)
+    versions = [m.version for m in migrations]
+    if len(set(versions)) != len(versions):
+        raise RuntimeError(f'Duplicate migration versions in {VERSIONS_DIR}')
+    return migrations
+
+
+def head_version(migrations=None):
+    migrations = load_migrations() if migrations is None else migrations
+    return migrations[-1].version if migrations else 0
+
+
+def current_version(engine):
+    """Latest applied version, or None when the database isn't versioned yet"""
+    try:
+        with engine.connect() as conn:
+            return conn.execute(select(func.max(schema_version.c.version))).scalar() or 0
+    except (OperationalError, ProgrammingError):
+        return None
+
+
+def _record(engine, migrations):
+    with engine.begin() as conn:
+        done = set(conn.execute(select(schema_version.c.version)).scalars())
+        rows = [{'version': m.version, 'name': m.name, 'applied_date': datetime.utcnow()}
+                for m in migrations if m.version not in done]
+        if rows:
+            conn.execute(schema_version.insert(), rows)
+
+
+def stamp(engine, version, migrations=None):
+    """Mark every migration up to `version` as applied without running it"""
+    migrations = load_migrations() if migrations is None else migrations
+    _meta.create_all(engine, checkfirst=True)
+    try:
+        _record(engine, [m for m in migrations if m.version <= version])
+    except IntegrityError:
+        # Another process stamped concurrently
+        pass
+
+
+def _advisory_lock(engine):
+    if engine.dialect.name != 'postgresql':
+        return None
+    conn = engine.connect().execution_options(isolation_level='AUTOCOMMIT')
+    conn.exec_driver_sql(f'SELECT pg_advisory_lock({PG_LOCK_ID})')
+    return conn
+
+
+def upgrade(engine, metadata, target=None, log=print):
+    """Apply pending migrations up to `target` (default: newest). Returns the versions applied."""
+    migrations = load_migrations()
+    target = head_version(migrations) if target is None else target
+    lock = _advisory_lock(engine)
+    try:
+        current = current_version(engine)
+        if current is None:
+            current = _initialise(engine, metadata, migrations, log)
+        ops = Operations(engine, metadata, log=log)
+        applied = []
+        for migration in migrations:
+            if current < migration.version <= target:
+                log(f'Applying {migration.name}: {migration.description}')
+                migration.module.upgrade(ops)
+                _record(engine, [migration])
+                applied.append(migration.version)
+        return applied
+    finally:
+        if lock is not None:
+            lock.exec_driver_sql(f'SELECT pg_advisory_unlock({PG_LOCK_ID})')
+            lock.close()
+
+
+def _initialise(engine, metadata, migrations, log):
+    """Version an unversioned database; returns the version it ends up at"""
+    if inspect(engine).has_table('company'):
+        # Run everything from the baseline on; its tables mostly exist already
+        log('Existing unversioned database, upgrading from the baseline')
+        _meta.create_all(engine, checkfirst=True)
+        return 0
+    metadata.create_all(engine)
+    head = head_version(migrations)
+    stamp(engine, head, migrations)
+    log(f'Created schema at version {head}')
+    return head
+
+
+def check_schema(app, db):
+    """Startup check: one version query, plus create/upgrade when needed"""
+    engine = db.engine
+    log = app.logger.info
+    current = current_version(engine)
+    migrations = load_migrations()
+    head = head_version(migrations)
+    if current == head:
+        return
+    if current is not None and current > head:
+        app.logger.warning('Database schema version %s is newer than this code (%s)', current, head)
+        return
+    if current is None and not inspect(engine).has_table('company'):
+        # Fresh database: nothing to migrate
+        upgrade(engine, db.metadata, log=log)
+        return
+    if app.config.get('MIGRATE_ON_STARTUP'):
+        upgrade(engine, db.metadata, log=log)
+    else:
+        app.logger.warning('Database schema is at version %s, code expects %s: run `flask db upgrade`',
+                           current if current is not None else 'unversioned', head)
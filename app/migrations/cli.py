@@ -0,0 +1,40 @@
+"""`flask db ...` commands for the migration runner"""
+import click
+from flask.cli import AppGroup
+from app.models import db
+from app.migrations import load_migrations, current_version, head_version, upgrade, stamp
+
+db_cli = AppGroup('db', help='Database schema migrations.')
+
+
+@db_cli.command('upgrade')
+@click.option('--to', 'target', type=int, default=None, help='Stop at this version.')
+def upgrade_command(target):
+    """Apply pending migrations."""
+    applied = upgrade(db.engine, db.metadata, target=target, log=click.echo)
+    click.echo(f'Applied {len(applied)} migration(s); now at version {current_version(db.engine)}.')
+
+
+@db_cli.command('current')
+def current_command():
+    """Show the database and code schema versions."""
+    current = current_version(db.engine)
+    click.echo(f'database: {"unversioned" if current is None else current}')
+    click.echo(f'code:     {head_version()}')
+
+
+@db_cli.command('history')
+def history_command():
+    """List migrations and whether they are applied."""
+    current = current_version(db.engine) or 0
+    for migration in load_migrations():
+        mark = 'x' if migration.version <= current else ' '
+        click.echo(f'[{mark}] {migration.name}: {migration.description}')
+
+
+@db_cli.command('stamp')
+@click.argument('version', type=int)
+def stamp_command(version):
+    """Mark migrations up to VERSION as applied without running them."""
+    stamp(db.engine, version)
+    click.echo(f'Stamped version {version}.')
@@ -0,0 +1,204 @@
+"""Schema operations for migrations.
+
+Every helper is idempotent (it checks the live schema first) and commits on
+its own, so a migration that stops halfway can simply be run again. Index
+builds use `CREATE INDEX CONCURRENTLY` on PostgreSQL and backfills update in
+primary-key batches, so neither holds long locks on busy tables.
+"""
+import time
+from sqlalchemy import MetaData, Index, inspect, text
+from sqlalchemy.schema import CreateTable
+
+
+class Operations:
+    """Helpers handed to each migration's `upgrade(ops)`"""
+
+    def __init__(self, engine, metadata, log=print):
+        self.engine = engine
+        self.metadata = metadata
+        self.dialect = engine.dialect.name
+        self.log = log
+
+    # -- introspection -------------------------------------------------
+
+    def _inspector(self):
+        return inspect(self.engine)
+
+    def has_table(self, table):
+        return self._inspector().has_table(table)
+
+    def has_column(self, table, column):
+        return column in {c['name'] for c in self._inspector().get_columns(table)}
+
+    def has_index(self, table, name):
+        return name in {i['name'] for i in self._inspector().get_indexes(table)}
+
+    def has_unique(self, table, columns):
+        """Whether a unique constraint or unique index covers exactly `columns`"""
+        inspector = self._inspector()
+        wanted = list(columns)
+        if any(u['column_names'] == wanted for u in inspector.get_unique_constraints(table)):
+            return True
+        return any(i['unique'] and i['column_names'] == wanted for i in inspector.get_indexes(table))
+
+    # -- statements ----------------------------------------------------
+
+    def drop_unique(self, table, columns):
+        """Drop unique constraints covering exactly `columns` (SQLite needs `rebuild_table`)"""
+        preparer = self.engine.dialect.identifier_preparer
+        for constraint in self._inspector().get_unique_constraints(table):
+            if constraint['column_names'] == list(columns):
+                self.execute('ALTER TABLE {} DROP CONSTRAINT {}'.format(
+                    preparer.quote(table), preparer.quote(constraint['name'])))
+                self.log(f'  dropped unique constraint {constraint["name"]}')
+
+    def execute(self, sql, params=None):
+        """Run one statement in its own transaction"""
+        with self.engine.begin() as conn:
+            return conn.execute(text(sql) if isinstance(sql, str) else sql, params or {})
+
+    def create_tables(self, *names):
+        """Create model tables that don't exist yet (all of them when no names are given)"""
+        tables = [self.metadata.tables[n] for n in names] if names else None
+        self.metadata.create_all(self.engine, tables=tables, checkfirst=True)
+
+    def add_column(self, table, column):
+        """ALTER TABLE ... ADD COLUMN for a sqlalchemy Column, unless it already exists"""
+        if self.has_column(table, column.name):
+            return
+        preparer = self.engine.dialect.identifier_preparer
+        ddl = 'ALTER TABLE {} ADD COLUMN {} {}'.format(
+            preparer.quote(table), preparer.quote(column.name), column.type.compile(self.engine.dialect))
+        if column.server_default is not None:
+            ddl += " DEFAULT '{}'".format(column.server_default.arg)
+        self.execute(ddl)
+        self.log(f'  added column {table}.{column.name}')
+
+    def create_index(self, name, table, *columns, unique=False):
+        """Create an index without blocking writes (CONCURRENTLY on PostgreSQL)"""
+        if self.dialect == 'postgresql' and self._pg_index_valid(name) is False:
+            # A failed concurrent build leaves an invalid index behind; rebuild it
+            self.drop_index(name, table)
+        if self.has_index(table, name):
+            return
+        started = time.monotonic()
+        # Built on a detached copy so the model metadata doesn't gain a second Index
+        detached = self.metadata.tables[table].to_metadata(MetaData())
+        index = Index(name, *[detached.c[c] for c in columns], unique=unique, postgresql_concurrently=True)
+        if self.dialect == 'postgresql':
+            with self.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+                index.create(conn)
+        else:
+            with self.engine.begin() as conn:
+                index.create(conn)
+        self.log(f'  created index {name} in {time.monotonic() - started:.1f}s')
+
+    def drop_index(self, name, table):
+        if not self.has_index(table, name) and self._pg_index_valid(name) is None:
+            return
+        preparer = self.engine.dialect.identifier_preparer
+        if self.dialect == 'postgresql':
+            with self.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+                conn.exec_driver_sql(f'DROP INDEX CONCURRENTLY IF EXISTS {preparer.quote(name)}')
+        else:
+            self.execute(f'DROP INDEX IF EXISTS {preparer.quote(name)}')
+        self.log(f'  dropped index {name}')
+
+    def _pg_index_valid(self, name):
+        if self.dialect != 'postgresql':
+            return None
+        return self.execute(
+            'SELECT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid WHERE c.relname = :name',
+            {'name': name}
+        ).scalar()
+
+    def set_foreign_key_ondelete(self, table, column, ondelete):
+        """Give the foreign key on `table.column` the ON DELETE action of its model
+        (`ondelete`, e.g. 'SET NULL'), unless it already has it"""
+        fk = next((fk for fk in self._inspector().get_foreign_keys(table)
+                   if fk['constrained_columns'] == [column]), None)
+        if fk is None or (fk['options'].get('ondelete') or '').upper() == ondelete.upper():
+            return
+        if self.dialect == 'sqlite':
+            self.rebuild_table(table)
+            return
+        preparer = self.engine.dialect.identifier_preparer
+        quoted, name = preparer.quote(table), preparer.quote(fk['name'])
+        with self.engine.begin() as conn:
+            conn.execute(text(f'ALTER TABLE {quoted} DROP CONSTRAINT {name}'))
+            # NOT VALID + VALIDATE: existing rows are checked without blocking writes
+            conn.execute(text(
+                f'ALTER TABLE {quoted} ADD CONSTRAINT {name} FOREIGN KEY ({preparer.quote(column)}) '
+                f'REFERENCES {preparer.quote(fk["referred_table"])} '
+                f'({", ".join(preparer.quote(c) for c in fk["referred_columns"])}) ON DELETE {ondelete} NOT VALID'))
+        self.execute(f'ALTER TABLE {quoted} VALIDATE CONSTRAINT {name}')
+        self.log(f'  {table}.{column}: ON DELETE {ondelete}')
+
+    def backfill(self, table, values, where, batch_size=1000, pause=0):
+        """UPDATE `table` SET `values` WHERE `where`, one primary-key batch per transaction.
+
+        `values` maps column names to literal values. Returns the number of rows updated.
+        """
+        preparer = self.engine.dialect.identifier_preparer
+        quoted = preparer.quote(table)
+        assignments = ', '.join(f'{preparer.quote(col)} = :v_{col}' for col in values)
+        params = {f'v_{col}': value for col, value in values.items()}
+        last_id, total = 0, 0
+        while True:
+            with self.engine.begin() as conn:
+                ids = [row[0] for row in conn.execute(text(
+                    f'SELECT id FROM {quoted} WHERE id > :last_id AND ({where}) ORDER BY id LIMIT :n'
+                ), {'last_id': last_id, 'n': batch_size})]
+                if not ids:
+                    break
+                conn.execute(text(
+                    f'UPDATE {quoted} SET {assignments} WHERE id >= :lo AND id <= :hi AND ({where})'
+                ), dict(params, lo=ids[0], hi=ids[-1]))
+            total += len(ids)
+            last_id = ids[-1]
+            if pause:
+                time.sleep(pause)
+        if total:
+            self.log(f'  backfilled {total} {table} rows')
+        return total
+
+    def rebuild_table(self, table):
+        """Recreate a SQLite table from its current model definition, keeping shared columns.
+
+        SQLite can't drop constraints or change columns in place; this is its
+        documented create-copy-drop-rename procedure, run with foreign keys off.
+        """
+        if self.dialect != 'sqlite':
+            raise NotImplementedError('rebuild_table is only needed on SQLite')
+        copy = MetaData()
+        for t in self.metadata.tables.values():
+            t.to_metadata(copy)
+        model = copy.tables[table]
+        temp = model.to_metadata(copy, name=f'{table}_new')
+        temp.indexes.clear()
+
+        existing = {c['name'] for c in self._inspector().get_columns(table)}
+        shared = ', '.join(f'"{c.name}"' for c in model.columns if c.name in existing)
+
+        raw = self.engine.raw_connection()
+        try:
+            cursor = raw.cursor()
+            cursor.execute('PRAGMA foreign_keys=OFF')
+            cursor.execute('BEGIN IMMEDIATE')
+            try:
+                cursor.execute(str(CreateTable(temp).compile(dialect=self.engine.dialect)))
+                cursor.execute(f'INSERT INTO "{table}_new" ({shared}) SELECT {shared} FROM "{table}"')
+                cursor.execute(f'DROP TABLE "{table}"')
+                cursor.execute(f'ALTER TABLE "{table}_new" RENAME TO "{table}"')
+                cursor.execute('COMMIT')
+            except Exception:
+                cursor.execute('ROLLBACK')
+                raise
+            finally:
+                cursor.execute('PRAGMA foreign_keys=ON')
+                cursor.close()
+        finally:
+            raw.close()
+        for index in self.metadata.tables[table].indexes:
+            index.create(self.engine, checkfirst=True)
+        self.log(f'  rebuilt table {table}')
@@ -0,0 +1,9 @@
+"""Baseline: the schema create_all produced before migrations were versioned
+
+Databases from that time may miss tables added since; create them from the
+models. Later migrations cover changes to tables that already existed.
+"""
+
+
+def upgrade(ops):
+    ops.create_tables()
@@ -0,0 +1,15 @@
+"""Add user.role and allow several users per company
+
+Replaces scripts/migrate_user_table.py. Existing users become owners.
+"""
+from sqlalchemy import Column, String
+
+
+def upgrade(ops):
+    if ops.dialect == 'sqlite':
+        if not ops.has_column('user', 'role') or ops.has_unique('user', ['company_id']):
+            ops.rebuild_table('user')
+    else:
+        ops.add_column('user', Column('role', String(20)))
+        ops.drop_unique('user', ['company_id'])
+    ops.backfill('user', {'role': 'owner'}, where='role IS NULL')
@@ -0,0 +1,10 @@
+"""Index stock movements by (product_id, created_date, id)
+
+Serves ledger replays and keyset pagination of the movement report; the
+old single-column product_id index becomes redundant.
+"""
+
+
+def upgrade(ops):
+    ops.create_index('ix_stock_movement_product_created', 'stock_movement', 'product_id', 'created_date', 'id')
+    ops.drop_index('ix_stock_movement_product_id', 'stock_movement')
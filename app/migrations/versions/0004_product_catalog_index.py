@@ -0,0 +1,8 @@
+"""Index products by (company_id, updated_date)
+
+Serves the POS catalog version lookup and changes-since queries.
+"""
+
+
+def upgrade(ops):
+    ops.create_index('ix_product_company_updated', 'product', 'company_id', 'updated_date')
@@ -0,0 +1,11 @@
+"""Add sale.client_ref for idempotent offline POS sync
+
+Unique per company; existing sales keep NULL, which the index allows any
+number of times.
+"""
+from sqlalchemy import Column, String
+
+
+def upgrade(ops):
+    ops.add_column('sale', Column('client_ref', String(64)))
+    ops.create_index('ix_sale_company_client_ref', 'sale', 'company_id', 'client_ref', unique=True)
@@ -0,0 +1,5 @@
+"""Add cart and cart_line for server-side POS carts"""
+
+
+def upgrade(ops):
+    ops.create_tables('cart', 'cart_line')
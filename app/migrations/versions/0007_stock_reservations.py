@@ -0,0 +1,13 @@
+"""Add stock_reservation and product.reserved_quantity
+
+Cart holds move from summing open cart lines to reservations, so the
+cart_line product index goes. Carts open during the upgrade hold nothing
+until their next change re-reserves their lines.
+"""
+from sqlalchemy import Column, Integer
+
+
+def upgrade(ops):
+    ops.add_column('product', Column('reserved_quantity', Integer, nullable=False, server_default='0'))
+    ops.create_tables('stock_reservation')
+    ops.drop_index('ix_cart_line_product', 'cart_line')
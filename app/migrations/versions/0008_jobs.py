@@ -0,0 +1,5 @@
+"""Add the job table for background jobs (app/jobs)"""
+
+
+def upgrade(ops):
+    ops.create_tables('job')
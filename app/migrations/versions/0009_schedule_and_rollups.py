@@ -0,0 +1,5 @@
+"""Add the job schedule and daily sales rollup tables"""
+
+
+def upgrade(ops):
+    ops.create_tables('job_schedule', 'daily_sales_rollup')
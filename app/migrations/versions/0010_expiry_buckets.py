@@ -0,0 +1,41 @@
+"""Add precomputed expiry buckets (product_expiry, expiry_summary)
+
+Filled here for existing products so the dashboard tiles are right before the
+first scheduled `inventory.refresh_expiry` run.
+"""
+from collections import Counter, defaultdict
+from datetime import datetime
+from sqlalchemy import select
+from app.expiry import SUMMARY_COLUMNS, bucket_for
+
+
+def upgrade(ops):
+    ops.create_tables('product_expiry', 'expiry_summary')
+    product = ops.metadata.tables['product']
+    product_expiry = ops.metadata.tables['product_expiry']
+    expiry_summary = ops.metadata.tables['expiry_summary']
+    today = datetime.utcnow().date()
+
+    with ops.engine.begin() as conn:
+        if conn.execute(select(expiry_summary.c.company_id).limit(1)).first():
+            return
+        rows = []
+        counts = defaultdict(Counter)
+        for product_id, company_id, expiry_date in conn.execute(
+                select(product.c.id, product.c.company_id, product.c.expiry_date).where(
+                    product.c.is_active == True, product.c.expiry_date.isnot(None))):
+            expiry_date = expiry_date.date() if isinstance(expiry_date, datetime) else expiry_date
+            days_left = (expiry_date - today).days
+            bucket = bucket_for(days_left)
+            rows.append({'product_id': product_id, 'company_id': company_id, 'expiry_date': expiry_date,
+                         'days_left': days_left, 'bucket': bucket, 'as_of': today})
+            counts[company_id][bucket] += 1
+        if rows:
+            conn.execute(product_expiry.insert(), rows)
+        if counts:
+            conn.execute(expiry_summary.insert(), [
+                dict({column: c.get(bucket, 0) for bucket, column in SUMMARY_COLUMNS.items()},
+                     company_id=company_id, as_of=today)
+                for company_id, c in counts.items()
+            ])
+    ops.log(f'  filled expiry buckets for {len(rows)} products')
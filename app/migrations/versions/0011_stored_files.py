@@ -0,0 +1,31 @@
+"""Add stored_file reference counts for uploads
+
+Counted here from the rows that already point at an upload. Files stored
+before content addressing keep their names until `flask uploads dedupe`.
+"""
+from collections import Counter
+from datetime import datetime
+from sqlalchemy import select, func
+
+REFERENCES = (('product', 'image_path'), ('company', 'logo_path'), ('expense', 'receipt_image'))
+
+
+def upgrade(ops):
+    ops.create_tables('stored_file')
+    stored_file = ops.metadata.tables['stored_file']
+
+    with ops.engine.begin() as conn:
+        if conn.execute(select(stored_file.c.path).limit(1)).first():
+            return
+        counts = Counter()
+        for table, column in REFERENCES:
+            col = ops.metadata.tables[table].c[column]
+            for path, count in conn.execute(
+                    select(col, func.count()).where(col.isnot(None), col != '').group_by(col)):
+                counts[path] += count
+        if counts:
+            now = datetime.utcnow()
+            conn.execute(stored_file.insert(), [
+                {'path': path, 'ref_count': count, 'created_date': now} for path, count in counts.items()
+            ])
+    ops.log(f'  counted references to {len(counts)} uploads')
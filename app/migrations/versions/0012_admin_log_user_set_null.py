@@ -0,0 +1,9 @@
+"""Keep admin_log rows when their user is deleted (performed_by ON DELETE SET NULL)
+
+With SQLite foreign keys enforced, deleting a user that appears in the log
+failed with "FOREIGN KEY constraint failed".
+"""
+
+
+def upgrade(ops):
+    ops.set_foreign_key_ondelete('admin_log', 'performed_by', 'SET NULL')
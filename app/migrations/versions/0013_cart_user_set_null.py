@@ -0,0 +1,5 @@
+"""Keep carts when their cashier is deleted (cart.user_id ON DELETE SET NULL)"""
+
+
+def upgrade(ops):
+    ops.set_foreign_key_ondelete('cart', 'user_id', 'SET NULL')
@@ -0,0 +1,5 @@
+"""Keep jobs when their user is deleted (job.user_id ON DELETE SET NULL)"""
+
+
+def upgrade(ops):
+    ops.set_foreign_key_ondelete('job', 'user_id', 'SET NULL')
@@ -3,8 +3,9 @@ from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime
 import uuid
+from app.replica import RoutingSession
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 
 
 class Company(db.Model):
@@ -67,6 +68,10 @@ class User(UserMixin, db.Model):
 class Product(db.Model):
     """Product model"""
     __tablename__ = 'product'
+    __table_args__ = (
+        # Catalog version and POS delta sync (app/catalog.py)
+        db.Index('ix_product_company_updated', 'company_id', 'updated_date'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     company_id = db.Column(db.Integer, db.ForeignKey('company.id'), nullable=False)
@@ -85,6 +90,8 @@ class Product(db.Model):
     manufacturing_date = db.Column(db.DateTime)
     expiry_date = db.Column(db.DateTime)
     quantity = db.Column(db.Integer, default=0)
+    # Units held by active stock reservations; available to sell = quantity - reserved_quantity
+    reserved_quantity = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     minimum_stock_level = db.Column(db.Integer, default=10)
     reorder_level = db.Column(db.Integer, default=20)
     prescription_required = db.Column(db.Boolean, default=False)
@@ -110,10 +117,14 @@ class Product(db.Model):
 class StockMovement(db.Model):
     """Stock movement history"""
     __tablename__ = 'stock_movement'
+    __table_args__ = (
+        # Serves per-product ledger replays and keyset pagination of the movement report
+        db.Index('ix_stock_movement_product_created', 'product_id', 'created_date', 'id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False)
-    movement_type = db.Column(db.String(50), nullable=False)  # 'purchase', 'sale', 'adjustment', 'return'
+    movement_type = db.Column(db.String(50), nullable=False)  # 'opening', 'purchase', 'sale', 'adjustment', 'return'
     quantity = db.Column(db.Integer, nullable=False)
     batch_number = db.Column(db.String(100))
     reference_id = db.Column(db.Integer)  # sale_id or purchase_id
@@ -123,6 +134,64 @@ class StockMovement(db.Model):
     product = db.relationship('Product', back_populates='stock_movements')
 
 
+class StockReservation(db.Model):
+    """Units of a product held for a holder (e.g. a POS cart) until expires_at"""
+    __tablename__ = 'stock_reservation'
+    __table_args__ = (
+        db.UniqueConstraint('holder_type', 'holder_id', 'product_id', name='uq_stock_reservation_holder_product'),
+        # Dropping a product's expired holds, and the sweeper's scan for expired holds
+        db.Index('ix_stock_reservation_product_expires', 'product_id', 'expires_at'),
+        db.Index('ix_stock_reservation_expires', 'expires_at'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False)
+    holder_type = db.Column(db.String(20), nullable=False)  # 'cart'
+    holder_id = db.Column(db.Integer, nullable=False)
+    quantity = db.Column(db.Integer, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False)
+    created_date = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class StockSnapshot(db.Model):
+    """Materialized stock-on-hand per product/batch, computed from StockMovement"""
+    __tablename__ = 'stock_snapshot'
+    __table_args__ = (
+        db.Index('ix_stock_snapshot_company_date', 'company_id', 'snapshot_date'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    company_id = db.Column(db.Integer, db.ForeignKey('company.id'), nullable=False)
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False)
+    batch_number = db.Column(db.String(100))
+    quantity = db.Column(db.Integer, nullable=False, default=0)
+    # All rows of one snapshot run share snapshot_date and the ledger watermark
+    # (highest StockMovement.id folded into the quantities).
+    snapshot_date = db.Column(db.DateTime, nullable=False)
+    last_movement_id = db.Column(db.Integer, nullable=False, default=0)
+    created_date = db.Column(db.DateTime, default=datetime.utcnow)
+
+    product = db.relationship('Product')
+
+
+class StockValuation(db.Model):
+    """Cached stock valuation per category for a closed date"""
+    __tablename__ = 'stock_valuation'
+    __table_args__ = (
+        db.UniqueConstraint('company_id', 'valuation_date', 'category', name='uq_stock_valuation_company_date_category'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    company_id = db.Column(db.Integer, db.ForeignKey('company.id'), nullable=False)
+    valuation_date = db.Column(db.Date, nullable=False)
+    category = db.Column(db.String(100), nullable=False)
+    product_count = db.Column(db.Integer, default=0)
+    quantity = db.Column(db.Integer, default=0)
+    cost_value = db.Column(db.Float, default=0)
+    mrp_value = db.Column(db.Float, default=0)
+    created_date = db.Column(db.DateTime, default=datetime.utcnow)
+
+
 class Category(db.Model):
     """Master category for products"""
     __tablename__ = 'category'
@@ -199,12 +268,17 @@ class Supplier(db.Model):
 class Sale(db.Model):
     """Sales/Invoice model"""
     __tablename__ = 'sale'
+    __table_args__ = (
+        # Offline POS sync is idempotent per POS-generated reference
+        db.Index('ix_sale_company_client_ref', 'company_id', 'client_ref', unique=True),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     company_id = db.Column(db.Integer, db.ForeignKey('company.id'), nullable=False)
     customer_id = db.Column(db.Integer, db.ForeignKey('customer.id'))
     invoice_number = db.Column(db.String(50), unique=True, nullable=False)
     invoice_date = db.Column(db.DateTime, default=datetime.utcnow)
+    client_ref = db.Column(db.String(64))  # POS-generated reference, set for offline-queued and retried checkouts
     customer_name = db.Column(db.String(255))
     customer_phone = db.Column(db.String(20))
     subtotal = db.Column(db.Float, nullable=False)
@@ -245,7 +319,45 @@ class SaleItem(db.Model):
     total_amount = db.Column(db.Float, nullable=False)
     
     sale = db.relationship('Sale', back_populates='items')
-    product = db.relationship('Product', back_populates='sale_items')
+    # Line items are always shown with their product
+    product = db.relationship('Product', back_populates='sale_items', lazy='joined', innerjoin=True)
+
+
+class Cart(db.Model):
+    """Server-side POS cart; its lines hold stock through StockReservation"""
+    __tablename__ = 'cart'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    company_id = db.Column(db.Integer, db.ForeignKey('company.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='SET NULL'))
+    status = db.Column(db.String(20), nullable=False, default='open')  # 'open', 'checked_out'
+    expires_at = db.Column(db.DateTime, nullable=False)
+    sale_id = db.Column(db.Integer, db.ForeignKey('sale.id'))
+    created_date = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_date = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    lines = db.relationship('CartLine', back_populates='cart', cascade='all, delete-orphan',
+                            order_by='CartLine.id')
+    sale = db.relationship('Sale')
+
+
+class CartLine(db.Model):
+    """A product in a cart, priced when it was added"""
+    __tablename__ = 'cart_line'
+    __table_args__ = (
+        db.UniqueConstraint('cart_id', 'product_id', name='uq_cart_line_cart_product'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    cart_id = db.Column(db.Integer, db.ForeignKey('cart.id'), nullable=False)
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False)
+    quantity = db.Column(db.Integer, nullable=False)
+    unit_price = db.Column(db.Float, nullable=False)
+    tax_percentage = db.Column(db.Float, default=0)
+    created_date = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    cart = db.relationship('Cart', back_populates='lines')
+    product = db.relationship('Product', lazy='joined', innerjoin=True)
 
 
 class SalesReturn(db.Model):
@@ -263,7 +375,9 @@ class SalesReturn(db.Model):
     refund_amount = db.Column(db.Float, nullable=False)
     refund_mode = db.Column(db.String(50))  # 'cash', 'card', 'upi', etc.
     
-    sale = db.relationship('Sale', back_populates='returns')
+    # Returns are listed by invoice number
+    sale = db.relationship('Sale', back_populates='returns', lazy='joined', innerjoin=True)
+    product = db.relationship('Product')
 
 
 class Purchase(db.Model):
@@ -287,7 +401,8 @@ class Purchase(db.Model):
     updated_date = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     company = db.relationship('Company', back_populates='purchases')
-    supplier = db.relationship('Supplier', back_populates='purchases')
+    # Purchases are always listed with their supplier
+    supplier = db.relationship('Supplier', back_populates='purchases', lazy='joined', innerjoin=True)
     items = db.relationship('PurchaseItem', back_populates='purchase', cascade='all, delete-orphan')
     returns = db.relationship('PurchaseReturn', back_populates='purchase', cascade='all, delete-orphan')
 
@@ -310,7 +425,7 @@ class PurchaseItem(db.Model):
     total_amount = db.Column(db.Float, nullable=False)
     
     purchase = db.relationship('Purchase', back_populates='items')
-    product = db.relationship('Product', back_populates='purchase_items')
+    product = db.relationship('Product', back_populates='purchase_items', lazy='joined', innerjoin=True)
 
 
 class PurchaseReturn(db.Model):
@@ -326,7 +441,8 @@ class PurchaseReturn(db.Model):
     reason = db.Column(db.String(255))
     credit_amount = db.Column(db.Float, nullable=False)
     
-    purchase = db.relationship('Purchase', back_populates='returns')
+    purchase = db.relationship('Purchase', back_populates='returns', lazy='joined', innerjoin=True)
+    product = db.relationship('Product')
 
 
 class Expense(db.Model):
@@ -378,13 +494,107 @@ class Doctor(db.Model):
     consultations = db.relationship('Sale', back_populates='doctor')
 
 
+class Job(db.Model):
+    """Background job run by the job workers (app/jobs)"""
+    __tablename__ = 'job'
+    __table_args__ = (
+        db.Index('ix_job_status_run_after', 'status', 'run_after'),
+        db.Index('ix_job_unique_key', 'unique_key'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    company_id = db.Column(db.Integer, db.ForeignKey('company.id'))
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='SET NULL'))  # NULL once the user is deleted
+    task = db.Column(db.String(100), nullable=False)
+    args = db.Column(db.Text)  # JSON keyword arguments
+    unique_key = db.Column(db.String(255))  # at most one queued or running job per key
+    status = db.Column(db.String(20), nullable=False, default='queued')  # 'queued', 'running', 'succeeded', 'failed'
+    progress = db.Column(db.Integer, default=0)  # percent
+    message = db.Column(db.String(255))
+    attempts = db.Column(db.Integer, default=0)
+    max_attempts = db.Column(db.Integer, default=3)
+    result = db.Column(db.Text)  # JSON
+    result_file = db.Column(db.String(500))
+    error = db.Column(db.Text)
+    run_after = db.Column(db.DateTime, default=datetime.utcnow)
+    created_date = db.Column(db.DateTime, default=datetime.utcnow)
+    started_date = db.Column(db.DateTime)
+    finished_date = db.Column(db.DateTime)
+    updated_date = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class ProductExpiry(db.Model):
+    """Expiry bucket of an active product with an expiry date (app/expiry.py)"""
+    __tablename__ = 'product_expiry'
+    __table_args__ = (
+        db.Index('ix_product_expiry_company_date', 'company_id', 'expiry_date'),
+    )
+
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), primary_key=True)
+    company_id = db.Column(db.Integer, db.ForeignKey('company.id'), nullable=False)
+    expiry_date = db.Column(db.Date, nullable=False)
+    days_left = db.Column(db.Integer, nullable=False)  # as of `as_of`
+    bucket = db.Column(db.String(10), nullable=False)  # 'expired', '30', '60', '90', 'later'
+    as_of = db.Column(db.Date, nullable=False)
+
+    product = db.relationship('Product')
+
+
+class ExpirySummary(db.Model):
+    """Products per expiry bucket for a company, for the dashboard tiles (app/expiry.py)"""
+    __tablename__ = 'expiry_summary'
+
+    company_id = db.Column(db.Integer, db.ForeignKey('company.id'), primary_key=True)
+    expired = db.Column(db.Integer, nullable=False, default=0)
+    within_30 = db.Column(db.Integer, nullable=False, default=0)
+    within_60 = db.Column(db.Integer, nullable=False, default=0)
+    within_90 = db.Column(db.Integer, nullable=False, default=0)
+    as_of = db.Column(db.Date, nullable=False)  # UTC day of the last full rebuild
+
+
+class JobSchedule(db.Model):
+    """Last slot claimed for each scheduled task (app/jobs/scheduler.py)"""
+    __tablename__ = 'job_schedule'
+
+    name = db.Column(db.String(100), primary_key=True)
+    last_run_at = db.Column(db.DateTime, nullable=False)  # server local time
+
+
+class DailySalesRollup(db.Model):
+    """Sales totals of one finished (UTC) day, finalised nightly (app/rollups.py)"""
+    __tablename__ = 'daily_sales_rollup'
+    __table_args__ = (
+        db.Index('ix_daily_sales_rollup_company_day', 'company_id', 'day', unique=True),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    company_id = db.Column(db.Integer, db.ForeignKey('company.id'), nullable=False)
+    day = db.Column(db.Date, nullable=False)
+    invoice_count = db.Column(db.Integer, nullable=False, default=0)
+    sales_total = db.Column(db.Float, nullable=False, default=0)
+    tax_total = db.Column(db.Float, nullable=False, default=0)
+    discount_total = db.Column(db.Float, nullable=False, default=0)
+    profit = db.Column(db.Float, nullable=False, default=0)  # (unit price - purchase price) * quantity
+    finalised_date = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class StoredFile(db.Model):
+    """An upload in content-addressed storage and how many rows point at it (app/uploads.py)"""
+    __tablename__ = 'stored_file'
+
+    path = db.Column(db.String(500), primary_key=True)  # as in product.image_path, company.logo_path, expense.receipt_image
+    ref_count = db.Column(db.Integer, nullable=False, default=0)
+    created_date = db.Column(db.DateTime, default=datetime.utcnow)
+    released_date = db.Column(db.DateTime)  # last time a reference was dropped
+
+
 class AdminLog(db.Model):
     """Simple audit log for admin actions (credential changes, etc.)"""
     __tablename__ = 'admin_log'
 
     id = db.Column(db.Integer, primary_key=True)
     company_id = db.Column(db.Integer, db.ForeignKey('company.id'))
-    performed_by = db.Column(db.Integer, db.ForeignKey('user.id'))
+    performed_by = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='SET NULL'))
     action = db.Column(db.String(100), nullable=False)
     details = db.Column(db.Text)
     created_date = db.Column(db.DateTime, default=datetime.utcnow)
@@ -0,0 +1,105 @@
+"""N+1 query detection.
+
+`QueryRecorder` captures the SQL statements issued on the app's engines while
+a block runs (typically one test-client request). `statement_shape` reduces a
+statement to its shape (literals, bound values and IN-lists collapsed), so a
+relationship lazily loaded once per row shows up as one shape repeated N
+times. `repeated_shapes` lists the shapes repeated more than a threshold.
+
+In tests, load the fixture with `pytest_plugins = ['app.query_audit']` and
+provide an `app` fixture::
+
+    def test_invoice_detail(client, query_recorder):
+        with query_recorder() as recorder:
+            client.get('/sales/invoices/1')
+        recorder.assert_no_repeats(threshold=3)
+
+`scripts/check_queries.py` runs the same check over every GET route against
+a committed baseline.
+"""
+import re
+from collections import Counter
+from sqlalchemy import event
+
+DEFAULT_THRESHOLD = 5
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+_PLACEHOLDER = re.compile(r'%\(\w+\)s|:\w+|\?|\$\d+|%s')
+_IN_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+_SPACE = re.compile(r'\s+')
+
+
+def statement_shape(statement):
+    """Normalised statement: literals and parameters become `?`, IN-lists `(?)`"""
+    shape = _STRING.sub('?', statement)
+    shape = _PLACEHOLDER.sub('?', shape)
+    shape = _NUMBER.sub('?', shape)
+    shape = _IN_LIST.sub('(?)', shape)
+    return _SPACE.sub(' ', shape).strip()
+
+
+def repeated_shapes(statements, threshold=DEFAULT_THRESHOLD):
+    """[(shape, count)] for shapes issued more than `threshold` times, most repeated first"""
+    counts = Counter(statement_shape(s) for s in statements if not s.startswith('BEGIN'))
+    return [(shape, count) for shape, count in counts.most_common() if count > threshold]
+
+
+def max_repeat(statements):
+    """Highest number of times any single statement shape was issued"""
+    counts = Counter(statement_shape(s) for s in statements if not s.startswith('BEGIN'))
+    return max(counts.values(), default=0)
+
+
+class QueryRecorder:
+    """Context manager recording statements executed on the given engines"""
+
+    def __init__(self, engines):
+        self.engines = list(engines)
+        self.statements = []
+
+    def _record(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+    def __enter__(self):
+        self.statements = []
+        for engine in self.engines:
+            event.listen(engine, 'before_cursor_execute', self._record)
+        return self
+
+    def __exit__(self, *exc):
+        for engine in self.engines:
+            event.remove(engine, 'before_cursor_execute', self._record)
+        return False
+
+    @property
+    def count(self):
+        return len([s for s in self.statements if not s.startswith('BEGIN')])
+
+    def repeated(self, threshold=DEFAULT_THRESHOLD):
+        return repeated_shapes(self.statements, threshold)
+
+    def assert_no_repeats(self, threshold=DEFAULT_THRESHOLD):
+        repeated = self.repeated(threshold)
+        if repeated:
+            details = '\n'.join(f'  {count}x {shape[:200]}' for shape, count in repeated)
+            raise AssertionError(f'Repeated queries (N+1) above {threshold}:\n{details}')
+
+
+try:
+    import pytest
+except ImportError:  # pytest is only needed when the fixture is used
+    pytest = None
+
+if pytest is not None:
+    @pytest.fixture
+    def query_recorder(request):
+        """Factory fixture: `with query_recorder() as r:` records on the `app` fixture's engines"""
+        app = request.getfixturevalue('app')
+
+        def factory():
+            with app.app_context():
+                from app.models import db
+                engines = list(db.engines.values())
+            return QueryRecorder(engines)
+        return factory
@@ -0,0 +1,145 @@
+"""Read-replica routing.
+
+When `SQLALCHEMY_BINDS` has a `replica` key (set from `REPLICA_DATABASE_URL`),
+`RoutingSession` sends plain SELECTs issued by read-only requests to it:
+GET requests to blueprints in `REPLICA_BLUEPRINTS` or to views decorated
+with `replica_reads`. Everything else stays on the primary:
+
+- flushes, DML and `SELECT ... FOR UPDATE`
+- every query after the request has flushed a write
+- requests from a browser session that wrote within `READ_YOUR_WRITES_SECONDS`
+- all requests while the replica lags more than `REPLICA_MAX_LAG_SECONDS`
+  behind the primary, or cannot be reached (probed at most every
+  `REPLICA_LAG_CHECK_SECONDS`)
+"""
+import threading
+import time
+from functools import wraps
+from flask import current_app, g, request, session, has_request_context
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+from sqlalchemy.sql import Select
+from app.database import READ_METHODS, backend_name, engine_options
+
+REPLICA_BIND = 'replica'
+
+PG_LAG_SQL = (
+    "SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END"
+)
+
+_lag = {'checked': 0.0, 'seconds': None}
+_lag_lock = threading.Lock()
+
+
+def replica_reads(f):
+    """Mark a read-only view as safe to serve from the replica"""
+    @wraps(f)
+    def wrapped(*args, **kwargs):
+        return f(*args, **kwargs)
+    wrapped.replica_reads = True
+    return wrapped
+
+
+def replica_bind_options(config, url):
+    """Engine options for the replica bind, sized like the primary and read-only on PostgreSQL"""
+    options = engine_options(dict(config, SQLALCHEMY_DATABASE_URI=url, SQLALCHEMY_ENGINE_OPTIONS=None))
+    if backend_name(url) == 'postgresql':
+        connect_args = options['connect_args']
+        connect_args['application_name'] += '-replica'
+        connect_args['options'] = (connect_args.get('options', '') + ' -c default_transaction_read_only=on').strip()
+    options['url'] = url
+    return options
+
+
+def probe_lag(engine):
+    """Replication lag of `engine` in seconds; 0 for backends that can't report it"""
+    with engine.connect() as conn:
+        if engine.dialect.name == 'postgresql':
+            return float(conn.exec_driver_sql(PG_LAG_SQL).scalar() or 0)
+        conn.exec_driver_sql('SELECT 1')
+    return 0.0
+
+
+def replica_lag(engine):
+    """Cached replication lag in seconds, or None while the replica is unreachable"""
+    interval = current_app.config.get('REPLICA_LAG_CHECK_SECONDS', 5)
+    now = time.monotonic()
+    with _lag_lock:
+        if now - _lag['checked'] < interval:
+            return _lag['seconds']
+        _lag['checked'] = now
+    try:
+        seconds = probe_lag(engine)
+    except Exception as e:
+        current_app.logger.warning('Replica unavailable, reading from primary: %s', e)
+        seconds = None
+    with _lag_lock:
+        _lag['seconds'] = seconds
+    return seconds
+
+
+def _routed_endpoint():
+    if request.method not in READ_METHODS or not request.endpoint:
+        return False
+    if request.blueprint in current_app.config.get('REPLICA_BLUEPRINTS', ()):
+        return True
+    view = current_app.view_functions.get(request.endpoint)
+    return getattr(view, 'replica_reads', False)
+
+
+def _recent_writer():
+    last_write = session.get('_last_write')
+    window = current_app.config.get('READ_YOUR_WRITES_SECONDS', 10)
+    return last_write is not None and time.time() - last_write < window
+
+
+def use_replica(replica):
+    """Whether reads in the current request may go to the replica"""
+    if not has_request_context() or g.get('_db_wrote'):
+        return False
+    decision = g.get('_use_replica')
+    if decision is None:
+        decision = _routed_endpoint() and not _recent_writer()
+        if decision:
+            lag = replica_lag(replica)
+            decision = lag is not None and lag <= current_app.config.get('REPLICA_MAX_LAG_SECONDS', 30)
+        g._use_replica = decision
+    return decision
+
+
+def _is_plain_read(clause):
+    return isinstance(clause, Select) and clause._for_update_arg is None
+
+
+class RoutingSession(Session):
+    """Session that serves read-only requests from the replica bind when configured"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and _is_plain_read(clause):
+            replica = self._db.engines.get(REPLICA_BIND)
+            if replica is not None and use_replica(replica):
+                return replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _mark_write(session_, flush_context):
+    if has_request_context() and (session_.new or session_.dirty or session_.deleted):
+        g._db_wrote = True
+
+
+@event.listens_for(RoutingSession, 'do_orm_execute')
+def _mark_dml(orm_execute_state):
+    if has_request_context() and (orm_execute_state.is_insert or orm_execute_state.is_update
+                                  or orm_execute_state.is_delete):
+        g._db_wrote = True
+
+
+def init_replica_routing(app, db):
+    """Keep a browser session on the primary for READ_YOUR_WRITES_SECONDS after it writes"""
+    @app.after_request
+    def _remember_write(response):
+        if g.get('_db_wrote') and REPLICA_BIND in db.engines:
+            session['_last_write'] = time.time()
+        return response
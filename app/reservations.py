@@ -0,0 +1,150 @@
+"""Stock reservations: per-line holds that expire.
+
+A `StockReservation` holds units of a product for a holder (a POS cart, as
+holder_type 'cart') until `expires_at`. `Product.reserved_quantity` is the
+sum of the product's reservations, adjusted incrementally whenever a hold is
+placed, resized, released or dropped, so available-to-sell is
+`quantity - reserved_quantity` without aggregating reservations on reads.
+
+Every write path locks the product rows first, in id order, and only then
+touches their reservations. Expired holds of the locked products are dropped
+before availability is checked, so an expired hold never blocks a sale even
+if the sweeper hasn't run yet. The sweeper (`expire_reservations`, run every
+minute by the job workers as the scheduled `reservations.expire` task, or by
+`flask reservations sweep`) keeps the counters of idle products current for
+search and the POS catalog.
+"""
+from datetime import datetime
+import click
+from flask import g
+from flask.cli import AppGroup
+from app.models import db, Product, StockReservation
+from app.jobs import task
+
+SWEEP_BATCH = 500
+
+reservations_cli = AppGroup('reservations', help='Stock reservations.')
+
+
+class InsufficientStock(ValueError):
+    """A line asks for more units than are available to sell"""
+
+    def __init__(self, product, available=None):
+        super().__init__(f'Insufficient stock for {product.product_name}')
+        self.product_id = product.id
+        self.available = available_to_sell(product) if available is None else available
+
+
+def available_to_sell(product):
+    return max((product.quantity or 0) - (product.reserved_quantity or 0), 0)
+
+
+def lock_products(company_id, product_ids):
+    """Company products by id, row-locked for update where the backend supports it"""
+    if not product_ids:
+        return []
+    query = Product.query.filter(Product.id.in_(set(product_ids)))
+    if company_id is not None:
+        query = query.filter(Product.company_id == company_id)
+    return query.order_by(Product.id).with_for_update().populate_existing().all()
+
+
+def holds(holder_type, holder_id):
+    """The holder's reservations by product id"""
+    return {r.product_id: r for r in StockReservation.query.filter_by(holder_type=holder_type, holder_id=holder_id)}
+
+
+def drop_expired(products, now=None):
+    """Drop the expired holds of locked products, returning their units to available"""
+    products = {p.id: p for p in products}
+    if not products:
+        return 0
+    expired = StockReservation.query.filter(
+        StockReservation.product_id.in_(products),
+        StockReservation.expires_at <= (now or datetime.utcnow())
+    ).all()
+    for reservation in expired:
+        products[reservation.product_id].reserved_quantity -= reservation.quantity
+        db.session.delete(reservation)
+    db.session.flush()
+    return len(expired)
+
+
+def reserve(product, holder_type, holder_id, quantity, expires_at):
+    """Set the units a holder holds of a locked product (0 releases the hold)
+
+    Growing a hold needs the extra units to be available; shrinking one
+    always succeeds. Raises InsufficientStock.
+    """
+    reservation = StockReservation.query.filter_by(holder_type=holder_type, holder_id=holder_id,
+                                                   product_id=product.id).first()
+    current = reservation.quantity if reservation else 0
+    if quantity > current:
+        available = available_to_sell(product) + current
+        if quantity > available:
+            raise InsufficientStock(product, available)
+
+    if quantity <= 0:
+        if reservation is not None:
+            db.session.delete(reservation)
+    elif reservation is None:
+        db.session.add(StockReservation(product_id=product.id, holder_type=holder_type, holder_id=holder_id,
+                                        quantity=quantity, expires_at=expires_at))
+    else:
+        reservation.quantity = quantity
+        reservation.expires_at = expires_at
+    product.reserved_quantity += max(quantity, 0) - current
+    db.session.flush()
+
+
+def renew(holder_type, holder_id, expires_at):
+    """Extend all of a holder's live holds"""
+    StockReservation.query.filter(
+        StockReservation.holder_type == holder_type,
+        StockReservation.holder_id == holder_id,
+        StockReservation.expires_at > datetime.utcnow()
+    ).update({StockReservation.expires_at: expires_at}, synchronize_session=False)
+
+
+def release(holder_type, holder_id, products=()):
+    """Drop all of a holder's holds; `products` are rows already locked by the caller"""
+    reservations = list(holds(holder_type, holder_id).values())
+    if not reservations:
+        return
+    locked = {p.id: p for p in products}
+    missing = {r.product_id for r in reservations} - set(locked)
+    locked.update({p.id: p for p in lock_products(None, missing)})
+    for reservation in reservations:
+        locked[reservation.product_id].reserved_quantity -= reservation.quantity
+        db.session.delete(reservation)
+    db.session.flush()
+
+
+def expire_reservations(now=None, batch=SWEEP_BATCH):
+    """Drop expired holds in batches and commit; returns the number dropped"""
+    now = now or datetime.utcnow()
+    dropped = 0
+    while True:
+        product_ids = [pid for (pid,) in db.session.query(StockReservation.product_id).filter(
+            StockReservation.expires_at <= now).distinct().limit(batch)]
+        if not product_ids:
+            return dropped
+        count = drop_expired(lock_products(None, product_ids), now)
+        db.session.commit()
+        dropped += count
+        if len(product_ids) < batch:
+            return dropped
+
+
+@task('reservations.expire', max_attempts=1)
+def expire_job(ctx):
+    """Drop expired stock reservations (workers hold the SQLite write lock)"""
+    return {'message': f'Dropped {expire_reservations()} expired reservation(s).'}
+
+
+@reservations_cli.command('sweep')
+def sweep_command():
+    """Drop expired stock reservations."""
+    # Writes: take SQLite's write lock at BEGIN like the job workers do
+    g.sqlite_write_lock = True
+    click.echo(f'Dropped {expire_reservations()} expired reservation(s).')
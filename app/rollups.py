@@ -0,0 +1,120 @@
+"""Daily sales rollups.
+
+`DailySalesRollup` holds the totals of one finished day (UTC, like the
+dashboard's "today") for a company: invoices, sales, tax, discount and profit
+at the products' purchase prices. The nightly `reports.finalise_rollups` job
+rolls up every finished day that has no row yet, including days without
+sales; today is always computed live.
+
+A change to a finished day (a cancelled invoice, an offline sale synced
+late) deletes that day's row with `invalidate_rollup`. Readers compute days
+without a row live until the next run, so totals are never stale.
+"""
+from datetime import datetime, date, time, timedelta
+from sqlalchemy import func
+from app.models import db, Company, Sale, SaleItem, Product, DailySalesRollup
+from app.jobs import task
+
+FIELDS = ('invoice_count', 'sales_total', 'tax_total', 'discount_total', 'profit')
+
+
+def _as_date(value):
+    """func.date() result as a date (SQLite returns a string)"""
+    if isinstance(value, str):
+        return date.fromisoformat(value[:10])
+    return value.date() if isinstance(value, datetime) else value
+
+
+def _days(start, end):
+    return [start + timedelta(days=i) for i in range((end - start).days + 1)]
+
+
+def _empty():
+    return dict.fromkeys(FIELDS, 0)
+
+
+def live_totals(company_id, start, end):
+    """{day: totals} computed from the sales of start..end (days without sales are absent)"""
+    day = func.date(Sale.invoice_date)
+    filters = (
+        Sale.company_id == company_id,
+        Sale.is_cancelled == False,
+        Sale.invoice_date >= datetime.combine(start, time.min),
+        Sale.invoice_date < datetime.combine(end + timedelta(days=1), time.min),
+    )
+    totals = {}
+    rows = db.session.query(day, func.count(Sale.id), func.sum(Sale.total_amount), func.sum(Sale.tax_amount),
+                            func.sum(Sale.discount_amount)).filter(*filters).group_by(day)
+    for value, count, sales, tax, discount in rows:
+        totals[_as_date(value)] = {'invoice_count': count, 'sales_total': sales or 0, 'tax_total': tax or 0,
+                                   'discount_total': discount or 0, 'profit': 0}
+    profit = func.sum((SaleItem.unit_price - Product.purchase_price) * SaleItem.quantity)
+    rows = db.session.query(day, profit).join(SaleItem, SaleItem.sale_id == Sale.id).join(
+        Product, Product.id == SaleItem.product_id).filter(*filters).group_by(day)
+    for value, amount in rows:
+        totals.setdefault(_as_date(value), _empty())['profit'] = amount or 0
+    return totals
+
+
+def first_sale_day(company_id):
+    first = db.session.query(func.min(Sale.invoice_date)).filter(Sale.company_id == company_id).scalar()
+    return first.date() if first else None
+
+
+def daily_totals(company_id, start, end):
+    """{day: totals} for every day of start..end: rollups for finished days, live for the rest"""
+    rollups = DailySalesRollup.query.filter(
+        DailySalesRollup.company_id == company_id,
+        DailySalesRollup.day >= start,
+        DailySalesRollup.day <= end
+    )
+    totals = {r.day: {f: getattr(r, f) for f in FIELDS} for r in rollups}
+    missing = [d for d in _days(start, end) if d not in totals]
+    if missing:
+        first = first_sale_day(company_id)
+        missing = [d for d in missing if first and d >= first]
+    if missing:
+        live = live_totals(company_id, missing[0], missing[-1])
+        totals.update({d: live.get(d, _empty()) for d in missing})
+    return {d: totals.get(d, _empty()) for d in _days(start, end)}
+
+
+def period_totals(company_id, start, end):
+    """Totals summed over start..end"""
+    days = daily_totals(company_id, start, end).values()
+    return {f: sum(t[f] for t in days) for f in FIELDS}
+
+
+def finalise_rollups(company_id, through=None):
+    """Roll up every finished day through `through` (default yesterday) without a row; commits"""
+    through = through or datetime.utcnow().date() - timedelta(days=1)
+    first = first_sale_day(company_id)
+    if first is None or first > through:
+        return 0
+    done = {d for (d,) in db.session.query(DailySalesRollup.day).filter(
+        DailySalesRollup.company_id == company_id, DailySalesRollup.day >= first)}
+    missing = [d for d in _days(first, through) if d not in done]
+    if not missing:
+        return 0
+    live = live_totals(company_id, missing[0], missing[-1])
+    now = datetime.utcnow()
+    db.session.add_all(DailySalesRollup(company_id=company_id, day=d, finalised_date=now, **live.get(d, _empty()))
+                       for d in missing)
+    db.session.commit()
+    return len(missing)
+
+
+def invalidate_rollup(company_id, day):
+    """Forget a finished day's rollup after its sales changed; the caller commits"""
+    if day < datetime.utcnow().date():
+        DailySalesRollup.query.filter_by(company_id=company_id, day=day).delete(synchronize_session=False)
+
+
+@task('reports.finalise_rollups')
+def finalise_rollups_job(ctx):
+    company_ids = [cid for (cid,) in db.session.query(Company.id).order_by(Company.id)]
+    days = 0
+    for i, company_id in enumerate(company_ids, start=1):
+        days += finalise_rollups(company_id)
+        ctx.progress(100 * i // len(company_ids))
+    return {'message': f'Rolled up {days} day(s) for {len(company_ids)} companies.'}
@@ -1,29 +1,31 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify
 from flask_login import login_required, current_user
 from app.utils import require_roles
-from werkzeug.utils import secure_filename
 from app.models import db, Expense, Sale, Purchase, Customer, Supplier, SalesReturn, PurchaseReturn
+from app.replica import replica_reads
+from app.cache import cached, invalidate
+from app.uploads import save_upload, release
 from datetime import datetime
-import os
 
 accounting_bp = Blueprint('accounting', __name__, url_prefix='/accounting')
 
 
-ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'pdf'}
-
-
-def allowed_file(filename):
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
-
-
 @accounting_bp.route('/')
 @login_required
 @require_roles('owner')
+@replica_reads
 def accounting_dashboard():
     """Accounting dashboard"""
     company_id = current_user.company_id
     today = datetime.utcnow().date()
-    month_start = datetime.utcnow().replace(day=1).date()
+    tiles = cached(company_id, f'accounting.tiles:{today}', lambda: _accounting_tiles(company_id, today),
+                   tags=('sales', 'expenses'))
+    
+    return render_template('accounting/dashboard.html', **tiles)
+
+
+def _accounting_tiles(company_id, today):
+    month_start = today.replace(day=1)
     
     # Today's sales
     today_sales = db.session.query(db.func.sum(Sale.total_amount)).filter(
@@ -63,13 +65,14 @@ def accounting_dashboard():
     
     month_profit = month_sales - month_expenses
     
-    return render_template('accounting/dashboard.html',
-                         today_sales=today_sales,
-                         today_expenses=today_expenses,
-                         today_profit=today_profit,
-                         month_sales=month_sales,
-                         month_expenses=month_expenses,
-                         month_profit=month_profit)
+    return {
+        'today_sales': today_sales,
+        'today_expenses': today_expenses,
+        'today_profit': today_profit,
+        'month_sales': month_sales,
+        'month_expenses': month_expenses,
+        'month_profit': month_profit,
+    }
 
 
 @accounting_bp.route('/expenses')
@@ -115,20 +118,7 @@ def add_expense():
     """Add new expense"""
     if request.method == 'POST':
         try:
-            receipt_image = None
-            if 'receipt_image' in request.files:
-                file = request.files['receipt_image']
-                if file and file.filename and allowed_file(file.filename):
-                    filename = secure_filename(file.filename)
-                    filename = f"{datetime.utcnow().timestamp()}_{filename}"
-                    upload_folder = current_app.config.get('UPLOAD_FOLDER') or os.path.join(current_app.root_path, 'static', 'uploads')
-                    try:
-                        os.makedirs(upload_folder, exist_ok=True)
-                    except PermissionError:
-                        upload_folder = os.path.join(current_app.root_path, 'static', 'uploads')
-                        os.makedirs(upload_folder, exist_ok=True)
-                    file.save(os.path.join(upload_folder, filename))
-                    receipt_image = f"uploads/{filename}"
+            receipt_image = save_upload(request.files.get('receipt_image'), 'receipt')
             
             expense_date = datetime.strptime(request.form.get('expense_date'), '%Y-%m-%d')
             
@@ -142,6 +132,7 @@ def add_expense():
             )
             
             db.session.add(expense)
+            invalidate(expense.company_id, 'expenses')
             db.session.commit()
             
             flash('Expense added successfully.', 'success')
@@ -172,29 +163,12 @@ def edit_expense(expense_id):
             expense.amount = float(request.form.get('amount'))
             expense.expense_date = datetime.strptime(request.form.get('expense_date'), '%Y-%m-%d')
             
-            if 'receipt_image' in request.files:
-                file = request.files['receipt_image']
-                if file and file.filename and allowed_file(file.filename):
-                    # Delete old image
-                    if expense.receipt_image:
-                        old_file = os.path.join(current_app.root_path, 'static', expense.receipt_image)
-                        if os.path.exists(old_file):
-                            try:
-                                os.remove(old_file)
-                            except PermissionError:
-                                pass
-
-                    filename = secure_filename(file.filename)
-                    filename = f"{datetime.utcnow().timestamp()}_{filename}"
-                    upload_folder = current_app.config.get('UPLOAD_FOLDER') or os.path.join(current_app.root_path, 'static', 'uploads')
-                    try:
-                        os.makedirs(upload_folder, exist_ok=True)
-                    except PermissionError:
-                        upload_folder = os.path.join(current_app.root_path, 'static', 'uploads')
-                        os.makedirs(upload_folder, exist_ok=True)
-                    file.save(os.path.join(upload_folder, filename))
-                    expense.receipt_image = f"uploads/{filename}"
+            receipt_image = save_upload(request.files.get('receipt_image'), 'receipt')
+            if receipt_image:
+                release(expense.receipt_image)
+                expense.receipt_image = receipt_image
             
+            invalidate(expense.company_id, 'expenses')
             db.session.commit()
             
             flash('Expense updated successfully.', 'success')
@@ -219,15 +193,8 @@ def delete_expense(expense_id):
         return redirect(url_for('accounting.expenses_list'))
     
     try:
-        # Delete receipt image if exists
-        if expense.receipt_image:
-            old_file = os.path.join(current_app.root_path, 'static', expense.receipt_image)
-            if os.path.exists(old_file):
-                try:
-                    os.remove(old_file)
-                except PermissionError:
-                    pass
-        
+        release(expense.receipt_image)
+        invalidate(expense.company_id, 'expenses')
         db.session.delete(expense)
         db.session.commit()
         
@@ -243,6 +210,7 @@ def delete_expense(expense_id):
 @accounting_bp.route('/cash-summary')
 @login_required
 @require_roles('owner')
+@replica_reads
 def cash_summary():
     """Daily cash summary"""
     company_id = current_user.company_id
@@ -285,6 +253,7 @@ def cash_summary():
 
 @accounting_bp.route('/sales-register')
 @login_required
+@replica_reads
 def sales_register():
     """Sales register"""
     company_id = current_user.company_id
@@ -311,6 +280,7 @@ def sales_register():
 @accounting_bp.route('/purchase-register')
 @login_required
 @require_roles('owner')
+@replica_reads
 def purchase_register():
     """Purchase register"""
     company_id = current_user.company_id
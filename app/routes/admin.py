@@ -1,6 +1,7 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash
 from app.models import Company, User, db, AdminLog
 from app.utils import require_roles
+from app.identity import invalidate_user
 from flask_login import login_user, current_user
 from werkzeug.security import check_password_hash
 
@@ -92,6 +93,7 @@ def edit_company_login(company_id):
                 user.set_password(password)
 
         db.session.commit()
+        invalidate_user(user.id)
 
         # write an admin log
         try:
@@ -1,8 +1,10 @@
-from flask import Blueprint, render_template, jsonify
+from flask import Blueprint, render_template, jsonify, url_for
 from flask_login import login_required, current_user
-from app.models import db, Alert, Product, Sale, Purchase, Customer, Supplier
-from datetime import datetime, timedelta
+from app.models import db, Alert, Company, Product, Sale, Purchase, Customer, Supplier
+from datetime import datetime
 from sqlalchemy import and_, or_
+from app.jobs import task, enqueue
+from app.expiry import expiring_products
 
 alerts_bp = Blueprint('alerts', __name__, url_prefix='/alerts')
 
@@ -37,20 +39,8 @@ def generate_alerts(company_id):
         db.session.add(alert)
         alert_created = True
     
-    # Expiry alerts
-    expiry_30 = today + timedelta(days=30)
-    expiry_60 = today + timedelta(days=60)
-    expiry_90 = today + timedelta(days=90)
-    
-    # 90 days expiry (include already expired items)
-    expiring_90 = Product.query.filter(
-        and_(
-            Product.company_id == company_id,
-            Product.expiry_date.isnot(None),
-            Product.expiry_date <= expiry_90,
-            Product.is_active == True
-        )
-    ).all()
+    # Expiry alerts (include already expired items)
+    expiring_90 = expiring_products(company_id, 90)
     
     for product in expiring_90:
         try:
@@ -125,16 +115,28 @@ def generate_alerts(company_id):
         db.session.commit()
 
 
+@task('alerts.generate')
+def generate_alerts_job(ctx):
+    generate_alerts(ctx.job.company_id)
+
+
+@task('alerts.sweep')
+def sweep_alerts_job(ctx):
+    """Regenerate every company's alerts (scheduled)"""
+    company_ids = [cid for (cid,) in db.session.query(Company.id).order_by(Company.id)]
+    for i, company_id in enumerate(company_ids, start=1):
+        generate_alerts(company_id)
+        ctx.progress(100 * i // len(company_ids))
+    return {'message': f'Regenerated alerts for {len(company_ids)} companies.'}
+
+
 @alerts_bp.route('/')
 @login_required
 def alerts():
     """View alerts"""
     company_id = current_user.company_id
     
-    # Generate current alerts
-    generate_alerts(company_id)
-    
-    # Get all alerts
+    # Alerts as of the last scheduled sweep or refresh
     all_alerts = Alert.query.filter_by(company_id=company_id).order_by(
         Alert.created_date.desc()
     ).all()
@@ -157,9 +159,6 @@ def api_alert_count():
     """Get alert counts"""
     company_id = current_user.company_id
     
-    # Generate current alerts
-    generate_alerts(company_id)
-    
     total = Alert.query.filter_by(company_id=company_id).count()
     critical = Alert.query.filter_by(company_id=company_id, severity='critical').count()
     warning = Alert.query.filter_by(company_id=company_id, severity='warning').count()
@@ -171,6 +170,15 @@ def api_alert_count():
     })
 
 
+@alerts_bp.route('/refresh', methods=['POST'])
+@login_required
+def refresh():
+    """Regenerate alerts now, in a background job"""
+    company_id = current_user.company_id
+    job = enqueue('alerts.generate', company_id=company_id, unique_key=f'alerts:{company_id}')
+    return jsonify({'success': True, 'message': 'Refreshing alerts', 'job_url': url_for('jobs.job_status', job_id=job.id)})
+
+
 @alerts_bp.route('/<int:alert_id>/mark-read', methods=['POST'])
 @login_required
 def mark_alert_read(alert_id):
@@ -1,20 +1,13 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, session, current_app
+from flask import Blueprint, render_template, request, redirect, url_for, flash, session
 from flask_login import login_user, logout_user, login_required, current_user
-from werkzeug.utils import secure_filename
 from app.models import db, Company, User
-import os
+from app.identity import invalidate_user, invalidate_company
+from app.uploads import save_upload, release
 from datetime import datetime
 
 auth_bp = Blueprint('auth', __name__, url_prefix='/')
 
 
-ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
-
-
-def allowed_file(filename):
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
-
-
 def generate_registration_number():
     """Generate unique registration number"""
     from datetime import datetime
@@ -71,22 +64,7 @@ def register():
         
         try:
             # Handle logo upload
-            logo_path = None
-            if 'logo' in request.files:
-                file = request.files['logo']
-                if file and file.filename and allowed_file(file.filename):
-                    filename = secure_filename(file.filename)
-                    # Add timestamp to make filename unique
-                    filename = f"{datetime.utcnow().timestamp()}_{filename}"
-                    upload_folder = current_app.config.get('UPLOAD_FOLDER') or os.path.join(current_app.root_path, 'static', 'uploads')
-                    try:
-                        os.makedirs(upload_folder, exist_ok=True)
-                    except PermissionError:
-                        # fallback to app static/uploads inside root if instance not writable
-                        upload_folder = os.path.join(current_app.root_path, 'static', 'uploads')
-                        os.makedirs(upload_folder, exist_ok=True)
-                    file.save(os.path.join(upload_folder, filename))
-                    logo_path = f"uploads/{filename}"
+            logo_path = save_upload(request.files.get('logo'), 'logo')
             
             # Create company
             company = Company(
@@ -152,6 +130,7 @@ def login():
             login_user(user, remember=remember)
             user.last_login = datetime.utcnow()
             db.session.commit()
+            invalidate_user(user.id)
             
             next_page = request.args.get('next')
             flash('Login successful!', 'success')
@@ -176,7 +155,7 @@ def logout():
 @login_required
 def profile():
     """View company profile"""
-    company = current_user.company
+    company = Company.query.get(current_user.company_id)
     return render_template('profile.html', company=company)
 
 
@@ -184,7 +163,7 @@ def profile():
 @login_required
 def edit_profile():
     """Edit company profile"""
-    company = current_user.company
+    company = Company.query.get(current_user.company_id)
     
     if request.method == 'POST':
         try:
@@ -200,31 +179,14 @@ def edit_profile():
             company.drug_license_number = request.form.get('drug_license_number', company.drug_license_number)
             
             # Handle logo upload
-            if 'logo' in request.files:
-                file = request.files['logo']
-                if file and file.filename and allowed_file(file.filename):
-                    # Delete old logo if exists
-                    if company.logo_path:
-                        old_file = os.path.join(current_app.root_path, 'static', company.logo_path)
-                        if os.path.exists(old_file):
-                            try:
-                                os.remove(old_file)
-                            except PermissionError:
-                                pass
-                    
-                    filename = secure_filename(file.filename)
-                    filename = f"{datetime.utcnow().timestamp()}_{filename}"
-                    upload_folder = current_app.config.get('UPLOAD_FOLDER') or os.path.join(current_app.root_path, 'static', 'uploads')
-                    try:
-                        os.makedirs(upload_folder, exist_ok=True)
-                    except PermissionError:
-                        upload_folder = os.path.join(current_app.root_path, 'static', 'uploads')
-                        os.makedirs(upload_folder, exist_ok=True)
-                    file.save(os.path.join(upload_folder, filename))
-                    company.logo_path = f"uploads/{filename}"
+            logo_path = save_upload(request.files.get('logo'), 'logo')
+            if logo_path:
+                release(company.logo_path)
+                company.logo_path = logo_path
             
             company.updated_date = datetime.utcnow()
             db.session.commit()
+            invalidate_company(company.id)
             flash('Profile updated successfully.', 'success')
             return redirect(url_for('auth.profile'))
         
@@ -245,7 +207,8 @@ def change_password():
         new_password = request.form.get('new_password')
         confirm_password = request.form.get('confirm_password')
         
-        if not current_user.check_password(old_password):
+        user = User.query.get(current_user.id)
+        if not user.check_password(old_password):
             flash('Current password is incorrect.', 'danger')
             return redirect(url_for('auth.change_password'))
         
@@ -258,7 +221,7 @@ def change_password():
             return redirect(url_for('auth.change_password'))
         
         try:
-            current_user.set_password(new_password)
+            user.set_password(new_password)
             db.session.commit()
             flash('Password changed successfully.', 'success')
             return redirect(url_for('auth.profile'))
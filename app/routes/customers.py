@@ -2,6 +2,7 @@ from flask import Blueprint, render_template, request, redirect, url_for, flash,
 from flask_login import login_required, current_user
 from app.utils import require_roles
 from app.models import db, Customer, Sale
+from app.replica import replica_reads
 from datetime import datetime
 from sqlalchemy import and_, func
 
@@ -182,6 +183,7 @@ def delete_customer(customer_id):
 @customers_bp.route('/ledger')
 @login_required
 @require_roles('owner')
+@replica_reads
 def customer_ledger():
     """Customer ledger report"""
     company_id = current_user.company_id
@@ -3,6 +3,9 @@ from flask_login import login_required, current_user
 from app.models import db, Sale, Purchase, Product, Customer, Supplier, StockMovement, SalesReturn
 from datetime import datetime, timedelta
 from sqlalchemy import func, and_
+from app.rollups import daily_totals, period_totals, first_sale_day
+from app.expiry import expiry_counts
+from app.cache import cached
 
 dashboard_bp = Blueprint('dashboard', __name__, url_prefix='/dashboard')
 
@@ -15,86 +18,15 @@ def dashboard():
     today = datetime.utcnow().date()
     month_start = datetime.utcnow().replace(day=1).date()
     
-    # Today's sales
-    today_sales = db.session.query(func.sum(Sale.total_amount)).filter(
-        and_(
-            Sale.company_id == company_id,
-            func.date(Sale.invoice_date) == today,
-            Sale.is_cancelled == False
-        )
-    ).scalar() or 0
-    
-    # Monthly sales
-    month_sales = db.session.query(func.sum(Sale.total_amount)).filter(
-        and_(
-            Sale.company_id == company_id,
-            func.date(Sale.invoice_date) >= month_start,
-            Sale.is_cancelled == False
-        )
-    ).scalar() or 0
-    
-    # Total profit (simplified: sum of (selling_price - purchase_price) * quantity sold)
-    # This is a simplified calculation; in real world, track per item
-    total_profit = 0
-    sales = Sale.query.filter(
-        and_(Sale.company_id == company_id, Sale.is_cancelled == False)
-    ).all()
-    for sale in sales:
-        for item in sale.items:
-            product = item.product
-            if product:
-                profit_per_item = item.unit_price - product.purchase_price
-                total_profit += profit_per_item * item.quantity
+    # Sales, purchase and stock tiles are cached per company (app/cache.py)
+    sales = cached(company_id, f'dashboard.sales:{today}', lambda: _sales_tiles(company_id, today, month_start),
+                   tags=('sales',))
+    total_purchases = cached(company_id, 'dashboard.purchases', lambda: _purchase_total(company_id),
+                             tags=('purchases',))
+    stock = cached(company_id, 'dashboard.stock', lambda: _stock_tiles(company_id), tags=('stock',))
     
-    # Total purchases
-    total_purchases = db.session.query(func.sum(Purchase.total_amount)).filter(
-        Purchase.company_id == company_id
-    ).scalar() or 0
-    
-    # Low stock count
-    low_stock = Product.query.filter(
-        and_(
-            Product.company_id == company_id,
-            Product.quantity <= Product.minimum_stock_level,
-            Product.is_active == True
-        )
-    ).count()
-    
-    # Expiring medicines
-    today_date = datetime.utcnow().date()
-    expiry_30_days = today_date + timedelta(days=30)
-    expiry_60_days = today_date + timedelta(days=60)
-    expiry_90_days = today_date + timedelta(days=90)
-    
-    expiring_30 = Product.query.filter(
-        and_(
-            Product.company_id == company_id,
-            Product.expiry_date.isnot(None),
-            Product.expiry_date >= today_date,
-            Product.expiry_date <= expiry_30_days,
-            Product.is_active == True
-        )
-    ).count()
-    
-    expiring_60 = Product.query.filter(
-        and_(
-            Product.company_id == company_id,
-            Product.expiry_date.isnot(None),
-            Product.expiry_date > expiry_30_days,
-            Product.expiry_date <= expiry_60_days,
-            Product.is_active == True
-        )
-    ).count()
-    
-    expiring_90 = Product.query.filter(
-        and_(
-            Product.company_id == company_id,
-            Product.expiry_date.isnot(None),
-            Product.expiry_date > expiry_60_days,
-            Product.expiry_date <= expiry_90_days,
-            Product.is_active == True
-        )
-    ).count()
+    # Expiring medicines (precomputed buckets)
+    expiring = expiry_counts(company_id)
     
     # Total customers
     total_customers = Customer.query.filter(
@@ -111,44 +43,67 @@ def dashboard():
         and_(Sale.company_id == company_id, Sale.is_cancelled == False)
     ).order_by(Sale.invoice_date.desc()).limit(10).all()
     
-    # Sales data for graph (last 7 days)
-    sales_by_day = {}
-    for i in range(7):
-        day = today - timedelta(days=i)
-        daily_total = db.session.query(func.sum(Sale.total_amount)).filter(
-            and_(
-                Sale.company_id == company_id,
-                func.date(Sale.invoice_date) == day,
-                Sale.is_cancelled == False
-            )
-        ).scalar() or 0
-        sales_by_day[day.strftime('%Y-%m-%d')] = float(daily_total)
-    
-    # Reorder for chronological order
-    sales_by_day = dict(sorted(sales_by_day.items()))
-    
     metrics = {
-        'today_sales': today_sales,
-        'month_sales': month_sales,
-        'total_profit': total_profit,
+        'today_sales': sales['today_sales'],
+        'month_sales': sales['month_sales'],
+        'total_profit': sales['total_profit'],
         'total_purchases': total_purchases,
-        'low_stock_count': low_stock,
-        'expiring_30': expiring_30,
-        'expiring_60': expiring_60,
-        'expiring_90': expiring_90,
+        'low_stock_count': stock['low_stock_count'],
+        'expiring_30': expiring['within_30'],
+        'expiring_60': expiring['within_60'],
+        'expiring_90': expiring['within_90'],
         'total_customers': total_customers,
         'total_suppliers': total_suppliers,
+        'total_stock_value': stock['total_stock_value'],
     }
-
-    # Total stock value (using purchase price * quantity)
-    total_stock_value = db.session.query(func.sum(Product.quantity * Product.purchase_price)).filter(
-        Product.company_id == company_id
-    ).scalar() or 0
-
-    metrics['total_stock_value'] = float(total_stock_value)
     
     return render_template('dashboard/index.html', 
                          company=current_user.company,
                          metrics=metrics,
                          recent_sales=recent_sales,
-                         sales_by_day=sales_by_day)
+                         sales_by_day=sales['sales_by_day'])
+
+
+def _sales_tiles(company_id, today, month_start):
+    # Nightly rollups for finished days, live queries for today
+    totals = daily_totals(company_id, min(month_start, today - timedelta(days=6)), today)
+    
+    # Total profit (simplified: sum of (selling_price - purchase_price) * quantity sold)
+    first_day = first_sale_day(company_id)
+    total_profit = period_totals(company_id, first_day, today)['profit'] if first_day and first_day <= today else 0
+    
+    # Sales data for graph (last 7 days, chronological)
+    sales_by_day = {}
+    for i in range(6, -1, -1):
+        day = today - timedelta(days=i)
+        sales_by_day[day.strftime('%Y-%m-%d')] = float(totals[day]['sales_total'])
+    
+    return {
+        'today_sales': totals[today]['sales_total'],
+        'month_sales': sum(t['sales_total'] for day, t in totals.items() if day >= month_start),
+        'total_profit': total_profit,
+        'sales_by_day': sales_by_day,
+    }
+
+
+def _purchase_total(company_id):
+    return db.session.query(func.sum(Purchase.total_amount)).filter(
+        Purchase.company_id == company_id
+    ).scalar() or 0
+
+
+def _stock_tiles(company_id):
+    low_stock = Product.query.filter(
+        and_(
+            Product.company_id == company_id,
+            Product.quantity <= Product.minimum_stock_level,
+            Product.is_active == True
+        )
+    ).count()
+    
+    # Total stock value (using purchase price * quantity)
+    total_stock_value = db.session.query(func.sum(Product.quantity * Product.purchase_price)).filter(
+        and_(Product.company_id == company_id, Product.is_active == True)
+    ).scalar() or 0
+    
+    return {'low_stock_count': low_stock, 'total_stock_value': float(total_stock_value)}
@@ -0,0 +1,42 @@
+from flask import Blueprint, current_app, jsonify
+from flask_login import current_user
+from app.models import db
+from app.database import database_health
+from app.replica import REPLICA_BIND, probe_lag
+
+health_bp = Blueprint('health', __name__, url_prefix='/health')
+
+
+@health_bp.route('/')
+def health():
+    """Liveness check"""
+    return jsonify({'status': 'ok'})
+
+
+def _show_details():
+    # Pool, pragma and replica details: owners only, unless HEALTH_DETAILS opens them up
+    if current_app.config.get('HEALTH_DETAILS'):
+        return True
+    return current_user.is_authenticated and current_user.role == 'owner'
+
+
+@health_bp.route('/db')
+def db_health():
+    """Database connectivity; pool status, SQLite pragmas and replica lag for owners"""
+    try:
+        info = database_health(db.engine)
+    except Exception:
+        current_app.logger.exception('Database health check failed')
+        return jsonify({'status': 'error'}), 503
+    if not _show_details():
+        return jsonify({'status': 'ok'})
+    info['status'] = 'ok'
+    replica = db.engines.get(REPLICA_BIND)
+    if replica is not None:
+        try:
+            info['replica'] = {'backend': replica.dialect.name, 'pool': replica.pool.status(),
+                               'lag_seconds': probe_lag(replica)}
+        except Exception:
+            current_app.logger.exception('Replica health check failed')
+            info['replica'] = {'status': 'error'}
+    return jsonify(info)
@@ -1,20 +1,152 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, send_file, current_app
+from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, send_file, current_app, Response, stream_with_context
 from flask_login import login_required, current_user
-from werkzeug.utils import secure_filename
+from app.utils import require_roles
 from app.models import db, Product, StockMovement, Category, Unit
+from app.stock import reconcile, correct_drift, take_snapshot, latest_snapshot_run, stock_as_of
+from app.database import supports_copy, copy_rows_from, copy_query_to
+from app.replica import replica_reads
+from app.jobs import task, enqueue, background_view
+from app.expiry import expiring_products, refresh_products
+from app.cache import invalidate
+from app.uploads import save_upload, release
+from sqlalchemy import select, literal, func
 from datetime import datetime
 import os
 import csv
 import io
+import tempfile
+import uuid
 
 inventory_bp = Blueprint('inventory', __name__, url_prefix='/inventory')
 
 
-ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
+IMPORT_ERRORS_SHOWN = 100
 
 
-def allowed_file(filename):
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+def import_products(company_id, rows):
+    """Insert product rows (dicts with every column) plus their opening-stock movements
+    and expiry buckets.
+
+    PostgreSQL loads the products with COPY; other backends use one executemany.
+    Opening movements are derived in the database with INSERT ... SELECT.
+    """
+    if not rows:
+        return
+    table = Product.__table__
+    if supports_copy(db.session):
+        columns = list(rows[0])
+        copy_rows_from(db.session, table.name, columns, ([row[c] for c in columns] for row in rows))
+    else:
+        db.session.execute(table.insert(), rows)
+
+    skus = [row['sku'] for row in rows]
+    movements = select(
+        table.c.id, literal('opening'), table.c.quantity, table.c.batch_number,
+        literal('Opening stock (bulk import)'), table.c.created_date
+    ).where(
+        table.c.company_id == company_id,
+        table.c.sku.in_(skus),
+        table.c.quantity != 0
+    )
+    db.session.execute(StockMovement.__table__.insert().from_select(
+        ['product_id', 'movement_type', 'quantity', 'batch_number', 'reason', 'created_date'], movements
+    ))
+
+    # Expiring imports show in reports, alerts and tiles right away, not after the nightly rebuild
+    if any(row['expiry_date'] for row in rows):
+        refresh_products(company_id, [product_id for (product_id,) in db.session.query(table.c.id).filter(
+            table.c.company_id == company_id,
+            table.c.sku.in_(skus),
+            table.c.expiry_date.isnot(None)
+        )])
+
+
+def build_import_rows(company_id, rows):
+    """Validate bulk import CSV rows; returns (product rows for `import_products`, errors)"""
+    # One lookup for every SKU/barcode in the file instead of two queries per row
+    # (SKU and barcode are unique across all companies)
+    skus = {row.get('sku') for row in rows if row.get('sku')}
+    barcodes = {row.get('barcode') for row in rows if row.get('barcode')}
+    taken_skus = {sku for (sku,) in db.session.query(Product.sku).filter(Product.sku.in_(skus))} if skus else set()
+    taken_barcodes = {b for (b,) in db.session.query(Product.barcode).filter(Product.barcode.in_(barcodes))} if barcodes else set()
+
+    now = datetime.utcnow()
+    new_products = []
+    errors = []
+    for i, row in enumerate(rows, start=2):
+        try:
+            # enforce company scoping and simple validations
+            sku = row.get('sku') or ''
+            barcode = row.get('barcode') or None
+            if not sku:
+                raise Exception(f'Missing SKU on row {i}')
+            if sku in taken_skus:
+                raise Exception(f'Duplicate SKU on row {i}: {sku}')
+            if barcode and barcode in taken_barcodes:
+                raise Exception(f'Duplicate barcode on row {i}: {barcode}')
+            dates = {}
+            for column in ('manufacturing_date', 'expiry_date'):
+                value = (row.get(column) or '').strip()
+                try:
+                    dates[column] = datetime.strptime(value, '%Y-%m-%d') if value else None
+                except ValueError:
+                    raise Exception(f'Invalid {column} on row {i}: {value} (use YYYY-MM-DD)')
+
+            # Every column is set explicitly: COPY bypasses model defaults
+            new_products.append({
+                'company_id': company_id,
+                'product_name': row.get('product_name'),
+                'generic_name': row.get('generic_name'),
+                'brand': row.get('brand'),
+                'category': row.get('category') or '',
+                'manufacturer': row.get('manufacturer'),
+                'batch_number': row.get('batch_number'),
+                'manufacturing_date': dates['manufacturing_date'],
+                'expiry_date': dates['expiry_date'],
+                'barcode': barcode,
+                'sku': sku,
+                'purchase_price': float(row.get('purchase_price') or 0),
+                'selling_price': float(row.get('selling_price') or 0),
+                'mrp': float(row.get('mrp') or 0),
+                'tax_percentage': float(row.get('tax_percentage') or 0),
+                'quantity': int(float(row.get('quantity') or 0)),
+                'minimum_stock_level': int(float(row.get('minimum_stock_level') or 10)),
+                'reorder_level': int(float(row.get('reorder_level') or 20)),
+                'prescription_required': (row.get('prescription_required','').lower() in ('1','true','yes','on')),
+                'description': row.get('description'),
+                'created_date': now,
+                'updated_date': now,
+                'is_active': True,
+            })
+            taken_skus.add(sku)
+            if barcode:
+                taken_barcodes.add(barcode)
+        except Exception as e:
+            errors.append(str(e))
+
+    return new_products, errors
+
+
+@task('inventory.import_products', max_attempts=2)
+def import_products_job(ctx, path):
+    """Import a bulk product CSV saved by `add_product`"""
+    company_id = ctx.job.company_id
+    with open(path, encoding='utf-8', newline='') as f:
+        rows = list(csv.DictReader(f))
+    ctx.progress(10, f'Checking {len(rows)} rows')
+    new_products, errors = build_import_rows(company_id, rows)
+    ctx.progress(40, f'Importing {len(new_products)} products')
+    import_products(company_id, new_products)
+    invalidate(company_id, 'stock')
+    db.session.commit()
+    os.remove(path)
+
+    msg = f'Bulk upload completed: {len(new_products)} products added.'
+    if errors:
+        current_app.logger.warning('Bulk product import errors: %s', '; '.join(errors))
+        msg += f' {len(errors)} rows had errors.'
+    return {'message': msg, 'imported': len(new_products), 'errors': errors[:IMPORT_ERRORS_SHOWN],
+            'next': 'inventory.products_list'}
 
 
 @inventory_bp.route('/products')
@@ -88,56 +220,15 @@ def add_product():
                 flash(f'Missing required columns in CSV: {", ".join(missing)}', 'danger')
                 return redirect(url_for('inventory.add_product'))
 
-            created = 0
-            errors = []
-            for i, row in enumerate(reader, start=2):
-                try:
-                    # enforce company scoping and simple validations
-                    sku = row.get('sku') or ''
-                    barcode = row.get('barcode') or None
-                    if sku and Product.query.filter_by(sku=sku, company_id=current_user.company_id).first():
-                        raise Exception(f'Duplicate SKU on row {i}: {sku}')
-                    if barcode and Product.query.filter_by(barcode=barcode, company_id=current_user.company_id).first():
-                        raise Exception(f'Duplicate barcode on row {i}: {barcode}')
-
-                    product = Product(
-                        company_id=current_user.company_id,
-                        product_name=row.get('product_name'),
-                        generic_name=row.get('generic_name'),
-                        brand=row.get('brand'),
-                        category=row.get('category') or '',
-                        manufacturer=row.get('manufacturer'),
-                        batch_number=row.get('batch_number'),
-                        barcode=barcode,
-                        sku=sku,
-                        purchase_price=float(row.get('purchase_price') or 0),
-                        selling_price=float(row.get('selling_price') or 0),
-                        mrp=float(row.get('mrp') or 0),
-                        tax_percentage=float(row.get('tax_percentage') or 0),
-                        quantity=int(float(row.get('quantity') or 0)),
-                        minimum_stock_level=int(float(row.get('minimum_stock_level') or 10)),
-                        reorder_level=int(float(row.get('reorder_level') or 20)),
-                        prescription_required=(row.get('prescription_required','').lower() in ('1','true','yes','on')),
-                        description=row.get('description')
-                    )
-                    db.session.add(product)
-                    created += 1
-                except Exception as e:
-                    errors.append(str(e))
-
-            try:
-                db.session.commit()
-                msg = f'Bulk upload completed: {created} products added.'
-                if errors:
-                    msg += f' {len(errors)} rows had errors (see logs).'
-                    flash(msg, 'warning')
-                else:
-                    flash(msg, 'success')
-                return redirect(url_for('inventory.products_list'))
-            except Exception as e:
-                db.session.rollback()
-                flash(f'Failed to import products: {e}', 'danger')
-                return redirect(url_for('inventory.add_product'))
+            # Validate and import in a background job; the job page reports the outcome
+            folder = os.path.join(current_app.config['JOB_FILES_FOLDER'], 'uploads')
+            os.makedirs(folder, exist_ok=True)
+            path = os.path.join(folder, f'products_{uuid.uuid4().hex}.csv')
+            with open(path, 'w', encoding='utf-8', newline='') as f:
+                f.write(stream.getvalue())
+            job = enqueue('inventory.import_products', company_id=current_user.company_id,
+                          user_id=current_user.id, path=path)
+            return redirect(url_for('jobs.job_page', job_id=job.id))
 
         # Single product flow continues below
         try:
@@ -153,20 +244,7 @@ def add_product():
                 return redirect(url_for('inventory.add_product'))
             
             # Handle image upload
-            image_path = None
-            if 'product_image' in request.files:
-                file = request.files['product_image']
-                if file and file.filename and allowed_file(file.filename):
-                    filename = secure_filename(file.filename)
-                    filename = f"{datetime.utcnow().timestamp()}_{filename}"
-                    upload_folder = current_app.config.get('UPLOAD_FOLDER') or os.path.join(current_app.root_path, 'static', 'uploads')
-                    try:
-                        os.makedirs(upload_folder, exist_ok=True)
-                    except PermissionError:
-                        upload_folder = os.path.join(current_app.root_path, 'static', 'uploads')
-                        os.makedirs(upload_folder, exist_ok=True)
-                    file.save(os.path.join(upload_folder, filename))
-                    image_path = f"uploads/{filename}"
+            image_path = save_upload(request.files.get('product_image'), 'product')
             
             mfg_date = None
             exp_date = None
@@ -211,8 +289,18 @@ def add_product():
                     product.unit_id = int(uid)
             except Exception:
                 pass
+            if product.quantity:
+                product.stock_movements.append(StockMovement(
+                    movement_type='opening',
+                    quantity=product.quantity,
+                    batch_number=product.batch_number,
+                    reason='Opening stock'
+                ))
             
             db.session.add(product)
+            db.session.flush()
+            refresh_products(product.company_id, [product.id])
+            invalidate(product.company_id, 'stock')
             db.session.commit()
             
             flash('Product added successfully.', 'success')
@@ -324,30 +412,14 @@ def edit_product(product_id):
                 product.expiry_date = datetime.strptime(request.form.get('expiry_date'), '%Y-%m-%d')
             
             # Handle image upload
-            if 'product_image' in request.files:
-                file = request.files['product_image']
-                if file and file.filename and allowed_file(file.filename):
-                    # Delete old image
-                    if product.image_path:
-                        old_file = os.path.join(current_app.root_path, 'static', product.image_path)
-                        if os.path.exists(old_file):
-                            try:
-                                os.remove(old_file)
-                            except PermissionError:
-                                pass
-
-                    filename = secure_filename(file.filename)
-                    filename = f"{datetime.utcnow().timestamp()}_{filename}"
-                    upload_folder = current_app.config.get('UPLOAD_FOLDER') or os.path.join(current_app.root_path, 'static', 'uploads')
-                    try:
-                        os.makedirs(upload_folder, exist_ok=True)
-                    except PermissionError:
-                        upload_folder = os.path.join(current_app.root_path, 'static', 'uploads')
-                        os.makedirs(upload_folder, exist_ok=True)
-                    file.save(os.path.join(upload_folder, filename))
-                    product.image_path = f"uploads/{filename}"
+            image_path = save_upload(request.files.get('product_image'), 'product')
+            if image_path:
+                release(product.image_path)
+                product.image_path = image_path
             
             product.updated_date = datetime.utcnow()
+            refresh_products(product.company_id, [product.id])
+            invalidate(product.company_id, 'stock')
             db.session.commit()
             
             flash('Product updated successfully.', 'success')
@@ -367,7 +439,7 @@ def edit_product(product_id):
 @login_required
 def adjust_stock(product_id):
     """Adjust stock for a product"""
-    product = Product.query.get(product_id)
+    product = db.session.get(Product, product_id, with_for_update=True)
     if not product or product.company_id != current_user.company_id:
         return jsonify({'success': False, 'message': 'Product not found'}), 404
     
@@ -400,6 +472,8 @@ def adjust_stock(product_id):
         
         db.session.add(movement)
         product.updated_date = datetime.utcnow()
+        refresh_products(product.company_id, [product.id])
+        invalidate(product.company_id, 'stock')
         db.session.commit()
         
         return jsonify({
@@ -430,6 +504,8 @@ def delete_product(product_id):
     try:
         product.is_active = False
         product.updated_date = datetime.utcnow()
+        refresh_products(product.company_id, [product.id])
+        invalidate(product.company_id, 'stock')
         db.session.commit()
         flash('Product deleted successfully.', 'success')
         return redirect(url_for('inventory.products_list'))
@@ -460,48 +536,260 @@ def low_stock_report():
 @login_required
 def expiry_report():
     """Expiry report"""
-    from datetime import timedelta
-    from sqlalchemy import and_
-    
-    company_id = current_user.company_id
-    today = datetime.utcnow().date()
-    expiry_90_days = today + timedelta(days=90)
-    
-    products = Product.query.filter(
-        and_(
-            Product.company_id == company_id,
-            Product.expiry_date.isnot(None),
-            Product.expiry_date <= expiry_90_days,
-            Product.is_active == True
-        )
-    ).order_by(Product.expiry_date).all()
+    products = expiring_products(current_user.company_id, 90)
     
     return render_template('inventory/expiry_report.html', products=products)
 
 
-@inventory_bp.route('/stock-movement-report')
-@login_required
-def stock_movement_report():
-    """Stock movement report"""
-    company_id = current_user.company_id
+MOVEMENT_PAGE_SIZE = 50
+MOVEMENT_EXPORT_CHUNK = 1000
+
+
+def _movement_report_query(company_id):
+    """Movement rows (plain columns, no ORM objects) filtered from request args"""
     product_id = request.args.get('product_id', type=int)
     movement_type = request.args.get('type', '')
-    
-    query = db.session.query(StockMovement).join(Product).filter(
+    start_date = request.args.get('start_date', '')
+    end_date = request.args.get('end_date', '')
+
+    query = db.session.query(
+        StockMovement.id,
+        StockMovement.product_id,
+        StockMovement.created_date,
+        StockMovement.movement_type,
+        StockMovement.quantity,
+        StockMovement.batch_number,
+        StockMovement.reference_id,
+        StockMovement.reason,
+        Product.product_name,
+        Product.sku
+    ).join(Product, StockMovement.product_id == Product.id).filter(
         Product.company_id == company_id
     )
-    
+
     if product_id:
         query = query.filter(StockMovement.product_id == product_id)
-    
     if movement_type:
         query = query.filter(StockMovement.movement_type == movement_type)
-    
-    movements = query.order_by(StockMovement.created_date.desc()).all()
-    products = Product.query.filter_by(company_id=company_id, is_active=True).all()
-    
-    return render_template('inventory/stock_movement_report.html', 
-                         movements=movements, 
-                         products=products,
-                         selected_product_id=product_id,
-                         selected_type=movement_type)
+    if start_date:
+        query = query.filter(StockMovement.created_date >= datetime.strptime(start_date, '%Y-%m-%d'))
+    if end_date:
+        end = datetime.strptime(end_date, '%Y-%m-%d').replace(hour=23, minute=59, second=59, microsecond=999999)
+        query = query.filter(StockMovement.created_date <= end)
+
+    # Keyset order matching ix_stock_movement_product_created
+    return query.order_by(
+        StockMovement.product_id.desc(),
+        StockMovement.created_date.desc(),
+        StockMovement.id.desc()
+    )
+
+
+def _encode_movement_cursor(row):
+    return f"{row.product_id}_{row.created_date.strftime('%Y%m%d%H%M%S%f')}_{row.id}"
+
+
+def _apply_movement_cursor(query, cursor):
+    """Restrict the query to rows after (product_id, created_date, id) of the cursor"""
+    try:
+        product_id, created, movement_id = cursor.split('_')
+        product_id = int(product_id)
+        created = datetime.strptime(created, '%Y%m%d%H%M%S%f')
+        movement_id = int(movement_id)
+    except ValueError:
+        return query
+    return query.filter(db.or_(
+        StockMovement.product_id < product_id,
+        db.and_(StockMovement.product_id == product_id, StockMovement.created_date < created),
+        db.and_(StockMovement.product_id == product_id, StockMovement.created_date == created,
+                StockMovement.id < movement_id)
+    ))
+
+
+MOVEMENT_EXPORT_HEADERS = ['Date', 'Product', 'SKU', 'Type', 'Quantity', 'Batch', 'Reference', 'Reason']
+
+
+def _movement_export_row(row):
+    return [
+        row.created_date.strftime('%Y-%m-%d %H:%M:%S') if row.created_date else '',
+        row.product_name,
+        row.sku,
+        row.movement_type,
+        row.quantity,
+        row.batch_number or '',
+        row.reference_id or '',
+        row.reason or ''
+    ]
+
+
+def _copy_movements_csv(query):
+    """Movement CSV produced by PostgreSQL COPY, formatted like `_movement_export_row`"""
+    statement = query.with_entities(
+        func.to_char(StockMovement.created_date, 'YYYY-MM-DD HH24:MI:SS'),
+        Product.product_name,
+        Product.sku,
+        StockMovement.movement_type,
+        StockMovement.quantity,
+        func.coalesce(StockMovement.batch_number, ''),
+        StockMovement.reference_id,
+        func.coalesce(StockMovement.reason, '')
+    ).statement
+    output = tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024)
+    copy_query_to(db.session, statement, output, header=MOVEMENT_EXPORT_HEADERS)
+    output.seek(0)
+    return send_file(
+        output,
+        mimetype='text/csv',
+        as_attachment=True,
+        download_name=f'stock_movements_{datetime.utcnow().strftime("%Y%m%d")}.csv'
+    )
+
+
+def _export_movements_csv(query):
+    if supports_copy(db.session):
+        return _copy_movements_csv(query)
+
+    def generate():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(MOVEMENT_EXPORT_HEADERS)
+        for i, row in enumerate(query.yield_per(MOVEMENT_EXPORT_CHUNK), start=1):
+            writer.writerow(_movement_export_row(row))
+            if i % MOVEMENT_EXPORT_CHUNK == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate(0)
+        yield buffer.getvalue()
+
+    filename = f'stock_movements_{datetime.utcnow().strftime("%Y%m%d")}.csv'
+    return Response(stream_with_context(generate()), mimetype='text/csv',
+                    headers={'Content-Disposition': f'attachment; filename={filename}'})
+
+
+def _export_movements_xlsx(query):
+    from openpyxl import Workbook
+
+    # write-only workbooks keep rows on disk instead of building the sheet in memory
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet('Stock Movements')
+    sheet.append(MOVEMENT_EXPORT_HEADERS)
+    for row in query.yield_per(MOVEMENT_EXPORT_CHUNK):
+        sheet.append(_movement_export_row(row))
+
+    output = tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024)
+    workbook.save(output)
+    output.seek(0)
+    return send_file(
+        output,
+        mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+        as_attachment=True,
+        download_name=f'stock_movements_{datetime.utcnow().strftime("%Y%m%d")}.xlsx'
+    )
+
+
+@inventory_bp.route('/stock-movement-report')
+@login_required
+@background_view
+@replica_reads
+def stock_movement_report():
+    """Stock movement report (keyset paginated)"""
+    company_id = current_user.company_id
+    product_id = request.args.get('product_id', type=int)
+    export_format = request.args.get('export', '')
+
+    try:
+        query = _movement_report_query(company_id)
+    except ValueError:
+        flash('Dates must be in YYYY-MM-DD format.', 'danger')
+        return redirect(url_for('inventory.stock_movement_report'))
+
+    if export_format == 'csv':
+        return _export_movements_csv(query)
+    if export_format == 'xlsx':
+        return _export_movements_xlsx(query)
+
+    cursor = request.args.get('after', '')
+    if cursor:
+        query = _apply_movement_cursor(query, cursor)
+    rows = query.limit(MOVEMENT_PAGE_SIZE + 1).all()
+    movements = rows[:MOVEMENT_PAGE_SIZE]
+    next_cursor = _encode_movement_cursor(movements[-1]) if len(rows) > MOVEMENT_PAGE_SIZE else None
+
+    selected_product = None
+    if product_id:
+        selected_product = Product.query.filter_by(id=product_id, company_id=company_id).first()
+
+    filters = {k: v for k, v in request.args.items() if k not in ('after', 'export') and v}
+    return render_template('inventory/stock_movement_report.html',
+                         movements=movements,
+                         selected_product=selected_product,
+                         selected_type=request.args.get('type', ''),
+                         start_date=request.args.get('start_date', ''),
+                         end_date=request.args.get('end_date', ''),
+                         filters=filters,
+                         is_first_page=not cursor,
+                         next_cursor=next_cursor)
+
+
+@inventory_bp.route('/api/products/typeahead')
+@login_required
+def product_typeahead():
+    """Product lookup for report filters (name, SKU or barcode)"""
+    query = request.args.get('q', '').strip()
+    if len(query) < 2:
+        return jsonify([])
+
+    products = db.session.query(Product.id, Product.product_name, Product.sku).filter(
+        Product.company_id == current_user.company_id,
+        db.or_(
+            Product.product_name.ilike(f'%{query}%'),
+            Product.sku.ilike(f'%{query}%'),
+            Product.barcode.ilike(f'%{query}%')
+        )
+    ).order_by(Product.product_name).limit(10).all()
+
+    return jsonify([{'id': p.id, 'name': p.product_name, 'sku': p.sku} for p in products])
+
+
+@inventory_bp.route('/stock-reconciliation', methods=['GET', 'POST'])
+@login_required
+@require_roles('owner')
+def stock_reconciliation():
+    """Compare the stock ledger with on-hand quantities"""
+    company_id = current_user.company_id
+    if request.method == 'POST':
+        try:
+            if request.form.get('action') == 'correct':
+                corrected = correct_drift(company_id)
+                flash(f'Booked {corrected} correction movements.', 'success')
+            else:
+                written = take_snapshot(company_id)
+                flash(f'Stock snapshot taken ({written} rows).', 'success')
+        except Exception as e:
+            db.session.rollback()
+            flash(f'Failed to update stock ledger: {str(e)}', 'danger')
+        return redirect(url_for('inventory.stock_reconciliation'))
+
+    drift = reconcile(company_id)
+    last_run = latest_snapshot_run(company_id)
+    return render_template('inventory/stock_reconciliation.html', drift=drift, last_run=last_run)
+
+
+@inventory_bp.route('/api/stock-as-of')
+@login_required
+def api_stock_as_of():
+    """On-hand stock per product (or batch) at the end of a given date"""
+    date_str = request.args.get('date', '')
+    try:
+        as_of = datetime.strptime(date_str, '%Y-%m-%d').replace(hour=23, minute=59, second=59, microsecond=999999)
+    except ValueError:
+        return jsonify({'success': False, 'message': 'date must be YYYY-MM-DD'}), 400
+
+    by_batch = request.args.get('by_batch', '0') in ('1', 'true', 'yes')
+    stock = stock_as_of(current_user.company_id, as_of, by_batch=by_batch)
+    if by_batch:
+        rows = [{'product_id': pid, 'batch_number': batch, 'quantity': qty}
+                for (pid, batch), qty in sorted(stock.items(), key=lambda kv: (kv[0][0], kv[0][1] or ''))]
+    else:
+        rows = [{'product_id': pid, 'quantity': qty} for pid, qty in sorted(stock.items())]
+    return jsonify({'success': True, 'as_of': as_of.isoformat(), 'stock': rows})
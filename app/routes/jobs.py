@@ -0,0 +1,44 @@
+from flask import Blueprint, render_template, jsonify, send_file, abort
+from flask_login import login_required, current_user
+from app.models import db, Job
+from app.jobs import job_payload
+import os
+
+jobs_bp = Blueprint('jobs', __name__, url_prefix='/jobs')
+
+
+def get_job(job_id):
+    """The current user's job, or 404"""
+    job = db.session.get(Job, job_id)
+    if job is None or job.company_id != current_user.company_id or job.user_id not in (None, current_user.id):
+        abort(404)
+    if job.user_id is None and job.result_file and getattr(current_user, 'role', None) != 'owner':
+        # The file of a user deleted since: only owners may still fetch it
+        abort(404)
+    return job
+
+
+@jobs_bp.route('/<int:job_id>')
+@login_required
+def job_status(job_id):
+    """Job status"""
+    return jsonify(job_payload(get_job(job_id)))
+
+
+@jobs_bp.route('/<int:job_id>/view')
+@login_required
+def job_page(job_id):
+    """Job progress page"""
+    job = get_job(job_id)
+    return render_template('jobs/status.html', job=job, payload=job_payload(job))
+
+
+@jobs_bp.route('/<int:job_id>/download')
+@login_required
+def download(job_id):
+    """Download the job's result file"""
+    job = get_job(job_id)
+    if job.status != 'succeeded' or not job.result_file or not os.path.exists(job.result_file):
+        abort(404)
+    html = job.result_file.endswith('.html')
+    return send_file(job.result_file, as_attachment=not html, download_name=os.path.basename(job.result_file))
@@ -0,0 +1,14 @@
+from flask import Blueprint, Response, current_app, request, abort
+from app.models import db
+from app.instrumentation import render_metrics
+
+metrics_bp = Blueprint('metrics', __name__)
+
+
+@metrics_bp.route('/metrics')
+def metrics():
+    """Prometheus scrape endpoint (registered only when instrumentation is enabled)"""
+    token = current_app.config.get('METRICS_TOKEN')
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        abort(401)
+    return Response(render_metrics(db.engines), mimetype='text/plain; version=0.0.4')
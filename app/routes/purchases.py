@@ -2,8 +2,11 @@ from flask import Blueprint, render_template, request, redirect, url_for, flash,
 from flask_login import login_required, current_user
 from app.utils import require_roles
 from app.models import db, Purchase, PurchaseItem, PurchaseReturn, Product, Supplier, StockMovement
+from app.expiry import refresh_products
+from app.cache import invalidate
 from datetime import datetime
 from sqlalchemy import and_
+from sqlalchemy.orm import selectinload, joinedload
 
 purchases_bp = Blueprint('purchases', __name__, url_prefix='/purchases')
 
@@ -89,7 +92,7 @@ def add_purchase():
             total_tax = 0
             
             for i, product_id in enumerate(product_ids):
-                product = Product.query.get(product_id)
+                product = db.session.get(Product, int(product_id), with_for_update=True)
                 if not product or product.company_id != company_id:
                     flash('Invalid product.', 'danger')
                     return redirect(url_for('purchases.add_purchase'))
@@ -172,6 +175,8 @@ def add_purchase():
                 )
                 db.session.add(movement)
             
+            refresh_products(company_id, [item['product'].id for item in purchase_items])
+            invalidate(company_id, 'purchases', 'stock')
             db.session.commit()
             
             flash('Purchase created successfully.', 'success')
@@ -191,7 +196,10 @@ def add_purchase():
 @require_roles('owner')
 def purchase_detail(purchase_id):
     """View purchase details"""
-    purchase = Purchase.query.get(purchase_id)
+    purchase = db.session.get(Purchase, purchase_id, options=[
+        selectinload(Purchase.items),
+        joinedload(Purchase.supplier),
+    ])
     if not purchase or purchase.company_id != current_user.company_id:
         flash('Purchase not found.', 'danger')
         return redirect(url_for('purchases.purchases_list'))
@@ -320,7 +328,7 @@ def process_return(purchase_id):
             db.session.add(return_record)
             
             # Update stock
-            product = Product.query.get(product_id)
+            product = db.session.get(Product, product_id, with_for_update=True, populate_existing=True)
             product.quantity -= quantity
             product.updated_date = datetime.utcnow()
             
@@ -334,6 +342,7 @@ def process_return(purchase_id):
             )
             db.session.add(movement)
             
+            invalidate(product.company_id, 'stock')
             db.session.commit()
             flash('Return processed successfully.', 'success')
             return redirect(url_for('purchases.purchase_detail', purchase_id=purchase_id))
@@ -2,8 +2,12 @@ from flask import Blueprint, render_template, request, jsonify, send_file
 from flask_login import login_required, current_user
 from app.utils import require_roles
 from app.models import db, Sale, Purchase, Product, Customer, Supplier, StockMovement, Expense, SalesReturn, PurchaseReturn
-from datetime import datetime, timedelta
+from app.valuation import valuation_as_of, valuation_totals
+from app.jobs import background_view
+from app.expiry import expiring_products
+from datetime import datetime
 from sqlalchemy import and_, func
+from sqlalchemy.orm import contains_eager, joinedload
 import csv
 import io
 
@@ -19,6 +23,7 @@ def reports_home():
 
 @reports_bp.route('/sales')
 @login_required
+@background_view
 def sales_report():
     """Sales report"""
     company_id = current_user.company_id
@@ -89,7 +94,7 @@ def sales_returns_report():
     """Sales returns report"""
     company_id = current_user.company_id
     
-    returns = db.session.query(SalesReturn).join(Sale).filter(
+    returns = db.session.query(SalesReturn).join(Sale).options(contains_eager(SalesReturn.sale)).filter(
         Sale.company_id == company_id
     ).order_by(SalesReturn.return_date.desc()).all()
     
@@ -99,6 +104,7 @@ def sales_returns_report():
 @reports_bp.route('/purchase')
 @login_required
 @require_roles('owner')
+@background_view
 def purchase_report():
     """Purchase report"""
     company_id = current_user.company_id
@@ -162,7 +168,10 @@ def purchase_returns_report():
     """Purchase returns report"""
     company_id = current_user.company_id
     
-    returns = db.session.query(PurchaseReturn).join(Purchase).filter(
+    returns = db.session.query(PurchaseReturn).join(Purchase).options(
+        contains_eager(PurchaseReturn.purchase),
+        joinedload(PurchaseReturn.product),
+    ).filter(
         Purchase.company_id == company_id
     ).order_by(PurchaseReturn.return_date.desc()).all()
     
@@ -172,6 +181,7 @@ def purchase_returns_report():
 @reports_bp.route('/purchases')
 @login_required
 @require_roles('owner')
+@background_view
 def purchases_report():
     """Purchase report"""
     company_id = current_user.company_id
@@ -230,6 +240,7 @@ def purchases_report():
 
 @reports_bp.route('/inventory')
 @login_required
+@background_view
 def inventory_report():
     """Inventory report"""
     company_id = current_user.company_id
@@ -288,23 +299,15 @@ def inventory_report():
 
 @reports_bp.route('/expiry')
 @login_required
+@background_view
 def expiry_report():
     """Expiry report"""
     company_id = current_user.company_id
-    days_filter = request.args.get('days', '30', type=int)
+    days_filter = request.args.get('days', 30, type=int)
     export_format = request.args.get('export', '')
     
     today = datetime.utcnow().date()
-    expiry_date_limit = today + timedelta(days=days_filter)
-    
-    products = Product.query.filter(
-        and_(
-            Product.company_id == company_id,
-            Product.expiry_date.isnot(None),
-            Product.expiry_date <= expiry_date_limit,
-            Product.is_active == True
-        )
-    ).order_by(Product.expiry_date).all()
+    products = expiring_products(company_id, days_filter)
     
     # Export to CSV
     if export_format == 'csv':
@@ -335,6 +338,56 @@ def expiry_report():
                          days_filter=days_filter)
 
 
+@reports_bp.route('/stock-valuation')
+@login_required
+@require_roles('owner')
+@background_view
+def stock_valuation_report():
+    """Stock valuation by category at the end of a given date"""
+    company_id = current_user.company_id
+    valuation_date = request.args.get('date', '')
+    export_format = request.args.get('export', '')
+
+    try:
+        as_of = datetime.strptime(valuation_date, '%Y-%m-%d').date()
+    except ValueError:
+        as_of = datetime.utcnow().date()
+        valuation_date = as_of.strftime('%Y-%m-%d')
+
+    rows = valuation_as_of(company_id, as_of)
+    totals = valuation_totals(rows)
+
+    # Export to CSV
+    if export_format == 'csv':
+        output = io.StringIO()
+        writer = csv.writer(output)
+        writer.writerow(['Category', 'Products', 'Quantity', 'Value at Cost', 'Value at MRP'])
+
+        for row in rows:
+            writer.writerow([
+                row['category'],
+                row['product_count'],
+                row['quantity'],
+                round(row['cost_value'], 2),
+                round(row['mrp_value'], 2)
+            ])
+        writer.writerow(['Total', totals['product_count'], totals['quantity'],
+                         round(totals['cost_value'], 2), round(totals['mrp_value'], 2)])
+
+        output.seek(0)
+        return send_file(
+            io.BytesIO(output.getvalue().encode()),
+            mimetype='text/csv',
+            as_attachment=True,
+            download_name=f'stock_valuation_{as_of.strftime("%Y%m%d")}.csv'
+        )
+
+    return render_template('reports/stock_valuation.html',
+                         rows=rows,
+                         totals=totals,
+                         valuation_date=valuation_date)
+
+
 @reports_bp.route('/profit-loss')
 @login_required
 @require_roles('owner')
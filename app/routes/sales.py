@@ -1,19 +1,48 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, send_file
+from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, send_file, current_app
 from flask_login import login_required, current_user
-from app.models import db, Sale, SaleItem, Product, Customer, SalesReturn, StockMovement
-from datetime import datetime
+from app.models import db, Company, Sale, SaleItem, Product, Customer, SalesReturn, StockMovement
+from app.carts import open_cart, get_cart, set_line, add_line, cart_holds, release_cart, cart_payload
+from app.reservations import InsufficientStock, lock_products, drop_expired, available_to_sell
+from app.jobs import background_view
+from app.rollups import invalidate_rollup
+from app.cache import invalidate
+from app.http_cache import page_etag, not_modified, revalidated
+from app.uploads import read_upload
+from app.catalog import (CATALOG_FIELDS, catalog_version, version_token, parse_version, catalog_etag,
+                         catalog_rows, removed_ids, snapshot)
+from datetime import datetime, timedelta, timezone
 from sqlalchemy import and_, func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import selectinload, joinedload, contains_eager
+import gzip
 import io
-import os
-from reportlab.lib.pagesizes import A4, letter
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, PageBreak, Image, KeepTogether
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib.units import inch, mm
-from reportlab.lib import colors
-from reportlab.lib.enums import TA_LEFT, TA_CENTER, TA_RIGHT
 
 sales_bp = Blueprint('sales', __name__, url_prefix='/sales')
 
+SYNC_BATCH_LIMIT = 100
+# Oldest offline sale a POS may sync; older ones would backdate invoices into closed days
+SYNC_MAX_AGE_DAYS = 7
+
+
+def invoice_version(sale_id):
+    """(company_id, updated dates of the sale, company, customer and products) for an invoice page's ETag"""
+    return db.session.query(
+        Sale.company_id, Sale.updated_date, Company.updated_date, Customer.updated_date, func.max(Product.updated_date)
+    ).join(Company, Sale.company_id == Company.id).outerjoin(Customer, Sale.customer_id == Customer.id).outerjoin(
+        SaleItem, SaleItem.sale_id == Sale.id
+    ).outerjoin(Product, SaleItem.product_id == Product.id).filter(Sale.id == sale_id).group_by(
+        Sale.id, Sale.company_id, Sale.updated_date, Company.updated_date, Customer.updated_date
+    ).first()
+
+
+def load_invoice(sale_id):
+    """Sale with everything an invoice page renders: items with products, customer, company"""
+    return db.session.get(Sale, sale_id, options=[
+        selectinload(Sale.items),
+        joinedload(Sale.customer),
+        joinedload(Sale.company),
+    ])
+
 
 def generate_invoice_number():
     """Generate unique invoice number"""
@@ -23,6 +52,182 @@ def generate_invoice_number():
     return f"INV{timestamp}{random_suffix}"
 
 
+def find_client_sale(company_id, client_ref):
+    """Sale already recorded for a POS-generated reference, if any"""
+    if not client_ref:
+        return None
+    return Sale.query.filter_by(company_id=company_id, client_ref=client_ref).first()
+
+
+def parse_client_date(value):
+    """Naive UTC datetime for a POS timestamp, never later than now
+
+    Raises ValueError for timestamps more than SYNC_MAX_AGE_DAYS old.
+    """
+    now = datetime.utcnow()
+    if not value:
+        return now
+    try:
+        moment = datetime.fromisoformat(str(value))
+    except ValueError:
+        return now
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+    if moment < now - timedelta(days=SYNC_MAX_AGE_DAYS):
+        raise ValueError(f'Sale is more than {SYNC_MAX_AGE_DAYS} days old; ring it up again')
+    return min(moment, now)
+
+
+def record_sale(company_id, data, client_ref=None, invoice_date=None, cart_id=None):
+    """Validate a POS cart, add the sale, its items and stock movements to the session
+    
+    Stock reserved for anything but the cart `cart_id` can't be sold; that
+    cart's holds are released once its stock is deducted.
+    Raises ValueError (InsufficientStock for stock shortfalls) when the cart
+    can't be sold; the caller commits or rolls back.
+    """
+    items = data.get('items', [])
+    customer_id = data.get('customer_id')
+    customer_name = data.get('customer_name', '')
+    customer_phone = data.get('customer_phone', '')
+    payment_method = data.get('payment_method', 'cash')
+    discount = float(data.get('discount', 0))
+    include_tax = data.get('include_tax', True)
+    notes = data.get('notes', '')
+    
+    if not items:
+        raise ValueError('Cart is empty')
+    
+    # Validate and prepare items
+    sale_items = []
+    subtotal = 0
+    total_tax = 0
+    
+    # Accept product identifier from front-end as either 'product_id' or 'id'
+    pids = []
+    for item in items:
+        try:
+            pids.append(int(item.get('product_id') or item.get('id')))
+        except Exception:
+            raise ValueError('Invalid product')
+    
+    # Load every product in one query and lock the rows (in id order, so
+    # concurrent checkouts can't deadlock) until the sale commits
+    products = {p.id: p for p in lock_products(company_id, pids)}
+    drop_expired(products.values())
+    held = cart_holds(cart_id) if cart_id else {}
+    
+    for pid, item in zip(pids, items):
+        product = products.get(pid)
+        if not product:
+            raise ValueError('Invalid product')
+        
+        quantity = int(item.get('quantity', 1))
+        available = product.quantity - product.reserved_quantity + held.get(pid, 0)
+        if available < quantity:
+            raise InsufficientStock(product, max(available, 0))
+        
+        unit_price = float(item.get('price', product.selling_price))
+        item_discount = float(item.get('discount', 0))
+        
+        tax_amount = 0
+        if include_tax:
+            tax_amount = (unit_price * quantity - item_discount) * (product.tax_percentage / 100)
+        
+        item_total = (unit_price * quantity) - item_discount + tax_amount
+        
+        sale_items.append({
+            'product': product,
+            'quantity': quantity,
+            'unit_price': unit_price,
+            'tax_percentage': product.tax_percentage,
+            'tax_amount': tax_amount,
+            'item_discount': item_discount,
+            'item_total': item_total,
+            'batch_number': product.batch_number
+        })
+        
+        subtotal += (unit_price * quantity) - item_discount
+        total_tax += tax_amount
+    
+    # Calculate total
+    total_amount = subtotal + total_tax - discount
+    if total_amount < 0:
+        total_amount = 0
+    
+    # Create sale
+    sale = Sale(
+        company_id=company_id,
+        customer_id=customer_id,
+        invoice_number=generate_invoice_number(),
+        invoice_date=invoice_date or datetime.utcnow(),
+        client_ref=client_ref,
+        customer_name=customer_name,
+        customer_phone=customer_phone,
+        doctor_id=data.get('doctor_id'),
+        subtotal=subtotal,
+        tax_amount=total_tax,
+        discount_amount=discount,
+        total_amount=total_amount,
+        payment_method=payment_method,
+        payment_status='paid' if payment_method != 'credit' else 'pending',
+        notes=notes
+    )
+    
+    db.session.add(sale)
+    db.session.flush()
+    # An offline sale synced after its day was rolled up
+    invalidate_rollup(company_id, sale.invoice_date.date())
+    invalidate(company_id, 'sales', 'stock')
+    
+    # Add items and deduct stock
+    for item in sale_items:
+        sale_item = SaleItem(
+            sale_id=sale.id,
+            product_id=item['product'].id,
+            batch_number=item['batch_number'],
+            quantity=item['quantity'],
+            unit_price=item['unit_price'],
+            tax_percentage=item['tax_percentage'],
+            tax_amount=item['tax_amount'],
+            discount_amount=item['item_discount'],
+            total_amount=item['item_total']
+        )
+        db.session.add(sale_item)
+        
+        # Deduct stock
+        product = item['product']
+        product.quantity -= item['quantity']
+        product.updated_date = datetime.utcnow()
+        
+        # Record stock movement
+        movement = StockMovement(
+            product_id=product.id,
+            movement_type='sale',
+            quantity=-item['quantity'],
+            batch_number=item['batch_number'],
+            reference_id=sale.id
+        )
+        db.session.add(movement)
+    if cart_id:
+        release_cart(cart_id, products.values())
+    
+    # Update customer balance if credit sale
+    if customer_id and payment_method == 'credit':
+        customer = Customer.query.get(customer_id)
+        if customer:
+            customer.current_balance += total_amount
+    # Associate consulting doctor if provided
+    try:
+        doc_id = data.get('doctor_id')
+        if doc_id:
+            sale.doctor_id = int(doc_id)
+    except Exception:
+        pass
+    
+    return sale
+
+
 @sales_bp.route('/pos')
 @login_required
 def pos():
@@ -62,160 +267,257 @@ def search_products():
         'sku': p.sku,
         'price': p.selling_price,
         'mrp': p.mrp,
-        'quantity': p.quantity,
+        'quantity': available_to_sell(p),
+        'on_hand': p.quantity,
         'tax_percentage': p.tax_percentage,
         'batch_number': p.batch_number
     } for p in products])
 
 
+@sales_bp.route('/api/catalog')
+@login_required
+def catalog_snapshot():
+    """Full POS catalog, gzip-compressed and revalidated by ETag"""
+    company_id = current_user.company_id
+    newest, count = catalog_version(company_id)
+    gzipped = 'gzip' in request.accept_encodings
+    etag = catalog_etag(company_id, newest, count) + ('-gz' if gzipped else '')
+    
+    if request.if_none_match.contains(etag):
+        response = current_app.response_class(status=304)
+    else:
+        body = snapshot(company_id, newest, count, catalog_etag(company_id, newest, count))
+        response = current_app.response_class(body if gzipped else gzip.decompress(body),
+                                              mimetype='application/json')
+        if gzipped:
+            response.headers['Content-Encoding'] = 'gzip'
+    response.set_etag(etag)
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+
+@sales_bp.route('/api/catalog/changes')
+@login_required
+def catalog_changes():
+    """Catalog rows changed since a version returned by the snapshot or a previous call"""
+    since = parse_version(request.args.get('since'))
+    if since is None:
+        return jsonify({'success': False, 'message': 'A valid catalog version is required'}), 400
+    
+    company_id = current_user.company_id
+    newest, count = catalog_version(company_id)
+    return jsonify({
+        'version': version_token(newest),
+        'count': count,
+        'fields': CATALOG_FIELDS,
+        'rows': catalog_rows(company_id, since=since or None),
+        'removed': removed_ids(company_id, since or None),
+    })
+
+
 @sales_bp.route('/checkout', methods=['POST'])
 @login_required
 def checkout():
     """Process checkout and create invoice"""
     try:
         data = request.json
-        items = data.get('items', [])
-        customer_id = data.get('customer_id')
-        customer_name = data.get('customer_name', '')
-        customer_phone = data.get('customer_phone', '')
-        payment_method = data.get('payment_method', 'cash')
-        discount = float(data.get('discount', 0))
-        include_tax = data.get('include_tax', True)
-        notes = data.get('notes', '')
-        
-        if not items:
-            return jsonify({'success': False, 'message': 'Cart is empty'}), 400
-        
         company_id = current_user.company_id
+        # A retried checkout (e.g. after a timeout) returns the sale it already made
+        client_ref = data.get('client_ref') or None
+        sale = find_client_sale(company_id, client_ref)
+        if sale is None:
+            sale = record_sale(company_id, data, client_ref=client_ref)
+            db.session.commit()
         
-        # Validate and prepare items
-        sale_items = []
-        subtotal = 0
-        total_tax = 0
-        
-        for item in items:
-            # Accept product identifier from front-end as either 'product_id' or 'id'
-            pid = item.get('product_id') or item.get('id')
-            try:
-                pid = int(pid)
-            except Exception:
-                pid = None
+        return jsonify({
+            'success': True,
+            'message': 'Sale completed successfully',
+            'invoice_number': sale.invoice_number,
+            'sale_id': sale.id,
+            'total_amount': sale.total_amount
+        })
+    
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': str(e)}), 400
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': str(e)}), 500
 
-            product = Product.query.get(pid) if pid else None
-            if not product or product.company_id != company_id:
-                return jsonify({'success': False, 'message': 'Invalid product'}), 400
-            
-            quantity = int(item.get('quantity', 1))
-            if product.quantity < quantity:
-                return jsonify({'success': False, 'message': f'Insufficient stock for {product.product_name}'}), 400
-            
-            unit_price = float(item.get('price', product.selling_price))
-            item_discount = float(item.get('discount', 0))
-            
-            tax_amount = 0
-            if include_tax:
-                tax_amount = (unit_price * quantity - item_discount) * (product.tax_percentage / 100)
-            
-            item_total = (unit_price * quantity) - item_discount + tax_amount
-            
-            sale_items.append({
-                'product': product,
-                'quantity': quantity,
-                'unit_price': unit_price,
-                'tax_percentage': product.tax_percentage,
-                'tax_amount': tax_amount,
-                'item_discount': item_discount,
-                'item_total': item_total,
-                'batch_number': product.batch_number
-            })
-            
-            subtotal += (unit_price * quantity) - item_discount
-            total_tax += tax_amount
-        
-        # Calculate total
-        total_amount = subtotal + total_tax - discount
-        if total_amount < 0:
-            total_amount = 0
-        
-        # Create sale
-        sale = Sale(
-            company_id=company_id,
-            customer_id=customer_id,
-            invoice_number=generate_invoice_number(),
-            invoice_date=datetime.utcnow(),
-            customer_name=customer_name,
-            customer_phone=customer_phone,
-            doctor_id=data.get('doctor_id'),
-            subtotal=subtotal,
-            tax_amount=total_tax,
-            discount_amount=discount,
-            total_amount=total_amount,
-            payment_method=payment_method,
-            payment_status='paid' if payment_method != 'credit' else 'pending',
-            notes=notes
-        )
-        
-        db.session.add(sale)
-        db.session.flush()
-        
-        # Add items and deduct stock
-        for item in sale_items:
-            sale_item = SaleItem(
-                sale_id=sale.id,
-                product_id=item['product'].id,
-                batch_number=item['batch_number'],
-                quantity=item['quantity'],
-                unit_price=item['unit_price'],
-                tax_percentage=item['tax_percentage'],
-                tax_amount=item['tax_amount'],
-                discount_amount=item['item_discount'],
-                total_amount=item['item_total']
-            )
-            db.session.add(sale_item)
-            
-            # Deduct stock
-            product = item['product']
-            product.quantity -= item['quantity']
-            product.updated_date = datetime.utcnow()
-            
-            # Record stock movement
-            movement = StockMovement(
-                product_id=product.id,
-                movement_type='sale',
-                quantity=-item['quantity'],
-                batch_number=item['batch_number'],
-                reference_id=sale.id
-            )
-            db.session.add(movement)
-        
-        # Update customer balance if credit sale
-        if customer_id and payment_method == 'credit':
-            customer = Customer.query.get(customer_id)
-            if customer:
-                customer.current_balance += total_amount
-        # Associate consulting doctor if provided
-        try:
-            doc_id = data.get('doctor_id')
-            if doc_id:
-                sale.doctor_id = int(doc_id)
-        except Exception:
-            pass
-        
+
+@sales_bp.route('/carts', methods=['POST'])
+@login_required
+def create_cart():
+    """Open a server-side cart"""
+    cart = open_cart(current_user.company_id, current_user.id)
+    db.session.commit()
+    return jsonify({'success': True, 'cart': cart_payload(cart)}), 201
+
+
+@sales_bp.route('/carts/<int:cart_id>')
+@login_required
+def view_cart(cart_id):
+    """Cart lines and totals"""
+    cart = get_cart(current_user.company_id, cart_id)
+    if cart is None:
+        return jsonify({'success': False, 'message': 'Cart not found'}), 404
+    return jsonify({'success': True, 'cart': cart_payload(cart)})
+
+
+def change_cart(cart_id, change):
+    """Apply change(cart) to an open cart of the current company and return the cart"""
+    try:
+        cart = get_cart(current_user.company_id, cart_id, lock=True)
+        if cart is None:
+            return jsonify({'success': False, 'message': 'Cart not found'}), 404
+        if cart.status != 'open':
+            return jsonify({'success': False, 'message': 'Cart is already checked out'}), 400
+        change(cart)
         db.session.commit()
+        return jsonify({'success': True, 'cart': cart_payload(cart)})
+    except InsufficientStock as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': str(e), 'product_id': e.product_id,
+                        'available': e.available}), 400
+    except (TypeError, ValueError) as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': str(e)}), 400
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+
+@sales_bp.route('/carts/<int:cart_id>/lines', methods=['POST'])
+@login_required
+def add_cart_line(cart_id):
+    """Add units of a product, priced and held as they are added"""
+    data = request.json or {}
+    return change_cart(cart_id, lambda cart: add_line(cart, int(data.get('product_id')),
+                                                      int(data.get('quantity', 1))))
+
+
+@sales_bp.route('/carts/<int:cart_id>/lines/<int:product_id>', methods=['PUT'])
+@login_required
+def update_cart_line(cart_id, product_id):
+    """Set the quantity of a product in the cart; 0 removes it"""
+    data = request.json or {}
+    return change_cart(cart_id, lambda cart: set_line(cart, product_id, int(data.get('quantity'))))
+
+
+@sales_bp.route('/carts/<int:cart_id>/lines/<int:product_id>', methods=['DELETE'])
+@login_required
+def remove_cart_line(cart_id, product_id):
+    """Remove a product from the cart"""
+    return change_cart(cart_id, lambda cart: set_line(cart, product_id, 0))
+
+
+@sales_bp.route('/carts/<int:cart_id>/checkout', methods=['POST'])
+@login_required
+def checkout_cart(cart_id):
+    """Turn a cart into a sale; only billing details are posted"""
+    try:
+        data = request.json or {}
+        company_id = current_user.company_id
+        cart = get_cart(company_id, cart_id, lock=True)
+        if cart is None:
+            return jsonify({'success': False, 'message': 'Cart not found'}), 404
+        
+        if cart.status == 'open':
+            data['items'] = [{'product_id': line.product_id, 'quantity': line.quantity, 'price': line.unit_price}
+                             for line in cart.lines]
+            sale = record_sale(company_id, data, client_ref=data.get('client_ref') or None, cart_id=cart.id)
+            cart.status = 'checked_out'
+            cart.sale = sale
+            db.session.commit()
+        else:
+            # Already checked out (e.g. a retried request): report the same sale
+            sale = cart.sale
         
         return jsonify({
             'success': True,
             'message': 'Sale completed successfully',
             'invoice_number': sale.invoice_number,
             'sale_id': sale.id,
-            'total_amount': total_amount
+            'total_amount': sale.total_amount
         })
     
+    except InsufficientStock as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': str(e), 'product_id': e.product_id,
+                        'available': e.available}), 400
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': str(e)}), 400
     except Exception as e:
         db.session.rollback()
         return jsonify({'success': False, 'message': str(e)}), 500
 
 
+@sales_bp.route('/sync', methods=['POST'])
+@login_required
+def sync_sales():
+    """Record sales queued by an offline POS, in queue order
+    
+    Each sale commits on its own and is identified by its client_ref, so a
+    batch can be resent safely. Per-sale status: 'created', 'duplicate'
+    (already synced), 'conflict' (not enough stock), 'rejected' (invalid)
+    or 'error'; processing stops at the first error so the rest keep their
+    order and are retried.
+    """
+    queued = (request.json or {}).get('sales') or []
+    if len(queued) > SYNC_BATCH_LIMIT:
+        return jsonify({'success': False, 'message': f'At most {SYNC_BATCH_LIMIT} sales per batch'}), 400
+    
+    company_id = current_user.company_id
+    results = []
+    for data in queued:
+        client_ref = str(data.get('client_ref') or '').strip()[:64]
+        if not client_ref:
+            results.append({'client_ref': None, 'status': 'rejected', 'message': 'client_ref is required'})
+            continue
+        result = {'client_ref': client_ref}
+        sale = find_client_sale(company_id, client_ref)
+        if sale is not None:
+            result['status'] = 'duplicate'
+        else:
+            try:
+                # A sale queued from a server-side cart closes it, releasing its holds
+                cart = get_cart(company_id, int(data['cart_id']), lock=True) if data.get('cart_id') else None
+                if cart is not None and cart.status != 'open':
+                    cart = None
+                sale = record_sale(company_id, data, client_ref=client_ref,
+                                   invoice_date=parse_client_date(data.get('created_at')),
+                                   cart_id=cart.id if cart else None)
+                if cart is not None:
+                    cart.status = 'checked_out'
+                    cart.sale = sale
+                db.session.commit()
+                result['status'] = 'created'
+            except InsufficientStock as e:
+                db.session.rollback()
+                result.update(status='conflict', message=str(e), product_id=e.product_id, available=e.available)
+            except ValueError as e:
+                db.session.rollback()
+                result.update(status='rejected', message=str(e))
+            except IntegrityError:
+                # Another request synced the same sale first
+                db.session.rollback()
+                sale = find_client_sale(company_id, client_ref)
+                result['status'] = 'duplicate' if sale else 'error'
+            except Exception as e:
+                db.session.rollback()
+                result.update(status='error', message=str(e))
+        if sale is not None and result['status'] in ('created', 'duplicate'):
+            result.update(invoice_number=sale.invoice_number, sale_id=sale.id, total_amount=sale.total_amount)
+        results.append(result)
+        if result['status'] == 'error':
+            break
+    
+    return jsonify({'success': True, 'results': results})
+
+
 @sales_bp.route('/invoices')
 @login_required
 def invoices_list():
@@ -244,33 +546,54 @@ def invoices_list():
 @login_required
 def invoice_detail(sale_id):
     """View invoice"""
-    sale = Sale.query.get(sale_id)
-    if not sale or sale.company_id != current_user.company_id:
+    version = invoice_version(sale_id)
+    if not version or version[0] != current_user.company_id:
         flash('Invoice not found.', 'danger')
         return redirect(url_for('sales.invoices_list'))
     
-    return render_template('sales/invoice_detail.html', sale=sale)
+    etag = page_etag('sales/invoice_detail.html', sale_id, *version[1:])
+    response = not_modified(etag)
+    if response is not None:
+        return response
+    
+    sale = load_invoice(sale_id)
+    return revalidated(render_template('sales/invoice_detail.html', sale=sale), etag)
 
 
 @sales_bp.route('/invoices/<int:sale_id>/print')
 @login_required
 def print_invoice(sale_id):
     """Print invoice"""
-    sale = Sale.query.get(sale_id)
-    if not sale or sale.company_id != current_user.company_id:
+    version = invoice_version(sale_id)
+    if not version or version[0] != current_user.company_id:
         return jsonify({'success': False, 'message': 'Invoice not found'}), 404
     
-    return render_template('sales/print_invoice.html', sale=sale)
+    etag = page_etag('sales/print_invoice.html', sale_id, *version[1:])
+    response = not_modified(etag)
+    if response is not None:
+        return response
+    
+    sale = load_invoice(sale_id)
+    return revalidated(render_template('sales/print_invoice.html', sale=sale), etag)
 
 
 @sales_bp.route('/invoices/<int:sale_id>/pdf')
 @login_required
+@background_view
 def download_invoice_pdf(sale_id):
     """Download invoice as PDF with professional formatting and logo"""
-    sale = Sale.query.get(sale_id)
+    sale = load_invoice(sale_id)
     if not sale or sale.company_id != current_user.company_id:
         return jsonify({'success': False, 'message': 'Invoice not found'}), 404
     
+    # reportlab is only loaded once a worker renders its first PDF
+    from reportlab.lib.pagesizes import A4
+    from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, Image
+    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+    from reportlab.lib.units import inch
+    from reportlab.lib import colors
+    from reportlab.lib.enums import TA_CENTER, TA_RIGHT
+    
     try:
         # Create PDF buffer (A4) and layout
         buffer = io.BytesIO()
@@ -342,17 +665,12 @@ def download_invoice_pdf(sale_id):
 
         comp_info = '<br/>'.join(comp_lines)
 
-        # Resolve logo path relative to static folder if needed
-        logo_path = company.logo_path
-        logo_full = None
-        if logo_path:
-            candidate = os.path.join(os.getcwd(), 'app', 'static', logo_path)
-            if os.path.exists(candidate):
-                logo_full = candidate
+        # The 300 px copy of the logo keeps the PDF small
+        logo_data = read_upload(company.logo_path, 'pdf')
 
-        if logo_full:
+        if logo_data:
             try:
-                img = Image(logo_full, width=1.0*inch, height=1.0*inch)
+                img = Image(io.BytesIO(logo_data), width=1.0*inch, height=1.0*inch)
                 header_data.append([img, Paragraph(f"<b>{company.company_name}</b><br/>{comp_info}", subtitle_style)])
             except:
                 header_data.append([Paragraph(f"<b>{company.company_name}</b><br/>{comp_info}", subtitle_style)])
@@ -567,7 +885,8 @@ def download_invoice_pdf(sale_id):
 @login_required
 def cancel_invoice(sale_id):
     """Cancel invoice"""
-    sale = Sale.query.get(sale_id)
+    # Lock the invoice so two cancel requests can't both restore stock
+    sale = Sale.query.filter_by(id=sale_id).with_for_update().first()
     if not sale or sale.company_id != current_user.company_id:
         flash('Invoice not found.', 'danger')
         return redirect(url_for('sales.invoices_list'))
@@ -578,6 +897,7 @@ def cancel_invoice(sale_id):
     
     try:
         reason = request.form.get('cancellation_reason', '')
+        lock_products(sale.company_id, [item.product_id for item in sale.items])
         
         # Reverse stock movements
         for item in sale.items:
@@ -603,6 +923,8 @@ def cancel_invoice(sale_id):
         sale.is_cancelled = True
         sale.cancellation_reason = reason
         sale.updated_date = datetime.utcnow()
+        invalidate_rollup(sale.company_id, sale.invoice_date.date())
+        invalidate(sale.company_id, 'sales', 'stock')
         
         db.session.commit()
         flash('Invoice cancelled successfully.', 'success')
@@ -619,7 +941,7 @@ def cancel_invoice(sale_id):
 def sales_returns_list():
     """List all sales returns"""
     company_id = current_user.company_id
-    returns = db.session.query(SalesReturn).join(Sale).filter(
+    returns = db.session.query(SalesReturn).join(Sale).options(contains_eager(SalesReturn.sale)).filter(
         Sale.company_id == company_id
     ).order_by(SalesReturn.return_date.desc()).all()
     
@@ -630,7 +952,7 @@ def sales_returns_list():
 @login_required
 def process_return(sale_id):
     """Process sales return"""
-    sale = Sale.query.get(sale_id)
+    sale = load_invoice(sale_id)
     if not sale or sale.company_id != current_user.company_id:
         flash('Invoice not found.', 'danger')
         return redirect(url_for('sales.invoices_list'))
@@ -647,6 +969,14 @@ def process_return(sale_id):
                 for item in sale.items:
                     item.product.quantity += item.quantity
                     item.product.updated_date = datetime.utcnow()
+                    db.session.add(StockMovement(
+                        product_id=item.product_id,
+                        movement_type='return',
+                        quantity=item.quantity,
+                        batch_number=item.batch_number,
+                        reference_id=sale.id,
+                        reason=f'Customer return on invoice {sale.invoice_number}'
+                    ))
             else:
                 # Partial return
                 product_id = request.form.get('product_id', type=int)
@@ -662,6 +992,14 @@ def process_return(sale_id):
                 product = sale_item.product
                 product.quantity += quantity
                 product.updated_date = datetime.utcnow()
+                db.session.add(StockMovement(
+                    product_id=product.id,
+                    movement_type='return',
+                    quantity=quantity,
+                    batch_number=sale_item.batch_number,
+                    reference_id=sale.id,
+                    reason=f'Customer return on invoice {sale.invoice_number}'
+                ))
                 
                 # Calculate refund amount
                 return_credit = (sale_item.unit_price * quantity) + (sale_item.tax_amount * quantity / sale_item.quantity)
@@ -684,6 +1022,7 @@ def process_return(sale_id):
             if sale.customer_id and sale.payment_method == 'credit':
                 sale.customer.current_balance -= return_credit
             
+            invalidate(sale.company_id, 'stock')
             db.session.commit()
             flash('Return processed successfully.', 'success')
             return redirect(url_for('sales.invoice_detail', sale_id=sale_id))
@@ -2,6 +2,7 @@ from flask import Blueprint, render_template, request, redirect, url_for, flash
 from flask_login import login_required, current_user
 from app.models import db, User
 from app.utils import require_roles
+from app.identity import invalidate_user
 from datetime import datetime
 
 users_bp = Blueprint('users', __name__, url_prefix='/users')
@@ -72,6 +73,7 @@ def edit_user(user_id):
         user.updated_date = datetime.utcnow()
         try:
             db.session.commit()
+            invalidate_user(user.id)
             flash('User updated.', 'success')
             return redirect(url_for('users.users_list'))
         except Exception as e:
@@ -99,6 +101,7 @@ def delete_user(user_id):
     try:
         db.session.delete(user)
         db.session.commit()
+        invalidate_user(user_id)
         flash('User deleted.', 'success')
         return redirect(url_for('users.users_list'))
     except Exception as e:
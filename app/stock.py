@@ -0,0 +1,164 @@
+"""Stock ledger helpers: snapshots, reconciliation and point-in-time stock.
+
+`Product.quantity` is the operational on-hand figure that checkout, returns,
+purchases and adjustments mutate in place. `StockMovement` is the ledger of
+those changes. The functions here fold the ledger into periodic
+`StockSnapshot` runs so that both the reconciler and point-in-time queries
+only have to replay movements recorded after the most recent snapshot.
+"""
+from datetime import datetime
+from sqlalchemy import func
+from app.models import db, Product, StockMovement, StockSnapshot
+
+
+def _company_movements(company_id):
+    return db.session.query(StockMovement).join(Product).filter(Product.company_id == company_id)
+
+
+def latest_snapshot_run(company_id, as_of=None):
+    """Return (snapshot_date, last_movement_id) of the newest run, or None"""
+    query = db.session.query(StockSnapshot.snapshot_date, StockSnapshot.last_movement_id).filter(
+        StockSnapshot.company_id == company_id
+    )
+    if as_of is not None:
+        query = query.filter(StockSnapshot.snapshot_date <= as_of)
+    return query.order_by(StockSnapshot.snapshot_date.desc(), StockSnapshot.id.desc()).first()
+
+
+def _snapshot_rows(company_id, run):
+    """On-hand per (product_id, batch_number) stored for a snapshot run"""
+    if run is None:
+        return {}
+    rows = db.session.query(
+        StockSnapshot.product_id, StockSnapshot.batch_number, StockSnapshot.quantity
+    ).filter(
+        StockSnapshot.company_id == company_id,
+        StockSnapshot.snapshot_date == run.snapshot_date,
+        StockSnapshot.last_movement_id == run.last_movement_id
+    ).all()
+    return {(r.product_id, r.batch_number): r.quantity for r in rows}
+
+
+def _movement_deltas(company_id, after_id, upto_id=None, as_of=None, by_batch=True):
+    """Aggregate ledger changes recorded after a watermark in a single GROUP BY"""
+    columns = [StockMovement.product_id]
+    if by_batch:
+        columns.append(StockMovement.batch_number)
+    query = db.session.query(*columns, func.sum(StockMovement.quantity)).join(Product).filter(
+        Product.company_id == company_id,
+        StockMovement.id > after_id
+    )
+    if upto_id is not None:
+        query = query.filter(StockMovement.id <= upto_id)
+    if as_of is not None:
+        query = query.filter(StockMovement.created_date <= as_of)
+    rows = query.group_by(*columns).all()
+    if by_batch:
+        return {(r[0], r[1]): int(r[2] or 0) for r in rows}
+    return {r[0]: int(r[1] or 0) for r in rows}
+
+
+def take_snapshot(company_id, snapshot_date=None):
+    """Fold movements recorded since the previous run into a new snapshot run.
+
+    Only keys that are non-zero now, or were non-zero in the previous run,
+    are written, so a key missing from a run means zero on hand.
+    Returns the number of rows written.
+    """
+    snapshot_date = snapshot_date or datetime.utcnow()
+    previous = latest_snapshot_run(company_id)
+    after_id = previous.last_movement_id if previous else 0
+
+    watermark = _company_movements(company_id).with_entities(func.max(StockMovement.id)).scalar() or 0
+    if previous and watermark <= after_id:
+        # Nothing new in the ledger; the previous run still answers every query
+        return 0
+
+    previous_rows = _snapshot_rows(company_id, previous)
+    on_hand = dict(previous_rows)
+    for key, delta in _movement_deltas(company_id, after_id, upto_id=watermark).items():
+        on_hand[key] = on_hand.get(key, 0) + delta
+
+    rows = [
+        {
+            'company_id': company_id,
+            'product_id': product_id,
+            'batch_number': batch_number,
+            'quantity': quantity,
+            'snapshot_date': snapshot_date,
+            'last_movement_id': watermark,
+            'created_date': datetime.utcnow(),
+        }
+        for (product_id, batch_number), quantity in on_hand.items()
+        if quantity or previous_rows.get((product_id, batch_number))
+    ]
+    if rows:
+        db.session.execute(StockSnapshot.__table__.insert(), rows)
+    db.session.commit()
+    return len(rows)
+
+
+def stock_as_of(company_id, as_of, by_batch=False):
+    """On-hand quantities at a past moment, from the nearest earlier snapshot.
+
+    Returns {product_id: qty} or {(product_id, batch_number): qty}.
+    """
+    run = latest_snapshot_run(company_id, as_of=as_of)
+    base = _snapshot_rows(company_id, run)
+    after_id = run.last_movement_id if run else 0
+
+    result = {}
+    for (product_id, batch_number), quantity in base.items():
+        key = (product_id, batch_number) if by_batch else product_id
+        result[key] = result.get(key, 0) + quantity
+    for key, delta in _movement_deltas(company_id, after_id, as_of=as_of, by_batch=by_batch).items():
+        result[key] = result.get(key, 0) + delta
+    return result
+
+
+def reconcile(company_id):
+    """Compare the ledger with Product.quantity for every product of a company.
+
+    Replays only the movements recorded after the latest snapshot. Returns a
+    list of drift records, one per product whose figures disagree.
+    """
+    run = latest_snapshot_run(company_id)
+    ledger = {}
+    for (product_id, _batch), quantity in _snapshot_rows(company_id, run).items():
+        ledger[product_id] = ledger.get(product_id, 0) + quantity
+    after_id = run.last_movement_id if run else 0
+    for product_id, delta in _movement_deltas(company_id, after_id, by_batch=False).items():
+        ledger[product_id] = ledger.get(product_id, 0) + delta
+
+    products = db.session.query(Product.id, Product.product_name, Product.sku, Product.quantity).filter(
+        Product.company_id == company_id
+    ).all()
+
+    drift = []
+    for p in products:
+        expected = ledger.get(p.id, 0)
+        actual = p.quantity or 0
+        if expected != actual:
+            drift.append({
+                'product_id': p.id,
+                'product_name': p.product_name,
+                'sku': p.sku,
+                'ledger_quantity': expected,
+                'product_quantity': actual,
+                'difference': actual - expected,
+            })
+    return drift
+
+
+def correct_drift(company_id, drift=None, reason='Reconciliation correction'):
+    """Book adjustment movements so the ledger matches Product.quantity"""
+    drift = reconcile(company_id) if drift is None else drift
+    for record in drift:
+        db.session.add(StockMovement(
+            product_id=record['product_id'],
+            movement_type='adjustment',
+            quantity=record['difference'],
+            reason=reason
+        ))
+    db.session.commit()
+    return len(drift)
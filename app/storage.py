@@ -0,0 +1,178 @@
+"""Where uploaded files live.
+
+Files are written once under their final name and never modified, so a
+backend only needs to store, read, list and delete them. `UPLOAD_STORAGE`
+selects it:
+
+- `local`: a directory (`UPLOAD_FOLDER`, outside the static folder), which
+  the front-end server can serve itself through `X-Sendfile` or
+  `X-Accel-Redirect`. Files uploaded when it was `app/static/uploads`
+  (`UPLOAD_LEGACY_FOLDER`) are still read from there until
+  `flask uploads dedupe` moves them
+- `s3`: a bucket (`UPLOAD_S3_BUCKET`, keys prefixed with `UPLOAD_S3_PREFIX`)
+  on Amazon S3 or any server speaking its API, such as MinIO or LocalStack
+  for development (`UPLOAD_S3_ENDPOINT`); needs the `boto3` package
+- `package.module:ClassName`: constructed with the app; implements the
+  methods of `LocalStorage`
+
+Naming, reference counting and variants are in `app/uploads.py`.
+"""
+import io
+import os
+import shutil
+import tempfile
+from importlib import import_module
+from flask import current_app
+from werkzeug.security import safe_join
+
+NOT_FOUND_CODES = {'404', 'NoSuchKey', 'NotFound'}
+
+
+class LocalStorage:
+    """Files in the UPLOAD_FOLDER directory, falling back to UPLOAD_LEGACY_FOLDER for reads"""
+
+    def __init__(self, app):
+        self.root = app.config['UPLOAD_FOLDER']
+        os.makedirs(self.root, exist_ok=True)
+        legacy = app.config.get('UPLOAD_LEGACY_FOLDER')
+        self.legacy_root = legacy if legacy and os.path.isdir(legacy) and \
+            os.path.abspath(legacy) != os.path.abspath(self.root) else None
+
+    def _path(self, root, name):
+        path = safe_join(root, name)
+        if path is None:
+            raise ValueError(f'Invalid upload name {name!r}')
+        return path
+
+    def local_path(self, name):
+        """Absolute path of `name`, for X-Sendfile and send_file"""
+        path = self._path(self.root, name)
+        if self.legacy_root is not None and not os.path.isfile(path):
+            legacy = self._path(self.legacy_root, name)
+            if os.path.isfile(legacy):
+                return legacy
+        return path
+
+    def exists(self, name):
+        return os.path.isfile(self.local_path(name))
+
+    def save(self, name, fileobj, content_type=None):
+        target = self._path(self.root, name)
+        fd, temp_path = tempfile.mkstemp(dir=self.root, suffix='.part')
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                shutil.copyfileobj(fileobj, out)
+            os.replace(temp_path, target)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    def open(self, name):
+        return open(self.local_path(name), 'rb')
+
+    def delete(self, name):
+        for root in filter(None, (self.root, self.legacy_root)):
+            try:
+                os.remove(self._path(root, name))
+            except FileNotFoundError:
+                pass
+
+    def list(self):
+        """(name, modified timestamp) of every stored file"""
+        for root in filter(None, (self.root, self.legacy_root)):
+            with os.scandir(root) as entries:
+                for entry in entries:
+                    if entry.is_file() and not entry.name.endswith('.part'):
+                        yield entry.name, entry.stat().st_mtime
+
+    def url(self, name, expires_in):
+        """Direct download URL, when the backend has one"""
+        return None
+
+
+class S3Storage:
+    """Files in an S3 bucket; `client` is a boto3 S3 client (built from the config by default)"""
+
+    def __init__(self, app, client=None):
+        self.bucket = app.config['UPLOAD_S3_BUCKET']
+        self.prefix = app.config.get('UPLOAD_S3_PREFIX') or ''
+        if client is None:
+            import boto3
+            client = boto3.client('s3', endpoint_url=app.config.get('UPLOAD_S3_ENDPOINT') or None)
+        self.client = client
+
+    def _key(self, name):
+        if not name or '/' in name or name.startswith('.'):
+            raise ValueError(f'Invalid upload name {name!r}')
+        return self.prefix + name
+
+    def local_path(self, name):
+        return None
+
+    def exists(self, name):
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self._key(name))
+        except Exception as e:
+            if is_not_found(e):
+                return False
+            raise
+        return True
+
+    def save(self, name, fileobj, content_type=None):
+        extra = {'ContentType': content_type} if content_type else {}
+        self.client.put_object(Bucket=self.bucket, Key=self._key(name), Body=fileobj.read(), **extra)
+
+    def open(self, name):
+        body = self.client.get_object(Bucket=self.bucket, Key=self._key(name))['Body']
+        try:
+            return io.BytesIO(body.read())
+        finally:
+            body.close()
+
+    def delete(self, name):
+        self.client.delete_object(Bucket=self.bucket, Key=self._key(name))
+
+    def list(self):
+        kwargs = {'Bucket': self.bucket, 'Prefix': self.prefix}
+        while True:
+            page = self.client.list_objects_v2(**kwargs)
+            for item in page.get('Contents', ()):
+                name = item['Key'][len(self.prefix):]
+                if name and '/' not in name:
+                    yield name, item['LastModified'].timestamp()
+            if not page.get('IsTruncated'):
+                return
+            kwargs['ContinuationToken'] = page['NextContinuationToken']
+
+    def url(self, name, expires_in):
+        return self.client.generate_presigned_url(
+            'get_object', Params={'Bucket': self.bucket, 'Key': self._key(name)}, ExpiresIn=expires_in)
+
+
+def _error_code(e):
+    """Error code of a botocore ClientError (or of a stand-in raising the same shape)"""
+    return str(getattr(e, 'response', {}).get('Error', {}).get('Code', ''))
+
+
+def is_not_found(e):
+    """Whether a backend error means the file doesn't exist"""
+    return isinstance(e, FileNotFoundError) or _error_code(e) in NOT_FOUND_CODES
+
+
+def load_storage(app):
+    name = app.config.get('UPLOAD_STORAGE') or 'local'
+    if name == 'local':
+        return LocalStorage(app)
+    if name == 's3':
+        return S3Storage(app)
+    module, _, attr = name.partition(':')
+    return getattr(import_module(module), attr)(app)
+
+
+def get_storage(app=None):
+    app = app or current_app._get_current_object()
+    storage = app.extensions.get('storage')
+    if storage is None:
+        storage = app.extensions['storage'] = load_storage(app)
+    return storage
@@ -0,0 +1,428 @@
+"""Uploaded images: product photos, company logos and expense receipts.
+
+`save_upload` stores a file under the SHA-256 of its content
+(`uploads/<sha256 prefix>.<ext>`) in the configured storage backend
+(app/storage.py), so the same file uploaded twice is stored once and a name
+never changes meaning, which lets browsers cache it for good. After the
+request, the `uploads.variants` job writes the resized copies in `VARIANTS`
+next to it (`<name>_<variant>.<ext>`): thumbnails for pages, a screen-sized
+copy and a 300 px logo for PDF invoices. `upload_url` / `read_upload` pick a
+variant and fall back to the original until it exists (or for files Pillow
+can't read, such as PDF receipts).
+
+`StoredFile` counts the rows pointing at each upload: `save_upload` adds one
+and `release` drops one in the caller's transaction, so a rollback leaves the
+count alone. The scheduled `uploads.collect` job deletes uploads (and their
+variants) that have had no references for `UPLOAD_COLLECT_GRACE`, along with
+files whose request failed before it committed.
+
+`/uploads/<name>` serves them, handing the transfer to the front-end server
+with `X-Sendfile` or `X-Accel-Redirect` when `UPLOAD_SENDFILE` is set.
+
+Pillow is optional: without it only the originals are stored.
+"""
+import hashlib
+import io
+import mimetypes
+import re
+import tempfile
+import time
+from importlib.util import find_spec
+from datetime import datetime, timedelta
+import click
+from flask import current_app, request, redirect, abort, send_file, url_for, after_this_request
+from flask.cli import AppGroup
+from flask_login import login_required
+from sqlalchemy.exc import IntegrityError
+from app.models import db, Product, Company, Expense, StoredFile
+from app.jobs import task, enqueue
+from app.cache import LRU
+from app.http_cache import asset_url
+from app.storage import get_storage, is_not_found
+
+# Optional: originals only without it. Imported where images are resized, so web
+# workers that never resize one don't load it
+HAS_PILLOW = find_spec('PIL') is not None
+
+UPLOADS_DIR = 'uploads'
+IMAGE_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
+ALLOWED_EXTENSIONS = {
+    'product': IMAGE_EXTENSIONS,
+    'logo': IMAGE_EXTENSIONS,
+    'receipt': IMAGE_EXTENSIONS | {'pdf'},
+}
+# Largest width x height of each variant; images are never enlarged
+VARIANTS = {
+    'product': {'thumb': (320, 320), 'display': (1024, 1024)},
+    'logo': {'thumb': (320, 320), 'pdf': (300, 300)},
+    'receipt': {'thumb': (320, 320), 'display': (1600, 1600)},
+}
+JPEG_QUALITY = 82
+# Content-addressed originals and their variants; anything else predates them
+STORED_NAME = re.compile(r'^([0-9a-f]{32})(?:_\w+)?\.\w+$')
+# Rows that point at uploads, and the kind of upload each holds
+REFERENCES = (('product', Product, Product.image_path), ('logo', Company, Company.logo_path),
+              ('receipt', Expense, Expense.receipt_image))
+# How long a remote backend's answer to "does this variant exist" is reused
+EXISTS_CACHE_SECONDS = 60
+
+uploads_cli = AppGroup('uploads', help='Uploaded images.')
+
+
+def _extension(filename):
+    return filename.rsplit('.', 1)[1].lower() if '.' in filename else ''
+
+
+def allowed_upload(filename, kind):
+    return _extension(filename) in ALLOWED_EXTENSIONS[kind]
+
+
+def _name(path):
+    """Storage name of an upload path ('uploads/<name>'), None for other static files"""
+    prefix = UPLOADS_DIR + '/'
+    return path[len(prefix):] if path and path.startswith(prefix) else None
+
+
+def _content_type(name):
+    return mimetypes.guess_type(name)[0] or 'application/octet-stream'
+
+
+def save_upload(file, kind):
+    """Store an uploaded file of `kind` ('product', 'logo' or 'receipt') and count the reference
+    the caller is about to add; returns its path ('uploads/<name>'), or None when no file was
+    sent or its type isn't allowed"""
+    if not file or not file.filename or not allowed_upload(file.filename, kind):
+        return None
+    ext = _extension(file.filename)
+    if ext == 'jpeg':
+        ext = 'jpg'
+
+    sha = hashlib.sha256()
+    with tempfile.TemporaryFile() as buffer:
+        for chunk in iter(lambda: file.stream.read(1 << 16), b''):
+            sha.update(chunk)
+            buffer.write(chunk)
+        name = f'{sha.hexdigest()[:32]}.{ext}'
+        path = f'{UPLOADS_DIR}/{name}'
+        # Count the reference first: it waits for a collector deleting this file, which
+        # holds the StoredFile row until the file is gone
+        retain(path)
+        # Ours is the only reference: the file may have been collected, or be a stray about to be
+        ref_count = db.session.query(StoredFile.ref_count).filter(StoredFile.path == path).scalar()
+        storage = get_storage()
+        if ref_count <= 1 or not storage.exists(name):
+            buffer.seek(0)
+            storage.save(name, buffer, _content_type(name))
+
+    if HAS_PILLOW and ext in IMAGE_EXTENSIONS and _missing_variants(path, kind):
+        @after_this_request
+        def _make_variants(response):
+            enqueue('uploads.variants', unique_key=f'variants:{path}', path=path, kind=kind)
+            return response
+    return path
+
+
+def retain(path, count=1):
+    """Count `count` more rows pointing at `path`, as part of the session's transaction"""
+    counter = {StoredFile.ref_count: StoredFile.ref_count + count}
+    if db.session.query(StoredFile).filter(StoredFile.path == path).update(counter, synchronize_session=False):
+        return
+    try:
+        with db.session.begin_nested():
+            db.session.add(StoredFile(path=path, ref_count=count))
+    except IntegrityError:
+        # Stored by a concurrent request
+        db.session.query(StoredFile).filter(StoredFile.path == path).update(counter, synchronize_session=False)
+
+
+def release(path):
+    """Count one row fewer pointing at `path`; once none do, `uploads.collect` deletes it"""
+    if not path:
+        return
+    db.session.query(StoredFile).filter(StoredFile.path == path, StoredFile.ref_count > 0).update(
+        {StoredFile.ref_count: StoredFile.ref_count - 1, StoredFile.released_date: datetime.utcnow()},
+        synchronize_session=False)
+
+
+def _variant_path(path, variant, ext):
+    stem = path.rsplit('.', 1)[0]
+    return f'{stem}_{variant}.{ext}'
+
+
+def _variant_candidates(path, variant):
+    return [_variant_path(path, variant, ext) for ext in ('jpg', 'png')]
+
+
+def _exists(name, cached=True):
+    storage = get_storage()
+    if not cached or storage.local_path(name) is not None:
+        return storage.exists(name)
+    # A HEAD request per image per page is too slow for a remote bucket
+    seen = current_app.extensions.get('upload_exists')
+    if seen is None:
+        seen = current_app.extensions['upload_exists'] = LRU(4096)
+    now = time.time()
+    entry = seen.get(name)
+    if entry is None or entry[1] < now:
+        entry = (storage.exists(name), now + EXISTS_CACHE_SECONDS)
+        seen.set(name, entry)
+    return entry[0]
+
+
+def variant_of(path, variant, cached=True):
+    """Path of a stored variant of `path`, or `path` itself when there is none yet"""
+    if not _name(path) or _extension(path) not in IMAGE_EXTENSIONS:
+        return path
+    for candidate in _variant_candidates(path, variant):
+        if _exists(_name(candidate), cached):
+            return candidate
+    return path
+
+
+def upload_url(path, variant=None):
+    """URL of an upload or of one of its variants"""
+    if not path:
+        return ''
+    if variant:
+        path = variant_of(path, variant)
+    name = _name(path)
+    return url_for('upload', name=name) if name else asset_url(path)
+
+
+def read_upload(path, variant=None):
+    """Content of an upload or of one of its variants, None if missing"""
+    name = _name(variant_of(path, variant) if variant else path)
+    if not name:
+        return None
+    try:
+        with get_storage().open(name) as f:
+            return f.read()
+    except Exception as e:
+        if is_not_found(e):
+            return None
+        raise
+
+
+def _missing_variants(path, kind):
+    return [v for v in VARIANTS[kind] if variant_of(path, v, cached=False) == path]
+
+
+def make_variants(path, kind):
+    """Write the missing resized copies of an uploaded image; returns their paths"""
+    from PIL import Image, ImageOps
+    missing = _missing_variants(path, kind)
+    if not missing:
+        return []
+    storage = get_storage()
+    written = []
+    with storage.open(_name(path)) as source, Image.open(source) as original:
+        image = ImageOps.exif_transpose(original)
+        has_alpha = image.mode in ('RGBA', 'LA', 'P') and (
+            image.mode != 'P' or 'transparency' in image.info)
+        for variant in missing:
+            copy = image.copy()
+            copy.thumbnail(VARIANTS[kind][variant])
+            out = io.BytesIO()
+            if has_alpha:
+                target = _variant_path(path, variant, 'png')
+                copy.convert('RGBA').save(out, 'PNG', optimize=True)
+            else:
+                target = _variant_path(path, variant, 'jpg')
+                copy.convert('RGB').save(out, 'JPEG', quality=JPEG_QUALITY, optimize=True, progressive=True)
+            out.seek(0)
+            storage.save(_name(target), out, _content_type(target))
+            written.append(target)
+    return written
+
+
+@task('uploads.variants')
+def variants_job(ctx, path, kind):
+    """Resize a newly uploaded image"""
+    try:
+        written = make_variants(path, kind)
+    except (OSError, ValueError) as e:
+        # Not an image Pillow can read: pages keep using the original
+        return {'message': f'No variants for {path}: {e}'}
+    return {'message': f'Wrote {len(written)} variants of {path}.'}
+
+
+def referenced_uploads():
+    """(path, kind) of every upload a product, company or expense points at"""
+    for kind, model, column in REFERENCES:
+        for (path,) in db.session.query(column).filter(column.isnot(None), column != '').distinct():
+            yield path, kind
+
+
+def _delete_files(storage, path):
+    """Delete an upload and whatever variants it has; returns how many files were removed"""
+    names = [_name(path)] + [_name(c) for v in {v for kind in VARIANTS.values() for v in kind}
+                             for c in _variant_candidates(path, v)]
+    removed = 0
+    for name in names:
+        if storage.exists(name):
+            storage.delete(name)
+            removed += 1
+    return removed
+
+
+def collect_unused(grace):
+    """Delete uploads nothing has pointed at for `grace` seconds, and stored files older than
+    that without a StoredFile row (their request failed); returns the number of files removed"""
+    storage = get_storage()
+    cutoff = datetime.utcnow() - timedelta(seconds=grace)
+    removed = 0
+    unused = [path for (path,) in db.session.query(StoredFile.path).filter(
+        StoredFile.ref_count <= 0, StoredFile.released_date < cutoff)]
+    for path in unused:
+        # Unless an upload of the same file took it back meanwhile. The deleted row stays
+        # locked until the commit, so an upload of the same content waits in `retain` until
+        # the files are gone, then stores it again under a new row
+        deleted = StoredFile.query.filter(StoredFile.path == path, StoredFile.ref_count <= 0).delete(
+            synchronize_session=False)
+        if deleted and _name(path):
+            removed += _delete_files(storage, path)
+        db.session.commit()
+
+    known = set()
+    for (path,) in db.session.query(StoredFile.path):
+        match = STORED_NAME.match(_name(path) or '')
+        if match:
+            known.add(match.group(1))
+    db.session.commit()
+    oldest = time.time() - grace
+    for name, modified in list(storage.list()):
+        match = STORED_NAME.match(name)
+        if match and match.group(1) not in known and modified < oldest:
+            # Stored again since the listing: an upload of the same content committed its row
+            stored = db.session.query(StoredFile.path).filter(
+                StoredFile.path.like(f'{UPLOADS_DIR}/{match.group(1)}.%')).first()
+            db.session.commit()
+            if stored:
+                continue
+            storage.delete(name)
+            removed += 1
+    return removed
+
+
+@task('uploads.collect')
+def collect_job(ctx):
+    """Delete uploads nothing points at any more"""
+    removed = collect_unused(current_app.config.get('UPLOAD_COLLECT_GRACE', 3600))
+    return {'message': f'Deleted {removed} unused upload file(s).'}
+
+
+def serve_upload(name):
+    """An upload, sent by the front-end server when UPLOAD_SENDFILE is set"""
+    storage = get_storage()
+    content_addressed = STORED_NAME.match(name) is not None
+    try:
+        local_path = storage.local_path(name)
+    except ValueError:
+        abort(404)
+
+    if content_addressed and request.if_none_match.contains(name):
+        response = current_app.response_class(status=304)
+    else:
+        mode = current_app.config.get('UPLOAD_SENDFILE')
+        mimetype = _content_type(name)
+        if mode == 'x-accel-redirect':
+            response = current_app.response_class(mimetype=mimetype, direct_passthrough=True)
+            response.headers['X-Accel-Redirect'] = current_app.config['UPLOAD_ACCEL_PREFIX'] + name
+        elif local_path is None:
+            # Remote storage without a front-end proxy: the client downloads from the bucket
+            return redirect(storage.url(name, current_app.config.get('UPLOAD_URL_EXPIRES', 300)))
+        elif not storage.exists(name):
+            abort(404)
+        elif mode == 'x-sendfile':
+            response = current_app.response_class(mimetype=mimetype, direct_passthrough=True)
+            response.headers['X-Sendfile'] = local_path
+        else:
+            response = send_file(local_path, mimetype=mimetype, conditional=not content_addressed)
+    if content_addressed:
+        response.set_etag(name)
+    # send_file marks responses no-cache, which would make browsers revalidate every use
+    response.cache_control.no_cache = None
+    response.cache_control.private = True
+    response.cache_control.immutable = content_addressed or None
+    response.cache_control.max_age = current_app.config[
+        'STATIC_VERSIONED_MAX_AGE' if content_addressed else 'UPLOADS_MAX_AGE']
+    return response
+
+
+def init_uploads(app):
+    app.add_url_rule('/uploads/<name>', 'upload', login_required(serve_upload))
+    app.jinja_env.globals.update(upload_url=upload_url)
+    app.cli.add_command(uploads_cli)
+
+
+@uploads_cli.command('variants')
+def variants_command():
+    """Write the missing resized copies of every referenced upload."""
+    if not HAS_PILLOW:
+        raise click.ClickException('Pillow is not installed')
+    count = 0
+    for path, kind in referenced_uploads():
+        if _extension(path) not in IMAGE_EXTENSIONS or not _name(path) or not _exists(_name(path), False):
+            continue
+        try:
+            count += len(make_variants(path, kind))
+        except (OSError, ValueError) as e:
+            click.echo(f'{path}: {e}')
+    click.echo(f'Wrote {count} variant(s).')
+
+
+@uploads_cli.command('collect')
+@click.option('--grace', type=int, default=None, help='Seconds unused (default UPLOAD_COLLECT_GRACE).')
+def collect_command(grace):
+    """Delete uploads nothing points at any more."""
+    grace = current_app.config.get('UPLOAD_COLLECT_GRACE', 3600) if grace is None else grace
+    click.echo(f'Deleted {collect_unused(grace)} file(s).')
+
+
+@uploads_cli.command('dedupe')
+def dedupe_command():
+    """Move uploads stored before content addressing to content-hashed names,
+    merging identical files."""
+    storage = get_storage()
+    moved = 0
+    for old_path, ref_count in db.session.query(StoredFile.path, StoredFile.ref_count).all():
+        old_name = _name(old_path)
+        if not old_name or STORED_NAME.match(old_name):
+            continue
+        try:
+            source = storage.open(old_name)
+        except Exception as e:
+            if not is_not_found(e):
+                raise
+            click.echo(f'{old_path}: missing')
+            continue
+        with source, tempfile.TemporaryFile() as buffer:
+            sha = hashlib.sha256()
+            for chunk in iter(lambda: source.read(1 << 16), b''):
+                sha.update(chunk)
+                buffer.write(chunk)
+            ext = _extension(old_name).replace('jpeg', 'jpg')
+            name = f'{sha.hexdigest()[:32]}.{ext}'
+            if not storage.exists(name):
+                buffer.seek(0)
+                storage.save(name, buffer, _content_type(name))
+
+        path = f'{UPLOADS_DIR}/{name}'
+        kinds = []
+        for kind, model, column in REFERENCES:
+            if model.query.filter(column == old_path).update({column: path}, synchronize_session=False):
+                kinds.append(kind)
+        StoredFile.query.filter(StoredFile.path == old_path).delete(synchronize_session=False)
+        if ref_count > 0:
+            retain(path, ref_count)
+        db.session.commit()
+        _delete_files(storage, old_path)
+        moved += 1
+        click.echo(f'{old_path} -> {path}')
+        if HAS_PILLOW and ext in IMAGE_EXTENSIONS:
+            for kind in kinds:
+                try:
+                    make_variants(path, kind)
+                except (OSError, ValueError) as e:
+                    click.echo(f'{path}: {e}')
+    click.echo(f'Moved {moved} upload(s).')
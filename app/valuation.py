@@ -0,0 +1,100 @@
+"""Point-in-time inventory valuation.
+
+Historical on-hand comes from `app.stock.stock_as_of` (nearest snapshot plus
+one aggregated query over later movements). Cost is the last purchase price
+paid on or before the valuation date, falling back to the product's current
+purchase price; MRP is the product's current MRP. Results for closed dates
+(before today) never change, so they are cached in `StockValuation`.
+"""
+from datetime import datetime, time
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+from app.models import db, Product, Purchase, PurchaseItem, StockValuation
+from app.stock import stock_as_of
+
+UNCATEGORISED = 'Uncategorised'
+
+
+def _cost_prices(company_id, as_of):
+    """Last purchase unit price per product on or before `as_of`"""
+    latest = db.session.query(
+        PurchaseItem.product_id.label('product_id'),
+        func.max(PurchaseItem.id).label('item_id')
+    ).join(Purchase).filter(
+        Purchase.company_id == company_id,
+        Purchase.purchase_date <= as_of
+    ).group_by(PurchaseItem.product_id).subquery()
+
+    rows = db.session.query(PurchaseItem.product_id, PurchaseItem.unit_price).join(
+        latest, PurchaseItem.id == latest.c.item_id
+    ).all()
+    return {product_id: unit_price for product_id, unit_price in rows}
+
+
+def compute_valuation(company_id, valuation_date):
+    """Value stock at the end of `valuation_date`, grouped by category"""
+    as_of = datetime.combine(valuation_date, time.max)
+    on_hand = {pid: qty for pid, qty in stock_as_of(company_id, as_of).items() if qty}
+    if not on_hand:
+        return []
+
+    costs = _cost_prices(company_id, as_of)
+    products = db.session.query(
+        Product.id, Product.category, Product.purchase_price, Product.mrp
+    ).filter(Product.company_id == company_id, Product.id.in_(list(on_hand))).all()
+
+    by_category = {}
+    for p in products:
+        quantity = on_hand[p.id]
+        unit_cost = costs.get(p.id, p.purchase_price) or 0
+        row = by_category.setdefault(p.category or UNCATEGORISED, {
+            'category': p.category or UNCATEGORISED,
+            'product_count': 0,
+            'quantity': 0,
+            'cost_value': 0.0,
+            'mrp_value': 0.0,
+        })
+        row['product_count'] += 1
+        row['quantity'] += quantity
+        row['cost_value'] += quantity * unit_cost
+        row['mrp_value'] += quantity * (p.mrp or 0)
+    return sorted(by_category.values(), key=lambda r: r['category'])
+
+
+def valuation_as_of(company_id, valuation_date):
+    """Category valuation rows for a date, served from cache for closed dates"""
+    closed = valuation_date < datetime.utcnow().date()
+    if closed:
+        cached = StockValuation.query.filter_by(
+            company_id=company_id, valuation_date=valuation_date
+        ).order_by(StockValuation.category).all()
+        if cached:
+            return [{
+                'category': c.category,
+                'product_count': c.product_count,
+                'quantity': c.quantity,
+                'cost_value': c.cost_value,
+                'mrp_value': c.mrp_value,
+            } for c in cached]
+
+    rows = compute_valuation(company_id, valuation_date)
+    if closed and rows:
+        try:
+            db.session.execute(StockValuation.__table__.insert(), [
+                dict(row, company_id=company_id, valuation_date=valuation_date, created_date=datetime.utcnow())
+                for row in rows
+            ])
+            db.session.commit()
+        except IntegrityError:
+            # Cached concurrently, or the cache lookup ran on a lagging replica
+            db.session.rollback()
+    return rows
+
+
+def valuation_totals(rows):
+    return {
+        'product_count': sum(r['product_count'] for r in rows),
+        'quantity': sum(r['quantity'] for r in rows),
+        'cost_value': sum(r['cost_value'] for r in rows),
+        'mrp_value': sum(r['mrp_value'] for r in rows),
+    }
@@ -7,22 +7,138 @@ basedir = os.path.abspath(os.path.dirname(__file__))
 INSTANCE_DIR = os.path.join(basedir, 'instance')
 
 
+def database_url(default, env='DATABASE_URL'):
+    """Database URL from the environment, accepting the legacy postgres:// scheme.
+
+    PostgreSQL URLs without a driver use psycopg2 (requirements.txt), which COPY
+    needs; SQLAlchemy 2.1 would otherwise pick psycopg 3.
+    """
+    url = os.environ.get(env) or default
+    for scheme in ('postgres://', 'postgresql://'):
+        if url.startswith(scheme):
+            url = 'postgresql+psycopg2://' + url[len(scheme):]
+    return url
+
+
 class Config:
     """Base configuration"""
     # Use an instance-level database file by default so code changes
     # (which may overwrite repository files) don't erase data.
     INSTANCE_DIR = INSTANCE_DIR
-    SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or 'sqlite:///' + os.path.join(INSTANCE_DIR, 'pharmacy.db')
+    SQLALCHEMY_DATABASE_URI = database_url('sqlite:///' + os.path.join(INSTANCE_DIR, 'pharmacy.db'))
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+
+    # SQLite profile (applied per connection by app/database.py; ignored on other backends)
+    SQLITE_PRAGMAS = {
+        'journal_mode': 'WAL',          # readers no longer block the writer
+        'busy_timeout': 15000,          # ms to wait for the write lock before "database is locked"
+        'synchronous': 'NORMAL',        # durable with WAL, far fewer fsyncs than FULL
+        'cache_size': -32000,           # KiB (negative) of page cache per connection
+        'mmap_size': 268435456,         # 256 MB memory-mapped reads
+        'foreign_keys': 'ON',
+        'temp_store': 'MEMORY',
+    }
+    # Take the write lock at BEGIN for POST/PUT/DELETE requests
+    SQLITE_IMMEDIATE_WRITES = True
+    SQLITE_POOL_SIZE = 10
+    SQLITE_MAX_OVERFLOW = 10
+
+    # Connection pool for PostgreSQL (per worker process)
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 5))
+    DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 5))
+    DB_POOL_TIMEOUT = 30
+    DB_POOL_RECYCLE = 1800  # seconds; stay under server/proxy idle timeouts
+    DB_POOL_PRE_PING = True
+    DB_STATEMENT_TIMEOUT_MS = int(os.environ.get('DB_STATEMENT_TIMEOUT_MS', 0))
+
+    # Read replica for reports and dashboards (app/replica.py)
+    SQLALCHEMY_BINDS = {'replica': database_url(None, 'REPLICA_DATABASE_URL')} if os.environ.get('REPLICA_DATABASE_URL') else {}
+    REPLICA_BLUEPRINTS = ('reports', 'dashboard')
+    REPLICA_MAX_LAG_SECONDS = int(os.environ.get('REPLICA_MAX_LAG_SECONDS', 30))
+    REPLICA_LAG_CHECK_SECONDS = 5
+    READ_YOUR_WRITES_SECONDS = 10
+
+    # Apply pending schema migrations when the app starts (app/migrations)
+    MIGRATE_ON_STARTUP = True
+
+    # Background jobs (app/jobs); workers run with `flask jobs work`
+    JOB_BROKER = os.environ.get('JOB_BROKER', 'sqlite')  # 'sqlite', 'database' or 'module:Class'
+    JOB_BROKER_PATH = os.path.join(INSTANCE_DIR, 'jobs', 'queue.sqlite')
+    JOB_FILES_FOLDER = os.path.join(INSTANCE_DIR, 'jobs')
+    JOB_VISIBILITY_TIMEOUT = 300  # seconds before a silent worker's job is handed out again
+    JOB_RETENTION_DAYS = 7
+    JOBS_INLINE = False  # run jobs synchronously at enqueue
+    # Scheduled tasks, as cron specs in server local time (app/jobs/scheduler.py)
+    JOB_SCHEDULE = {
+        'reservations.expire': '* * * * *',
+        'reports.finalise_rollups': '15 0 * * *',
+        'inventory.snapshot_stock': '30 0 * * *',
+        'inventory.refresh_expiry': '1 * * * *',
+        'alerts.sweep': '5 * * * *',
+        'maintenance.analyze': '0 2 * * *',
+        'jobs.purge': '30 2 * * *',
+        'maintenance.vacuum': '0 3 * * 0',
+        'uploads.collect': '45 * * * *',
+    }
+
+    # Dashboard and accounting tile cache (app/cache.py)
+    CACHE_BACKEND = os.environ.get('CACHE_BACKEND', '')  # '', 'sqlite', 'redis://host:6379/0' or 'module:Class'
+    CACHE_PATH = os.path.join(INSTANCE_DIR, 'cache.sqlite')
+    CACHE_MEMORY_SIZE = 1024  # entries in each process's LRU
+    CACHE_TILE_MAX_AGE = 60  # seconds a tile is served before it is recomputed, invalidated or not
+
+    # HTTP caching and compression (app/http_cache.py)
+    COMPRESS_MIN_SIZE = 500  # bytes
+    COMPRESS_LEVEL = 6
+    STATIC_VERSIONED_MAX_AGE = 365 * 24 * 3600  # static URLs from asset_url() carry a content version
+    UPLOADS_MAX_AGE = 24 * 3600
+    # Served from app/static/vendor after `flask assets vendor`, from the CDN until then
+    VENDOR_ASSETS = {
+        'bootstrap/bootstrap.min.css': 'https://cdn.jsdelivr.net/npm/bootstrap@5.3.0/dist/css/bootstrap.min.css',
+        'bootstrap/bootstrap.bundle.min.js': 'https://cdn.jsdelivr.net/npm/bootstrap@5.3.0/dist/js/bootstrap.bundle.min.js',
+        'fontawesome/css/all.min.css': 'https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.4.0/css/all.min.css',
+        'chartjs/chart.min.js': 'https://cdnjs.cloudflare.com/ajax/libs/Chart.js/3.9.1/chart.min.js',
+    }
+    # all.min.css loads its fonts from ../webfonts/
+    VENDOR_ASSETS.update({
+        f'fontawesome/webfonts/{font}.{ext}': f'https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.4.0/webfonts/{font}.{ext}'
+        for font in ('fa-brands-400', 'fa-regular-400', 'fa-solid-900', 'fa-v4compatibility')
+        for ext in ('woff2', 'ttf')
+    })
+
+    # Request/query instrumentation and /metrics (app/instrumentation.py)
+    INSTRUMENTATION_ENABLED = os.environ.get('INSTRUMENTATION_ENABLED', '').lower() in ('1', 'true', 'yes')
+    QUERY_BUDGET = int(os.environ.get('QUERY_BUDGET', 50))
+    INSTRUMENTATION_SLOWEST = 3
+    SERVER_TIMING_HEADER = False
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+    # Show pool and pragma details at /health/db without logging in as an owner
+    HEALTH_DETAILS = os.environ.get('HEALTH_DETAILS', '').lower() in ('1', 'true', 'yes')
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'dev-secret-key-change-in-production'
     
     # Flask-Login
     REMEMBER_COOKIE_DURATION = timedelta(days=7)
     REMEMBER_COOKIE_SECURE = True
     REMEMBER_COOKIE_HTTPONLY = True
+    # Seconds a worker may reuse a cached identity (user/role/company) before reloading it
+    IDENTITY_CACHE_TTL = 30
     
     # File upload settings
-    UPLOAD_FOLDER = os.path.join(basedir, 'app', 'static', 'uploads')
+    # Outside the static folder: uploads are only served by /uploads, to logged-in users
+    UPLOAD_FOLDER = os.path.join(INSTANCE_DIR, 'uploads')
+    # Where uploads were kept before; read until `flask uploads dedupe` moves them
+    UPLOAD_LEGACY_FOLDER = os.path.join(basedir, 'app', 'static', 'uploads')
+    # Upload storage (app/storage.py): 'local' (UPLOAD_FOLDER), 's3' or 'module:Class'
+    UPLOAD_STORAGE = os.environ.get('UPLOAD_STORAGE', 'local')
+    UPLOAD_S3_BUCKET = os.environ.get('UPLOAD_S3_BUCKET')
+    UPLOAD_S3_PREFIX = os.environ.get('UPLOAD_S3_PREFIX', 'uploads/')
+    UPLOAD_S3_ENDPOINT = os.environ.get('UPLOAD_S3_ENDPOINT')  # MinIO, LocalStack, ...; None for AWS
+    # How /uploads/ responses are sent: '' (by the app), 'x-sendfile' (Apache, lighttpd; local
+    # storage only) or 'x-accel-redirect' (nginx, to an internal location at UPLOAD_ACCEL_PREFIX)
+    UPLOAD_SENDFILE = os.environ.get('UPLOAD_SENDFILE', '')
+    UPLOAD_ACCEL_PREFIX = os.environ.get('UPLOAD_ACCEL_PREFIX', '/_uploads/')
+    UPLOAD_URL_EXPIRES = 300  # seconds a presigned S3 URL is valid, when the app redirects to one
+    UPLOAD_COLLECT_GRACE = 3600  # seconds an unreferenced upload is kept before uploads.collect deletes it
     ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'pdf'}
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB max file size
     
@@ -45,13 +161,22 @@ class DevelopmentConfig(Config):
 class TestingConfig(Config):
     """Testing configuration"""
     TESTING = True
-    SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:'
+    # TEST_DATABASE_URL runs the app against another backend, e.g. a local PostgreSQL
+    SQLALCHEMY_DATABASE_URI = database_url('sqlite:///:memory:', 'TEST_DATABASE_URL')
+    DB_POOL_SIZE = 2
+    DB_MAX_OVERFLOW = 2
+    JOBS_INLINE = True
 
 
 class ProductionConfig(Config):
     """Production configuration"""
     DEBUG = False
     TESTING = False
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 10))
+    DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 20))
+    DB_STATEMENT_TIMEOUT_MS = int(os.environ.get('DB_STATEMENT_TIMEOUT_MS', 30000))
+    # Run `flask db upgrade` as a deploy step instead
+    MIGRATE_ON_STARTUP = os.environ.get('MIGRATE_ON_STARTUP', '').lower() in ('1', 'true', 'yes')
 
 
 config = {
@@ -0,0 +1,214 @@
+"""Benchmark hot endpoints against a generated dataset.
+
+Logs in as the generated owner (see scripts/generate_data.py) and drives the
+Flask test client against the endpoints that matter at volume:
+
+- POS search and checkout
+- the dashboard and the alert count poll
+- the sales report and tax summary
+- an invoice PDF
+
+Each endpoint is requested --requests times after --warmup untimed requests,
+or until it has used --time-limit seconds.
+The output reports p50/p95/p99 latency, the number of SQL statements per
+request and the response statuses. Checkout writes real sales, so use
+--read-only to skip it on a dataset you want to keep unchanged.
+
+--json writes the results, stamped with the current git commit, for comparison.
+--compare prints the change against an earlier file.
+
+Run: python scripts/bench_endpoints.py [--database-url URL] [--requests 50] [--json out.json] [--compare before.json]
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+
+from generate_data import OWNER_USERNAME, OWNER_PASSWORD
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = (len(ordered) - 1) * pct / 100
+    lower = int(index)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (index - lower)
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=ROOT).stdout.strip() or None
+    except OSError:
+        return None
+
+
+class Workload:
+    """Request factories for each benchmarked endpoint"""
+
+    def __init__(self, db, company_id, rng):
+        from sqlalchemy import select
+        from app.models import Product, Sale
+        self.rng = rng
+        # Popular, in-stock products for search terms and carts
+        rows = db.session.execute(
+            select(Product.id, Product.product_name, Product.selling_price)
+            .where(Product.company_id == company_id, Product.is_active == True, Product.quantity > 50)
+            .order_by(Product.quantity.desc()).limit(500)
+        ).all()
+        if not rows:
+            sys.exit('No in-stock products found; generate a dataset first (scripts/generate_data.py)')
+        self.products = rows
+        self.sale_ids = db.session.execute(
+            select(Sale.id).where(Sale.company_id == company_id).order_by(Sale.id.desc()).limit(1000)
+        ).scalars().all()
+
+    def search(self):
+        name = self.rng.choice(self.products).product_name
+        return 'GET', f'/sales/api/products/search?q={name[:self.rng.randint(3, 6)]}', None
+
+    def checkout(self):
+        items = [{'product_id': p.id, 'quantity': 1, 'price': p.selling_price}
+                 for p in self.rng.sample(self.products, self.rng.randint(1, 4))]
+        return 'POST', '/sales/checkout', {'items': items, 'payment_method': 'cash', 'customer_name': 'Bench'}
+
+    def sales_report(self):
+        today = datetime.utcnow().date()
+        start = today.replace(day=1)
+        return 'GET', f'/reports/sales?start_date={start}&end_date={today}', None
+
+    def invoice_pdf(self):
+        return 'GET', f'/sales/invoices/{self.rng.choice(self.sale_ids)}/pdf', None
+
+    def endpoints(self, read_only):
+        endpoints = {
+            'pos_search': self.search,
+            'checkout': self.checkout,
+            'dashboard': lambda: ('GET', '/dashboard/', None),
+            'alerts_count': lambda: ('GET', '/alerts/api/count', None),
+            'sales_report': self.sales_report,
+            'tax_summary': lambda: ('GET', '/reports/tax-summary', None),
+            'invoice_pdf': self.invoice_pdf,
+        }
+        if read_only:
+            del endpoints['checkout']
+        return endpoints
+
+
+def run(args):
+    if args.database_url:
+        os.environ['DATABASE_URL'] = args.database_url
+    import logging
+    from app import create_app
+    from app.models import db, User
+    from app.query_audit import QueryRecorder
+
+    app, _ = create_app(args.config)
+    app.logger.setLevel(logging.CRITICAL)
+    with app.app_context():
+        owner = User.query.filter_by(username=OWNER_USERNAME).first()
+        if owner is None:
+            sys.exit(f'{OWNER_USERNAME} not found; generate a dataset first (scripts/generate_data.py)')
+        workload = Workload(db, owner.company_id, random.Random(args.seed))
+        engines = list(db.engines.values())
+        dialect = db.engine.dialect.name
+
+    # Secure session cookies are only sent over https
+    client = app.test_client()
+    base_url = 'https://localhost'
+    response = client.post('/login', data={'username': OWNER_USERNAME, 'password': OWNER_PASSWORD},
+                           base_url=base_url)
+    if response.status_code != 302:
+        sys.exit(f'Login failed with status {response.status_code}')
+
+    selected = workload.endpoints(args.read_only)
+    if args.only:
+        selected = {name: make for name, make in selected.items() if name in args.only}
+
+    results = {}
+    for name, make in selected.items():
+        latencies, queries, statuses = [], [], {}
+        deadline = time.perf_counter() + args.time_limit
+        for i in range(args.warmup + args.requests):
+            if latencies and time.perf_counter() > deadline:
+                break
+            method, url, body = make()
+            with QueryRecorder(engines) as recorder:
+                started = time.perf_counter()
+                response = client.open(url, method=method, json=body, base_url=base_url)
+                elapsed = (time.perf_counter() - started) * 1000
+            if i < args.warmup and elapsed < args.time_limit * 1000:
+                continue
+            latencies.append(elapsed)
+            queries.append(recorder.count)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+        results[name] = {
+            'requests': len(latencies),
+            'p50_ms': percentile(latencies, 50),
+            'p95_ms': percentile(latencies, 95),
+            'p99_ms': percentile(latencies, 99),
+            'mean_ms': statistics.mean(latencies),
+            'queries_mean': statistics.mean(queries),
+            'queries_max': max(queries),
+            'statuses': {str(status): count for status, count in sorted(statuses.items())},
+        }
+    return {
+        'revision': git_revision(),
+        'timestamp': datetime.utcnow().isoformat(timespec='seconds'),
+        'database': dialect,
+        'config': args.config,
+        'requests': args.requests,
+        'endpoints': results,
+    }
+
+
+def print_results(report, previous=None):
+    print(f"revision {report['revision']}, {report['database']}, {report['requests']} requests per endpoint")
+    print(f"{'endpoint':<14} {'n':>4} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'queries':>8}  statuses")
+    for name, r in report['endpoints'].items():
+        line = (f"{name:<14} {r['requests']:4d} {r['p50_ms']:9.1f} {r['p95_ms']:9.1f} {r['p99_ms']:9.1f} "
+                f"{r['queries_mean']:8.1f}  {', '.join(f'{s}x{c}' for s, c in r['statuses'].items())}")
+        before = (previous or {}).get('endpoints', {}).get(name)
+        if before:
+            change = (r['p95_ms'] - before['p95_ms']) / before['p95_ms'] * 100 if before['p95_ms'] else 0
+            line += f"   p95 {change:+.0f}%, queries {r['queries_mean'] - before['queries_mean']:+.1f}"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url', help='dataset to run against (default: the app configuration)')
+    parser.add_argument('--config', default='production')
+    parser.add_argument('--requests', type=int, default=50)
+    parser.add_argument('--warmup', type=int, default=3)
+    parser.add_argument('--time-limit', type=float, default=60, help='seconds per endpoint')
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--read-only', action='store_true', help='skip checkout')
+    parser.add_argument('--only', nargs='+', help='endpoint names to run')
+    parser.add_argument('--json', help='write the results to this file')
+    parser.add_argument('--compare', help='earlier --json output to compare against')
+    args = parser.parse_args()
+
+    report = run(args)
+    previous = None
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+    print_results(report, previous)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
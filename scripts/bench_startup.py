@@ -0,0 +1,105 @@
+"""Measure worker cold start: import + create_app time and resident memory.
+
+Each run starts a fresh interpreter (like a new gunicorn worker), imports the
+app, calls create_app and reports wall time and RSS, plus which heavy
+optional libraries ended up loaded. `--pdf` also renders one invoice PDF to
+show the cost moving to the first request that needs it.
+
+Run: python scripts/bench_startup.py [--runs 5] [--config testing] [--pdf] [--json out.json]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+HEAVY_MODULES = ('reportlab', 'openpyxl', 'matplotlib', 'PIL', 'psycopg2', 'numpy')
+
+# Executed in the child interpreter; prints one JSON line
+CHILD = r'''
+import json, resource, sys, time
+sys.path.insert(0, ROOT)
+t0 = time.perf_counter()
+from app import create_app
+t1 = time.perf_counter()
+app, _ = create_app(CONFIG)
+t2 = time.perf_counter()
+
+def rss_kb():
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1])
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+result = {
+    'import_ms': (t1 - t0) * 1000,
+    'create_app_ms': (t2 - t1) * 1000,
+    'rss_kb': rss_kb(),
+    'modules': len(sys.modules),
+    'heavy_loaded': [m for m in HEAVY if m in sys.modules],
+}
+if PDF:
+    from app.models import db, Company, User, Sale
+    with app.app_context():
+        company = Company(company_name='Bench', owner_name='b', email='bench@example.com', phone='1',
+                          address='a', city='c', state='s', country='c', postal_code='1')
+        db.session.add(company)
+        db.session.flush()
+        user = User(company_id=company.id, username='bench', role='owner')
+        user.set_password('benchpass')
+        sale = Sale(company_id=company.id, invoice_number='BENCH1', subtotal=0, tax_amount=0,
+                    discount_amount=0, total_amount=0, payment_method='cash')
+        db.session.add_all([user, sale])
+        db.session.commit()
+        sale_id = sale.id
+    client = app.test_client()
+    client.post('/login', data={'username': 'bench', 'password': 'benchpass'})
+    t3 = time.perf_counter()
+    response = client.get(f'/sales/invoices/{sale_id}/pdf')
+    result['first_pdf_ms'] = (time.perf_counter() - t3) * 1000
+    result['first_pdf_status'] = response.status_code
+    result['rss_after_pdf_kb'] = rss_kb()
+print(json.dumps(result))
+'''
+
+
+def run_once(config, pdf):
+    code = f'ROOT = {ROOT!r}\nCONFIG = {config!r}\nPDF = {pdf!r}\nHEAVY = {HEAVY_MODULES!r}\n' + CHILD
+    proc = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, cwd=ROOT)
+    if proc.returncode:
+        sys.exit(proc.stderr)
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def summarise(runs):
+    keys = [k for k, v in runs[0].items() if isinstance(v, (int, float)) and not isinstance(v, bool)]
+    return {k: {'median': statistics.median(r[k] for r in runs),
+                'min': min(r[k] for r in runs),
+                'max': max(r[k] for r in runs)} for k in keys}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--config', default='testing')
+    parser.add_argument('--pdf', action='store_true', help='also time the first invoice PDF')
+    parser.add_argument('--json', help='write the raw runs and summary to this file')
+    args = parser.parse_args()
+
+    runs = [run_once(args.config, args.pdf) for _ in range(args.runs)]
+    summary = summarise(runs)
+    for key, stats in summary.items():
+        print(f"{key:>18}: median {stats['median']:10.1f}  min {stats['min']:10.1f}  max {stats['max']:10.1f}")
+    print(f"{'heavy modules':>18}: {', '.join(runs[0]['heavy_loaded']) or 'none'}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'config': args.config, 'runs': runs, 'summary': summary}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
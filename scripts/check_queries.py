@@ -0,0 +1,257 @@
+"""Check every GET route for N+1 query patterns against a committed baseline.
+
+Builds an in-memory database with realistic volumes (a few hundred products,
+sales and purchases, plus one large invoice, purchase and POS cart), logs in as
+the owner and requests every GET endpoint of every blueprint, including CSV/XLSX
+export variants. For each request it records the statements issued and the
+highest repeat count of any one statement shape (see app/query_audit.py).
+
+A route fails when its repeat count exceeds the baseline in
+scripts/query_baseline.json. A route missing from the baseline fails when it
+exceeds --threshold. After fixing an N+1, lower the baseline with --update.
+
+Run: python scripts/check_queries.py [--scale 1] [--threshold 5] [--update] [--verbose]
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import sys
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app import create_app
+from app.models import (db, Company, User, Product, Customer, Supplier, Doctor, Category, Unit, Sale, SaleItem,
+                        SalesReturn, Purchase, PurchaseItem, PurchaseReturn, Expense, StockMovement, Cart, CartLine,
+                        Job)
+from app.query_audit import QueryRecorder, repeated_shapes, max_repeat, DEFAULT_THRESHOLD
+
+BASELINE = os.path.join(os.path.dirname(__file__), 'query_baseline.json')
+
+SKIP_ENDPOINTS = {'static', 'auth.logout'}
+
+# Query-string variants requested in addition to the plain GET
+VARIANTS = {
+    'reports.sales_report': ['export=csv'],
+    'reports.purchase_report': ['export=csv'],
+    'reports.purchases_report': ['export=csv'],
+    'reports.inventory_report': ['export=csv'],
+    'reports.expiry_report': ['export=csv'],
+    'reports.stock_valuation_report': ['export=csv'],
+    'inventory.stock_movement_report': ['export=csv', 'export=xlsx'],
+    'inventory.product_typeahead': ['q=Product'],
+    'sales.search_products': ['q=Product'],
+}
+
+BIG_DOCUMENT_LINES = 25
+
+
+def seed(company_id, scale=1, rng=None):
+    """Populate one company; returns ids to fill URL parameters with"""
+    rng = rng or random.Random(42)
+    now = datetime.utcnow()
+    n = lambda base: max(1, int(base * scale))
+
+    categories = [Category(company_id=company_id, name=f'Category {i}') for i in range(n(8))]
+    units = [Unit(company_id=company_id, name=f'Unit {i}') for i in range(n(4))]
+    db.session.add_all(categories + units)
+    db.session.flush()
+
+    products = []
+    for i in range(n(300)):
+        category = rng.choice(categories)
+        products.append(Product(
+            company_id=company_id, product_name=f'Product {i}', generic_name=f'Generic {i % 50}',
+            category=category.name, category_id=category.id, unit_id=rng.choice(units).id,
+            sku=f'SKU{company_id}-{i}', barcode=f'BC{company_id}-{i}', batch_number=f'B{i % 40}',
+            purchase_price=5 + i % 20, selling_price=8 + i % 25, mrp=10 + i % 30, tax_percentage=rng.choice([0, 5, 12]),
+            quantity=rng.randint(0, 200), minimum_stock_level=10, reorder_level=20,
+            expiry_date=now + timedelta(days=rng.randint(-30, 720))))
+    customers = [Customer(company_id=company_id, customer_name=f'Customer {i}', phone=f'9{company_id:03d}{i:06d}')
+                 for i in range(n(60))]
+    suppliers = [Supplier(company_id=company_id, supplier_name=f'Supplier {i}', phone=f'8{company_id:03d}{i:06d}')
+                 for i in range(n(12))]
+    doctors = [Doctor(company_id=company_id, name=f'Dr {i}') for i in range(n(10))]
+    db.session.add_all(products + customers + suppliers + doctors)
+    db.session.flush()
+
+    sales = []
+    for i in range(n(300)):
+        lines = BIG_DOCUMENT_LINES if i == 0 else rng.randint(1, 6)
+        customer = rng.choice(customers) if rng.random() < 0.6 else None
+        sale = Sale(company_id=company_id, customer_id=customer.id if customer else None,
+                    doctor_id=rng.choice(doctors).id if rng.random() < 0.3 else None,
+                    invoice_number=f'INV{company_id}-{i}', invoice_date=now - timedelta(days=rng.randint(0, 60)),
+                    customer_name=customer.customer_name if customer else 'Walk-in',
+                    subtotal=0, tax_amount=0, discount_amount=0, total_amount=0,
+                    payment_method=rng.choice(['cash', 'card', 'upi', 'credit']),
+                    payment_status='paid')
+        for product in rng.sample(products, lines):
+            quantity = rng.randint(1, 5)
+            sale.items.append(SaleItem(product_id=product.id, batch_number=product.batch_number, quantity=quantity,
+                                       unit_price=product.selling_price, tax_percentage=product.tax_percentage,
+                                       tax_amount=0, discount_amount=0, total_amount=quantity * product.selling_price))
+            sale.subtotal += quantity * product.selling_price
+        sale.total_amount = sale.subtotal
+        sales.append(sale)
+
+    purchases = []
+    for i in range(n(80)):
+        lines = BIG_DOCUMENT_LINES if i == 0 else rng.randint(1, 8)
+        purchase = Purchase(company_id=company_id, supplier_id=rng.choice(suppliers).id,
+                            purchase_number=f'PO{company_id}-{i}', supplier_invoice_number=f'SUP{i}',
+                            purchase_date=now - timedelta(days=rng.randint(0, 60)),
+                            subtotal=0, tax_amount=0, total_amount=0,
+                            payment_status=rng.choice(['paid', 'pending']))
+        for product in rng.sample(products, lines):
+            quantity = rng.randint(10, 50)
+            purchase.items.append(PurchaseItem(
+                product_id=product.id, batch_number=product.batch_number, quantity=quantity,
+                expiry_date=product.expiry_date, unit_price=product.purchase_price,
+                tax_percentage=product.tax_percentage, tax_amount=0,
+                total_amount=quantity * product.purchase_price))
+            purchase.subtotal += quantity * product.purchase_price
+        purchase.total_amount = purchase.subtotal
+        purchases.append(purchase)
+    db.session.add_all(sales + purchases)
+    db.session.flush()
+
+    for i, sale in enumerate(rng.sample(sales, n(30))):
+        item = sale.items[0]
+        db.session.add(SalesReturn(sale_id=sale.id, credit_note_number=f'CN{company_id}-{i}', product_id=item.product_id,
+                                   quantity=1, refund_amount=item.unit_price, refund_mode='cash'))
+    for purchase in rng.sample(purchases, n(15)):
+        item = purchase.items[0]
+        db.session.add(PurchaseReturn(purchase_id=purchase.id, product_id=item.product_id, batch_number=item.batch_number,
+                                      quantity=1, credit_amount=item.unit_price))
+    for i in range(n(60)):
+        db.session.add(Expense(company_id=company_id, expense_category=rng.choice(['rent', 'staff', 'utilities']),
+                               description=f'Expense {i}', amount=rng.randint(100, 5000),
+                               expense_date=now - timedelta(days=rng.randint(0, 60))))
+    for product in products[:n(100)]:
+        db.session.add(StockMovement(product_id=product.id, movement_type='opening', quantity=product.quantity))
+    cart = Cart(company_id=company_id, status='open', expires_at=now + timedelta(minutes=15), lines=[
+        CartLine(product_id=product.id, quantity=1, unit_price=product.selling_price,
+                 tax_percentage=product.tax_percentage) for product in products[:BIG_DOCUMENT_LINES]])
+    db.session.add(cart)
+    job = Job(company_id=company_id, task='alerts.generate', status='succeeded', progress=100, finished_date=now)
+    db.session.add(job)
+    db.session.commit()
+
+    return {
+        'sale_id': sales[0].id, 'purchase_id': purchases[0].id, 'product_id': products[0].id,
+        'customer_id': customers[0].id, 'supplier_id': suppliers[0].id, 'doctor_id': doctors[0].id,
+        'expense_id': Expense.query.filter_by(company_id=company_id).first().id,
+        'cat_id': categories[0].id, 'unit_id': units[0].id, 'company_id': company_id, 'cart_id': cart.id,
+        'job_id': job.id,
+    }
+
+
+def build_requests(app, ids):
+    """[(label, url)] for every GET route that can be filled from `ids`"""
+    requests, skipped = [], []
+    for rule in sorted(app.url_map.iter_rules(), key=lambda r: r.rule):
+        if 'GET' not in rule.methods or rule.endpoint in SKIP_ENDPOINTS:
+            continue
+        args = {}
+        for name in rule.arguments:
+            if name not in ids:
+                break
+            args[name] = ids[name]
+        else:
+            with app.test_request_context():
+                from flask import url_for
+                url = url_for(rule.endpoint, **args)
+            requests.append((f'{rule.endpoint} {rule.rule}', url))
+            for variant in VARIANTS.get(rule.endpoint, []):
+                requests.append((f'{rule.endpoint} {rule.rule}?{variant}', f'{url}?{variant}'))
+            continue
+        skipped.append(rule.endpoint)
+    return requests, skipped
+
+
+def run(scale, threshold):
+    app, _ = create_app('testing')
+    app.config['WTF_CSRF_ENABLED'] = False
+    app.config['PROPAGATE_EXCEPTIONS'] = False
+    # Routes that 500 (e.g. a missing template) are still measured; keep their tracebacks out of the report
+    app.logger.setLevel(logging.CRITICAL)
+    with app.app_context():
+        company = Company(company_name='Audit Pharmacy', owner_name='Owner', email='audit@example.com', phone='1',
+                          address='1 Main St', city='City', state='State', country='Country', postal_code='1')
+        db.session.add(company)
+        db.session.flush()
+        owner = User(company_id=company.id, username='audit-owner', role='owner')
+        owner.set_password('audit-password')
+        db.session.add(owner)
+        db.session.commit()
+        ids = seed(company.id, scale)
+        ids['user_id'] = owner.id
+        engines = list(db.engines.values())
+
+    client = app.test_client()
+    client.post('/login', data={'username': 'audit-owner', 'password': 'audit-password'})
+    requests, skipped = build_requests(app, ids)
+
+    results = {}
+    for label, url in requests:
+        with QueryRecorder(engines) as recorder:
+            response = client.get(url)
+        worst = repeated_shapes(recorder.statements, 0)
+        results[label] = {
+            'status': response.status_code,
+            'queries': recorder.count,
+            'max_repeat': max_repeat(recorder.statements),
+            'worst': worst[0][0][:160] if worst else '',
+            'repeated': repeated_shapes(recorder.statements, threshold),
+        }
+    return results, skipped
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scale', type=float, default=1)
+    parser.add_argument('--threshold', type=int, default=DEFAULT_THRESHOLD)
+    parser.add_argument('--update', action='store_true', help='write the current counts as the new baseline')
+    parser.add_argument('--verbose', action='store_true', help='print every route, not just failures')
+    args = parser.parse_args()
+
+    results, skipped = run(args.scale, args.threshold)
+
+    if args.update:
+        with open(BASELINE, 'w') as f:
+            json.dump({label: r['max_repeat'] for label, r in sorted(results.items())}, f, indent=2)
+            f.write('\n')
+        print(f'Wrote {len(results)} routes to {BASELINE}')
+        return 0
+
+    baseline = {}
+    if os.path.exists(BASELINE):
+        with open(BASELINE) as f:
+            baseline = json.load(f)
+
+    failures = []
+    for label, r in results.items():
+        allowed = baseline.get(label, args.threshold)
+        failed = r['max_repeat'] > allowed
+        if failed:
+            failures.append(label)
+        if failed or args.verbose:
+            flag = 'FAIL' if failed else ('    ' if r['max_repeat'] <= args.threshold else 'base')
+            print(f"{flag} {label}: status {r['status']}, {r['queries']} queries, "
+                  f"max repeat {r['max_repeat']} (allowed {allowed})")
+            for shape, count in r['repeated'][:3] if (failed or args.verbose) else []:
+                print(f'       {count}x {shape[:160]}')
+        elif r['max_repeat'] < baseline.get(label, 0):
+            print(f"     {label}: improved to {r['max_repeat']} (baseline {baseline[label]}); run with --update")
+
+    if skipped:
+        print(f"Skipped (no id for URL parameters): {', '.join(sorted(set(skipped)))}")
+    print(f'{len(results)} routes checked, {len(failures)} regressions')
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
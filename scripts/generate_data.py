@@ -0,0 +1,454 @@
+"""Fill a database with a synthetic pharmacy at production-like volumes.
+
+Creates one company with an owner login and, at --scale 1:
+
+- 50,000 products, 20,000 customers (15% on credit), 300 suppliers, 200 doctors
+- 1,000,000 sales over --days, items drawn from a Zipf distribution
+  (a few hundred products make up most of the sales)
+- 30,000 purchases, about 1% of sales returned, 0.5% of purchases returned
+- daily expenses, and a stock movement for every sale, purchase and return
+
+Opening-stock movements are sized so that every product's movement ledger
+adds up to its quantity. Rows are written in batches with COPY on PostgreSQL
+and executemany elsewhere. Use --scale 0.01 for a quick local dataset.
+
+The database is the app's normal one (DATABASE_URL or instance/pharmacy.db)
+unless --database-url is given. The generated login is printed at the end.
+
+Run: python scripts/generate_data.py [--scale 1] [--database-url URL] [--days 365] [--zipf 1.1] [--seed 42]
+"""
+import argparse
+import itertools
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+
+OWNER_USERNAME = 'bench-owner'
+OWNER_PASSWORD = 'bench-password'
+
+DRUGS = ['Paracetamol', 'Amoxicillin', 'Azithromycin', 'Cetirizine', 'Metformin', 'Atorvastatin', 'Amlodipine',
+         'Omeprazole', 'Pantoprazole', 'Ibuprofen', 'Diclofenac', 'Losartan', 'Telmisartan', 'Ciprofloxacin',
+         'Levocetirizine', 'Montelukast', 'Ondansetron', 'Domperidone', 'Ranitidine', 'Aceclofenac',
+         'Glimepiride', 'Rosuvastatin', 'Clopidogrel', 'Aspirin', 'Vitamin D3', 'Calcium', 'Iron Folic',
+         'Cefixime', 'Doxycycline', 'Fluconazole', 'Prednisolone', 'Salbutamol', 'Levothyroxine',
+         'Metoprolol', 'Furosemide', 'Spironolactone', 'Insulin Glargine', 'Sitagliptin', 'Tramadol', 'Zinc']
+FORMS = ['Tablet', 'Capsule', 'Syrup', 'Suspension', 'Injection', 'Cream', 'Drops', 'Inhaler']
+STRENGTHS = ['5mg', '10mg', '20mg', '25mg', '50mg', '100mg', '250mg', '500mg', '650mg', '1g']
+BRANDS = ['Cipla', 'Sun', 'Lupin', 'Mankind', 'Alkem', 'Zydus', 'Torrent', 'Glenmark', 'Abbott', 'Intas']
+CATEGORIES = ['Analgesic', 'Antibiotic', 'Antihistamine', 'Antidiabetic', 'Cardiac', 'Gastro', 'Respiratory',
+              'Vitamins', 'Dermatology', 'Hormones', 'Antifungal', 'Neurology']
+UNITS = [('Strip', 'STR'), ('Bottle', 'BTL'), ('Vial', 'VL'), ('Tube', 'TB'), ('Box', 'BX'), ('Piece', 'PC')]
+EXPENSE_CATEGORIES = ['rent', 'salary', 'electricity', 'internet', 'transport', 'maintenance', 'miscellaneous']
+TAX_RATES = [0, 5, 5, 12, 12, 12, 18]
+
+BATCH_ROWS = 20000
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scale', type=float, default=1.0, help='multiplier for every row count')
+    parser.add_argument('--database-url', help='target database (default: the app configuration)')
+    parser.add_argument('--days', type=int, default=365, help='history length')
+    parser.add_argument('--zipf', type=float, default=1.1, help='Zipf exponent for product popularity')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--company', default='Benchmark Pharmacy')
+    parser.add_argument('--products', type=int, default=50000)
+    parser.add_argument('--customers', type=int, default=20000)
+    parser.add_argument('--suppliers', type=int, default=300)
+    parser.add_argument('--doctors', type=int, default=200)
+    parser.add_argument('--sales', type=int, default=1000000)
+    parser.add_argument('--purchases', type=int, default=30000)
+    return parser.parse_args()
+
+
+class Generator:
+    """Writes one synthetic company; call the entity methods in order inside an app context"""
+
+    def __init__(self, db, company_id, rng, days, zipf, log=print):
+        self.db = db
+        self.company_id = company_id
+        self.rng = rng
+        self.log = log
+        self.end = datetime.utcnow().replace(microsecond=0)
+        self.start = self.end - timedelta(days=days)
+        self.zipf = zipf
+        self.pending = {}  # model -> buffered rows
+        self.table_order = {table: i for i, table in enumerate(db.metadata.sorted_tables)}
+        self.written = {}
+        self.net_stock = {}  # product id -> purchased - sold + returned by customers - returned to suppliers
+
+    # -- bulk writing -----------------------------------------------------
+
+    def next_id(self, model):
+        from sqlalchemy import func, select
+        return (self.db.session.execute(select(func.max(model.__table__.c.id))).scalar() or 0) + 1
+
+    def add(self, model, row):
+        rows = self.pending.setdefault(model, [])
+        rows.append(row)
+        if len(rows) >= BATCH_ROWS:
+            self.flush()
+
+    def flush(self):
+        """Write every buffered table, parents before children"""
+        from app.database import supports_copy, copy_rows_from
+        session = self.db.session
+        for m in sorted(self.pending, key=lambda m: self.table_order[m.__table__]):
+            rows = self.pending.pop(m)
+            table = m.__table__
+            if supports_copy(session):
+                columns = list(rows[0])
+                copy_rows_from(session, table.name, columns, ([row[c] for c in columns] for row in rows))
+            else:
+                session.execute(table.insert(), rows)
+            self.written[table.name] = self.written.get(table.name, 0) + len(rows)
+        session.commit()
+
+    def reset_sequences(self, *models):
+        """PostgreSQL serial sequences lag behind explicitly inserted ids"""
+        from sqlalchemy import text
+        if self.db.session.get_bind().dialect.name != 'postgresql':
+            return
+        for model in models:
+            name = model.__table__.name
+            self.db.session.execute(text(
+                f"SELECT setval(pg_get_serial_sequence('{name}', 'id'), (SELECT COALESCE(MAX(id), 1) FROM {name}))"))
+        self.db.session.commit()
+
+    # -- helpers ----------------------------------------------------------
+
+    def moment(self, fraction):
+        """Timestamp `fraction` of the way through the history, during opening hours"""
+        day = self.start + timedelta(days=int(fraction * (self.end - self.start).days))
+        return day.replace(hour=0, minute=0, second=0) + timedelta(seconds=self.rng.randint(8 * 3600, 22 * 3600))
+
+    def zipf_sampler(self, population):
+        """Function drawing k distinct items, most popular first in a shuffled ranking"""
+        ranked = list(population)
+        self.rng.shuffle(ranked)
+        cum_weights = list(itertools.accumulate(1.0 / (rank + 1) ** self.zipf for rank in range(len(ranked))))
+
+        def sample(k):
+            picked = self.rng.choices(ranked, cum_weights=cum_weights, k=k)
+            return list(dict.fromkeys(picked))
+        return sample
+
+    def movement(self, product_id, movement_type, quantity, batch, reference_id, created, reason=None):
+        from app.models import StockMovement
+        self.net_stock[product_id] = self.net_stock.get(product_id, 0) + quantity
+        self.add(StockMovement, {
+            'product_id': product_id, 'movement_type': movement_type, 'quantity': quantity,
+            'batch_number': batch, 'reference_id': reference_id, 'reason': reason, 'created_date': created,
+        })
+
+    # -- entities ---------------------------------------------------------
+
+    def masters(self):
+        from app.models import Category, Unit
+        now = self.end
+        self.categories = []
+        for name in CATEGORIES:
+            cat = Category(company_id=self.company_id, name=name, is_active=True, created_date=now)
+            self.db.session.add(cat)
+            self.categories.append(cat)
+        self.units = []
+        for name, abbreviation in UNITS:
+            unit = Unit(company_id=self.company_id, name=name, abbreviation=abbreviation, is_active=True,
+                        created_date=now)
+            self.db.session.add(unit)
+            self.units.append(unit)
+        self.db.session.commit()
+        self.categories = [(c.id, c.name) for c in self.categories]
+        self.units = [u.id for u in self.units]
+
+    def products(self, count):
+        from app.models import Product
+        rng, cid = self.rng, self.company_id
+        first = self.next_id(Product)
+        self.product_info = {}  # id -> (price, tax, batch, purchase price)
+        for n in range(count):
+            pid = first + n
+            drug = rng.choice(DRUGS)
+            category_id, category = rng.choice(self.categories)
+            purchase_price = round(rng.lognormvariate(3.5, 0.9), 2)
+            selling_price = round(purchase_price * rng.uniform(1.15, 1.45), 2)
+            tax = rng.choice(TAX_RATES)
+            batch = f'B{rng.randint(1000, 9999)}{chr(65 + n % 26)}'
+            self.product_info[pid] = (selling_price, tax, batch, purchase_price)
+            self.add(Product, {
+                'id': pid, 'company_id': cid,
+                'product_name': f'{drug} {rng.choice(STRENGTHS)} {rng.choice(FORMS)} {n}',
+                'generic_name': drug, 'brand': rng.choice(BRANDS), 'category': category,
+                'manufacturer': rng.choice(BRANDS) + ' Pharma', 'batch_number': batch,
+                'barcode': f'{cid:03d}{pid:010d}', 'sku': f'SKU{cid}-{pid:07d}',
+                'purchase_price': purchase_price, 'selling_price': selling_price,
+                'mrp': round(selling_price * 1.1, 2), 'tax_percentage': tax,
+                'manufacturing_date': self.start - timedelta(days=rng.randint(30, 400)),
+                'expiry_date': self.end + timedelta(days=rng.randint(-60, 900)),
+                'quantity': 0, 'minimum_stock_level': 10, 'reorder_level': 20,
+                'prescription_required': rng.random() < 0.3, 'description': None, 'image_path': None,
+                'created_date': self.start, 'updated_date': self.start, 'is_active': rng.random() > 0.02,
+                'category_id': category_id, 'unit_id': rng.choice(self.units),
+            })
+        self.flush()
+        self.product_ids = list(range(first, first + count))
+        # One popularity ranking: best sellers are also the most purchased
+        self.sample_products = self.zipf_sampler(self.product_ids)
+
+    def people(self, customers, suppliers, doctors):
+        from app.models import Customer, Supplier, Doctor
+        rng, cid = self.rng, self.company_id
+        first = self.next_id(Customer)
+        self.credit_customers, self.cash_customers = [], []
+        self.balances = {}
+        for n in range(customers):
+            on_credit = rng.random() < 0.15
+            (self.credit_customers if on_credit else self.cash_customers).append(first + n)
+            self.add(Customer, {
+                'id': first + n, 'company_id': cid, 'customer_name': f'Customer {n}',
+                'phone': f'9{cid:03d}{n:07d}', 'email': None, 'address': f'{n} Market Road',
+                'gst_number': None, 'credit_limit': 5000.0 if on_credit else 0.0, 'current_balance': 0.0,
+                'created_date': self.start, 'updated_date': self.start, 'is_active': True,
+            })
+        first_supplier = self.next_id(Supplier)
+        for n in range(suppliers):
+            self.add(Supplier, {
+                'id': first_supplier + n, 'company_id': cid, 'supplier_name': f'{rng.choice(BRANDS)} Distributors {n}',
+                'contact_person': f'Contact {n}', 'phone': f'8{cid:03d}{n:07d}', 'email': None, 'address': None,
+                'gst_number': None, 'payment_terms': rng.choice(['Net 15', 'Net 30', 'Net 45']), 'notes': None,
+                'created_date': self.start, 'updated_date': self.start, 'is_active': True,
+            })
+        first_doctor = self.next_id(Doctor)
+        for n in range(doctors):
+            self.add(Doctor, {
+                'id': first_doctor + n, 'company_id': cid, 'name': f'Dr. Physician {n}', 'phone': None,
+                'clinic': f'Clinic {n % 50}', 'notes': None, 'created_date': self.start,
+            })
+        self.flush()
+        self.supplier_ids = list(range(first_supplier, first_supplier + suppliers))
+        self.doctor_ids = list(range(first_doctor, first_doctor + doctors))
+
+    def purchases(self, count):
+        from app.models import Purchase, PurchaseItem, PurchaseReturn
+        rng, cid = self.rng, self.company_id
+        sample = self.sample_products
+        first = self.next_id(Purchase)
+        pending_after = self.end - timedelta(days=30)
+        self.purchase_lines = []
+        for n in range(count):
+            purchase_id = first + n
+            when = self.moment(n / count)
+            subtotal = tax_total = 0
+            lines = []
+            for pid in sample(rng.randint(3, 25)):
+                _, tax, batch, price = self.product_info[pid]
+                quantity = rng.randint(10, 200)
+                amount = round(price * quantity, 2)
+                tax_amount = round(amount * tax / 100, 2)
+                subtotal += amount
+                tax_total += tax_amount
+                lines.append((pid, quantity, batch, price, tax, tax_amount, amount + tax_amount))
+            paid = when < pending_after
+            self.add(Purchase, {
+                'id': purchase_id, 'company_id': cid, 'supplier_id': rng.choice(self.supplier_ids),
+                'purchase_number': f'PO{cid}-{purchase_id:08d}', 'purchase_date': when,
+                'supplier_invoice_number': f'SI{rng.randint(100000, 999999)}', 'subtotal': round(subtotal, 2),
+                'tax_amount': round(tax_total, 2), 'discount_amount': 0.0,
+                'total_amount': round(subtotal + tax_total, 2), 'payment_status': 'paid' if paid else 'pending',
+                'payment_date': when + timedelta(days=rng.randint(1, 30)) if paid else None, 'notes': None,
+                'created_date': when, 'updated_date': when,
+            })
+            for pid, quantity, batch, price, tax, tax_amount, total in lines:
+                self.add(PurchaseItem, {
+                    'purchase_id': purchase_id, 'product_id': pid, 'batch_number': batch,
+                    'expiry_date': when + timedelta(days=rng.randint(180, 1000)), 'quantity': quantity,
+                    'unit_price': price, 'tax_percentage': tax, 'tax_amount': tax_amount,
+                    'discount_percentage': 0.0, 'discount_amount': 0.0, 'total_amount': round(total, 2),
+                })
+                self.movement(pid, 'purchase', quantity, batch, purchase_id, when)
+            if rng.random() < 0.005:
+                pid, quantity, batch, price = lines[0][0], min(5, lines[0][1]), lines[0][2], lines[0][3]
+                returned = when + timedelta(days=rng.randint(1, 20))
+                self.add(PurchaseReturn, {
+                    'purchase_id': purchase_id, 'return_date': returned, 'product_id': pid, 'batch_number': batch,
+                    'quantity': quantity, 'reason': 'Damaged in transit', 'credit_amount': round(price * quantity, 2),
+                })
+                self.movement(pid, 'return', -quantity, batch, None, returned, 'Returned to supplier: Damaged in transit')
+            if n % 5000 == 4999:
+                self.flush()
+        self.flush()
+
+    def sales(self, count):
+        from app.models import Sale, SaleItem, SalesReturn
+        rng, cid = self.rng, self.company_id
+        sample = self.sample_products
+        first = self.next_id(Sale)
+        pending_after = self.end - timedelta(days=30)
+        methods = ['cash', 'upi', 'card']
+        started = time.perf_counter()
+        for n in range(count):
+            sale_id = first + n
+            when = self.moment(n / count)
+            customer_id, method = None, rng.choices(methods, weights=[5, 3, 2])[0]
+            if self.credit_customers and rng.random() < 0.1:
+                customer_id, method = rng.choice(self.credit_customers), 'credit'
+            elif self.cash_customers and rng.random() < 0.3:
+                customer_id = rng.choice(self.cash_customers)
+            subtotal = tax_total = 0
+            lines = []
+            for pid in sample(min(int(rng.expovariate(0.4)) + 1, 12)):
+                price, tax, batch, _ = self.product_info[pid]
+                quantity = rng.choice((1, 1, 1, 2, 2, 3, 5, 10))
+                amount = round(price * quantity, 2)
+                tax_amount = round(amount * tax / 100, 2)
+                subtotal += amount
+                tax_total += tax_amount
+                lines.append((pid, quantity, batch, price, tax, tax_amount, amount + tax_amount))
+            discount = round(subtotal * 0.05, 2) if rng.random() < 0.1 else 0.0
+            total = round(max(subtotal + tax_total - discount, 0), 2)
+            pending = method == 'credit' and when >= pending_after
+            if pending:
+                self.balances[customer_id] = self.balances.get(customer_id, 0) + total
+            self.add(Sale, {
+                'id': sale_id, 'company_id': cid, 'customer_id': customer_id,
+                'invoice_number': f'INV{cid}-{sale_id:09d}', 'invoice_date': when,
+                'customer_name': f'Customer {customer_id}' if customer_id else 'Walk-in Customer',
+                'customer_phone': None, 'subtotal': round(subtotal, 2), 'tax_amount': round(tax_total, 2),
+                'discount_amount': discount, 'total_amount': total, 'payment_method': method,
+                'payment_status': 'pending' if pending else 'paid', 'notes': None, 'is_cancelled': False,
+                'cancellation_reason': None, 'created_date': when, 'updated_date': when,
+                'doctor_id': rng.choice(self.doctor_ids) if self.doctor_ids and rng.random() < 0.2 else None,
+            })
+            for pid, quantity, batch, price, tax, tax_amount, line_total in lines:
+                self.add(SaleItem, {
+                    'sale_id': sale_id, 'product_id': pid, 'batch_number': batch, 'quantity': quantity,
+                    'unit_price': price, 'tax_percentage': tax, 'tax_amount': tax_amount,
+                    'discount_percentage': 0.0, 'discount_amount': 0.0, 'total_amount': round(line_total, 2),
+                })
+                self.movement(pid, 'sale', -quantity, batch, sale_id, when)
+            if rng.random() < 0.01:
+                pid, quantity, batch, price = lines[0][:4]
+                returned = when + timedelta(hours=rng.randint(1, 72))
+                self.add(SalesReturn, {
+                    'sale_id': sale_id, 'credit_note_number': f'CN{cid}-{sale_id:09d}', 'return_date': returned,
+                    'product_id': pid, 'quantity': 1, 'is_full_return': False, 'reason': 'Customer return',
+                    'refund_amount': price, 'refund_mode': 'cash',
+                })
+                self.movement(pid, 'return', 1, batch, sale_id, returned, 'Customer return')
+            if n % 10000 == 9999:
+                self.flush()
+                rate = (n + 1) / (time.perf_counter() - started)
+                self.log(f'  {n + 1:,} sales ({rate:,.0f}/s)')
+        self.flush()
+
+    def expenses(self):
+        from app.models import Expense
+        rng = self.rng
+        day = self.start
+        while day < self.end:
+            for _ in range(rng.randint(0, 3)):
+                category = rng.choice(EXPENSE_CATEGORIES)
+                self.add(Expense, {
+                    'company_id': self.company_id, 'expense_category': category,
+                    'description': f'{category.title()} {day:%b %d}', 'amount': round(rng.lognormvariate(6.5, 1.0), 2),
+                    'receipt_image': None, 'expense_date': day, 'created_date': day,
+                })
+            day += timedelta(days=1)
+        self.flush()
+
+    def closing_stock(self):
+        """Opening movements and product quantities so each ledger sums to the stock on hand"""
+        from sqlalchemy import bindparam
+        from app.models import Product
+        rng = self.rng
+        updates = []
+        for pid in self.product_ids:
+            net = self.net_stock.get(pid, 0)
+            opening = rng.randint(0, 150)
+            if opening + net < 0:
+                opening = -net + rng.randint(0, 40)
+            if opening:
+                self.movement(pid, 'opening', opening, self.product_info[pid][2], None, self.start,
+                              'Opening stock (generated)')
+            updates.append({'pid': pid, 'qty': self.net_stock.get(pid, 0)})
+        self.flush()
+        table = Product.__table__
+        self.db.session.execute(
+            table.update().where(table.c.id == bindparam('pid')).values(quantity=bindparam('qty')), updates)
+        self.db.session.commit()
+
+    def customer_balances(self):
+        from sqlalchemy import bindparam
+        from app.models import Customer
+        if not self.balances:
+            return
+        table = Customer.__table__
+        self.db.session.execute(
+            table.update().where(table.c.id == bindparam('cid')).values(current_balance=bindparam('balance')),
+            [{'cid': cid, 'balance': round(balance, 2)} for cid, balance in self.balances.items()])
+        self.db.session.commit()
+
+
+def create_company(db, name):
+    """Company plus owner login; refuses to run twice against one database"""
+    from app.models import Company, User
+    user = User.query.filter_by(username=OWNER_USERNAME).first()
+    if user:
+        sys.exit(f'{OWNER_USERNAME} already exists in this database; generate into an empty database')
+    company = Company(company_name=name, owner_name='Benchmark Owner', email='bench@example.com', phone='0000000000',
+                      address='1 Benchmark Street', city='Pune', state='Maharashtra', country='India',
+                      postal_code='411001')
+    db.session.add(company)
+    db.session.flush()
+    user = User(company_id=company.id, username=OWNER_USERNAME, role='owner')
+    user.set_password(OWNER_PASSWORD)
+    db.session.add(user)
+    db.session.commit()
+    return company.id
+
+
+def main():
+    args = parse_args()
+    if args.database_url:
+        os.environ['DATABASE_URL'] = args.database_url
+    from app import create_app
+    from app.models import (db, Product, Customer, Supplier, Doctor, Sale, Purchase)
+
+    app, _ = create_app('development')
+    scaled = lambda n: max(1, int(n * args.scale))
+    rng = random.Random(args.seed)
+    started = time.perf_counter()
+    with app.app_context():
+        print(f'Generating into {db.engine.url.render_as_string(hide_password=True)}')
+        company_id = create_company(db, args.company)
+        gen = Generator(db, company_id, rng, args.days, args.zipf)
+        steps = [
+            ('masters', gen.masters),
+            ('products', lambda: gen.products(scaled(args.products))),
+            ('customers, suppliers, doctors',
+             lambda: gen.people(scaled(args.customers), scaled(args.suppliers), scaled(args.doctors))),
+            ('purchases', lambda: gen.purchases(scaled(args.purchases))),
+            ('sales', lambda: gen.sales(scaled(args.sales))),
+            ('expenses', gen.expenses),
+            ('closing stock', gen.closing_stock),
+            ('customer balances', gen.customer_balances),
+        ]
+        for label, step in steps:
+            t0 = time.perf_counter()
+            step()
+            print(f'{label}: {time.perf_counter() - t0:.1f}s')
+        gen.reset_sequences(Product, Customer, Supplier, Doctor, Sale, Purchase)
+
+    print(f'Done in {time.perf_counter() - started:.0f}s')
+    for table, rows in sorted(gen.written.items()):
+        print(f'{table:>16}: {rows:,}')
+    print(f'Login: {OWNER_USERNAME} / {OWNER_PASSWORD}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,282 @@
+"""Concurrent checkout load test against a running server.
+
+Simulates --terminals POS terminals. Each one logs in with its own session,
+then loops: search the catalogue, build a cart from a small set of hot
+products, and check out. Before the run each hot product's stock is set to
+--stock, so terminals contend for the same rows and run out of stock.
+Everything goes over HTTP, so the same run works whether the server uses
+SQLite or PostgreSQL.
+
+Reported:
+
+- throughput and search/checkout latency percentiles
+- lock-wait errors: database is locked, lock or statement timeouts,
+  deadlocks, pool exhaustion
+- oversells: a product with more units confirmed sold than it had in stock,
+  with negative stock, or whose stock dropped by a different amount than
+  was confirmed sold (a lost update)
+- invoice-number collisions: unique-constraint failures and duplicate
+  invoice numbers among successful checkouts
+
+Start the server against the database to size, with a catalogue from
+scripts/generate_data.py. For example:
+
+    python scripts/generate_data.py --scale 0.01 --database-url postgresql://localhost/pharmacy_load
+    DATABASE_URL=postgresql://localhost/pharmacy_load gunicorn -w 4 --threads 4 -b 127.0.0.1:5000 run:app
+
+The server must not use secure-only cookies over plain HTTP (the default
+development config doesn't).
+
+Run: python scripts/loadtest.py [--url http://127.0.0.1:5000] [--terminals 8] [--duration 30] [--hot 20] [--stock 50] [--json out.json]
+"""
+import argparse
+import http.cookiejar
+import json
+import os
+import random
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from generate_data import OWNER_USERNAME, OWNER_PASSWORD, DRUGS
+from bench_endpoints import percentile
+
+LOCK_ERRORS = ('database is locked', 'could not obtain lock', 'lock timeout', 'deadlock detected',
+               'statement timeout', 'canceling statement', 'QueuePool limit', 'could not serialize')
+COLLISION_ERRORS = ('sale.invoice_number', 'sale_invoice_number_key', 'invoice_number')
+
+
+class NoRedirect(urllib.request.HTTPRedirectHandler):
+    # Login redirects to the dashboard; don't render it for every terminal
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class Terminal:
+    """One logged-in HTTP session"""
+
+    def __init__(self, base_url, timeout):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), NoRedirect())
+
+    def request(self, method, path, data=None, form=None):
+        """(status, parsed JSON or None, seconds)"""
+        headers = {}
+        body = None
+        if data is not None:
+            body = json.dumps(data).encode()
+            headers['Content-Type'] = 'application/json'
+        elif form is not None:
+            body = urllib.parse.urlencode(form).encode()
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        req = urllib.request.Request(self.base_url + path, data=body, headers=headers, method=method)
+        started = time.perf_counter()
+        try:
+            with self.opener.open(req, timeout=self.timeout) as response:
+                status, payload = response.status, response.read()
+        except urllib.error.HTTPError as e:
+            status, payload = e.code, e.read()
+        elapsed = time.perf_counter() - started
+        try:
+            parsed = json.loads(payload)
+        except ValueError:
+            parsed = None
+        return status, parsed, elapsed
+
+    def login(self, username, password):
+        self.request('POST', '/login', form={'username': username, 'password': password})
+        status, products, _ = self.request('GET', '/sales/api/products/search?q=zz')
+        if status != 200 or not isinstance(products, list):
+            sys.exit(f'Login as {username} failed (search returned {status})')
+
+    def search(self, term):
+        status, products, elapsed = self.request('GET', '/sales/api/products/search?q=' + urllib.parse.quote(term))
+        return (products if status == 200 and isinstance(products, list) else []), elapsed
+
+    def product(self, product):
+        """Current state of one product, found by SKU"""
+        products, _ = self.search(product['sku'])
+        return next((p for p in products if p['id'] == product['id']), None)
+
+
+def pick_hot_products(terminal, count, rng):
+    hot = {}
+    terms = list(DRUGS)
+    rng.shuffle(terms)
+    for term in terms:
+        for product in terminal.search(term)[0]:
+            if product['quantity'] > 0:
+                hot[product['id']] = product
+        if len(hot) >= count:
+            break
+    if not hot:
+        sys.exit('No products found; generate a catalogue first (scripts/generate_data.py)')
+    return list(hot.values())[:count]
+
+
+def set_stock(terminal, product, target):
+    delta = target - product['quantity']
+    if delta:
+        status, result, _ = terminal.request('POST', f"/inventory/products/{product['id']}/adjust-stock", data={
+            'adjustment_type': 'add' if delta > 0 else 'remove', 'quantity': abs(delta),
+            'reason': 'Load test reset'})
+        if status != 200:
+            sys.exit(f"Could not set stock of product {product['id']}: {status} {result}")
+
+
+class Results:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.search_latency = []
+        self.checkout_latency = []
+        self.outcomes = Counter()
+        self.errors = Counter()
+        self.sold = Counter()  # product id -> units confirmed sold
+        self.invoices = Counter()
+
+    def record_checkout(self, status, result, elapsed, cart):
+        message = (result or {}).get('message', '') if isinstance(result, dict) else ''
+        with self.lock:
+            self.checkout_latency.append(elapsed)
+            if status == 200 and result and result.get('success'):
+                self.outcomes['completed'] += 1
+                self.invoices[result.get('invoice_number')] += 1
+                for item in cart:
+                    self.sold[item['product_id']] += item['quantity']
+            elif status == 400 and 'Insufficient stock' in message:
+                self.outcomes['out_of_stock'] += 1
+            elif any(text in message for text in LOCK_ERRORS):
+                self.outcomes['lock_error'] += 1
+                self.errors[message[:120]] += 1
+            elif 'unique' in message.lower() and any(text in message for text in COLLISION_ERRORS):
+                self.outcomes['invoice_collision'] += 1
+                self.errors[message[:120]] += 1
+            else:
+                self.outcomes['other_error'] += 1
+                self.errors[f'{status} {message[:120]}'] += 1
+
+
+def run_terminal(terminal, args, hot, results, deadline, seed):
+    rng = random.Random(seed)
+    while time.perf_counter() < deadline:
+        product = rng.choice(hot)
+        _, elapsed = terminal.search(product['name'][:rng.randint(3, 6)])
+        with results.lock:
+            results.search_latency.append(elapsed)
+        cart = [{'product_id': p['id'], 'quantity': rng.randint(1, args.max_quantity), 'price': p['price']}
+                for p in rng.sample(hot, min(len(hot), rng.randint(1, args.max_items)))]
+        if args.think:
+            time.sleep(rng.uniform(0, args.think / 1000))
+        status, result, elapsed = terminal.request('POST', '/sales/checkout', data={
+            'items': cart, 'payment_method': 'cash', 'customer_name': 'Load test'})
+        results.record_checkout(status, result, elapsed, cart)
+
+
+def latency_summary(values):
+    ms = [v * 1000 for v in values]
+    return {'count': len(ms), 'p50_ms': percentile(ms, 50), 'p95_ms': percentile(ms, 95),
+            'p99_ms': percentile(ms, 99), 'max_ms': max(ms, default=0)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', default='http://127.0.0.1:5000')
+    parser.add_argument('--username', default=OWNER_USERNAME)
+    parser.add_argument('--password', default=OWNER_PASSWORD)
+    parser.add_argument('--terminals', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=30, help='seconds')
+    parser.add_argument('--hot', type=int, default=20, help='number of contended products')
+    parser.add_argument('--stock', type=int, default=50, help='stock each hot product starts with (0 keeps it)')
+    parser.add_argument('--max-items', type=int, default=3)
+    parser.add_argument('--max-quantity', type=int, default=2)
+    parser.add_argument('--think', type=float, default=0, help='max think time between search and checkout, ms')
+    parser.add_argument('--timeout', type=float, default=30, help='HTTP timeout, seconds')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', help='write the report to this file')
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    admin = Terminal(args.url, args.timeout)
+    admin.login(args.username, args.password)
+    hot = pick_hot_products(admin, args.hot, rng)
+    if args.stock:
+        for product in hot:
+            set_stock(admin, product, args.stock)
+    start_stock = {p['id']: admin.product(p)['quantity'] for p in hot}
+
+    terminals = []
+    for _ in range(args.terminals):
+        terminal = Terminal(args.url, args.timeout)
+        terminal.login(args.username, args.password)
+        terminals.append(terminal)
+
+    results = Results()
+    deadline = time.perf_counter() + args.duration
+    threads = [threading.Thread(target=run_terminal, args=(terminal, args, hot, results, deadline, args.seed + i))
+               for i, terminal in enumerate(terminals)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    oversold = []
+    for product in hot:
+        current = admin.product(product)
+        final = current['quantity'] if current else None
+        sold = results.sold[product['id']]
+        start = start_stock[product['id']]
+        if final is None or sold > start or final < 0 or start - final != sold:
+            oversold.append({'product_id': product['id'], 'start': start, 'confirmed_sold': sold, 'final': final})
+    duplicates = {number: count for number, count in results.invoices.items() if count > 1}
+
+    report = {
+        'url': args.url,
+        'terminals': args.terminals,
+        'duration_s': elapsed,
+        'hot_products': len(hot),
+        'start_stock': args.stock or None,
+        'checkouts': dict(results.outcomes),
+        'throughput_per_s': results.outcomes['completed'] / elapsed if elapsed else 0,
+        'search': latency_summary(results.search_latency),
+        'checkout': latency_summary(results.checkout_latency),
+        'lock_errors': results.outcomes['lock_error'],
+        'oversold_products': oversold,
+        'invoice_collisions': results.outcomes['invoice_collision'] + sum(c - 1 for c in duplicates.values()),
+        'duplicate_invoices': duplicates,
+        'error_messages': dict(results.errors.most_common(10)),
+    }
+
+    print(f"{args.terminals} terminals for {elapsed:.1f}s against {args.url}, {len(hot)} hot products")
+    print(f"checkouts: {', '.join(f'{k} {v}' for k, v in sorted(results.outcomes.items()))}")
+    print(f"throughput: {report['throughput_per_s']:.1f} completed checkouts/s")
+    for name in ('search', 'checkout'):
+        s = report[name]
+        print(f"{name:>9}: p50 {s['p50_ms']:.1f} ms, p95 {s['p95_ms']:.1f} ms, p99 {s['p99_ms']:.1f} ms, "
+              f"max {s['max_ms']:.1f} ms ({s['count']} requests)")
+    print(f"lock-wait errors: {report['lock_errors']}")
+    print(f"oversold products: {len(oversold)}")
+    for row in oversold[:10]:
+        print(f"  product {row['product_id']}: start {row['start']}, confirmed sold {row['confirmed_sold']}, "
+              f"final {row['final']}")
+    print(f"invoice-number collisions: {report['invoice_collisions']}")
+    for message, count in results.errors.most_common(5):
+        print(f'  {count}x {message}')
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+    return 1 if oversold or report['invoice_collisions'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,194 @@
+"""Smoke-test the PostgreSQL-only code paths against a real server.
+
+SQLite runs skip these: row locks (SELECT ... FOR UPDATE) in checkout, cancel,
+stock adjustment and purchases, COPY FROM for the bulk product import with its
+INSERT ... SELECT opening movements, COPY TO for the stock movement CSV export,
+and the constraint rewrite in `Operations.set_foreign_key_ondelete`.
+
+Needs TEST_DATABASE_URL pointing at a PostgreSQL database (see SETUP_GUIDE.md,
+"PostgreSQL test matrix"). The database must be empty unless --reset is given,
+which drops and recreates its public schema.
+
+Run: TEST_DATABASE_URL=postgresql://... python scripts/pg_smoke.py [--reset]
+"""
+import argparse
+import io
+import os
+import sys
+import threading
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from sqlalchemy import create_engine, inspect
+
+from config import database_url
+
+CSV_IMPORT = (
+    'product_name,sku,purchase_price,selling_price,mrp,quantity,barcode\n'
+    'Paracetamol,PG1,1,2,3,5,PGB1\n'
+    'Cetirizine,PG2,1,2,3,0,\n'
+    'Duplicate,PG1,1,2,3,4,\n'
+    'Ibuprofen,PG3,1,2,3,9,PGB3\n'
+    'Last unit,PG4,1,2,3,1,\n'
+)
+
+failures = []
+
+
+def check(label, ok, detail=''):
+    print(f"{'ok  ' if ok else 'FAIL'} {label}{f': {detail}' if detail and not ok else ''}")
+    if not ok:
+        failures.append(label)
+
+
+def prepare_database(url, reset):
+    engine = create_engine(url)
+    try:
+        if engine.dialect.name != 'postgresql':
+            sys.exit(f'TEST_DATABASE_URL must point at PostgreSQL, got {engine.dialect.name}')
+        if reset:
+            with engine.begin() as conn:
+                conn.exec_driver_sql('DROP SCHEMA public CASCADE')
+                conn.exec_driver_sql('CREATE SCHEMA public')
+        elif inspect(engine).get_table_names():
+            sys.exit('The test database is not empty; pass --reset to drop its public schema')
+    finally:
+        engine.dispose()
+
+
+def login(app):
+    client = app.test_client()
+    response = client.post('/login', data={'username': 'owner', 'password': 'smoke-pass'})
+    assert response.status_code == 302, 'login failed'
+    return client
+
+
+def counting(module, name, calls):
+    original = getattr(module, name)
+
+    def wrapper(*args, **kwargs):
+        calls.append(name)
+        return original(*args, **kwargs)
+    setattr(module, name, wrapper)
+
+
+def run_checks(app):
+    from app.database import supports_copy
+    from app.migrations.ops import Operations
+    from app.models import db, Company, Product, Sale, StockMovement, Supplier
+    from app.routes import inventory
+    from app.stock import reconcile
+
+    client = app.test_client()
+    response = client.post('/register', data={
+        'company_name': 'PG Smoke', 'owner_name': 'Owner', 'email': 'owner@example.com', 'phone': '1',
+        'address': 'x', 'city': 'x', 'state': 'x', 'country': 'x', 'postal_code': '1',
+        'username': 'owner', 'password': 'smoke-pass', 'confirm_password': 'smoke-pass'})
+    check('register company', response.status_code == 302, response.status_code)
+
+    with app.app_context():
+        check('COPY available (psycopg2 driver)', supports_copy(db.session), db.engine.dialect.driver)
+
+    copies = []
+    counting(inventory, 'copy_rows_from', copies)
+    counting(inventory, 'copy_query_to', copies)
+
+    # Bulk import: COPY into product, INSERT ... SELECT opening movements
+    response = client.post('/inventory/products/add', content_type='multipart/form-data',
+                           data={'bulk_file': (io.BytesIO(CSV_IMPORT.encode()), 'products.csv')})
+    with app.app_context():
+        company_id = db.session.query(Company.id).scalar()
+        products = {p.sku: p for p in Product.query.filter_by(company_id=company_id)}
+        ids = {sku: p.id for sku, p in products.items()}
+        check('bulk import rows', sorted(ids) == ['PG1', 'PG2', 'PG3', 'PG4'], sorted(ids))
+        check('bulk import used COPY', copies.count('copy_rows_from') == 1, copies)
+        openings = StockMovement.query.filter_by(movement_type='opening').count()
+        check('opening movements', openings == 3, openings)
+        supplier = Supplier(company_id=company_id, supplier_name='PG Supplier', phone='1')
+        db.session.add(supplier)
+        db.session.commit()
+        supplier_id = supplier.id
+
+    # Checkout, cancel, adjust and purchase take row locks
+    response = client.post('/sales/checkout', json={'items': [{'id': ids['PG1'], 'quantity': 2},
+                                                              {'id': ids['PG3'], 'quantity': 1}]})
+    check('checkout', response.status_code == 200 and response.json.get('success'), response.json)
+    sale_id = response.json.get('sale_id')
+    response = client.post('/sales/checkout', json={'items': [{'id': ids['PG1'], 'quantity': 99}]})
+    check('checkout rejects oversell', response.status_code == 400, response.status_code)
+    response = client.post(f'/sales/invoices/{sale_id}/cancel', data={'cancellation_reason': 'smoke'})
+    check('cancel invoice', response.status_code == 302, response.status_code)
+    response = client.post(f'/inventory/products/{ids["PG2"]}/adjust-stock',
+                           json={'adjustment_type': 'add', 'quantity': 4})
+    check('adjust stock', response.status_code == 200 and response.json.get('success'), response.json)
+    response = client.post('/purchases/add', data={
+        'supplier_id': supplier_id, 'product_id[]': [str(ids['PG3'])], 'quantity[]': ['6'],
+        'unit_price[]': ['1'], 'batch_number[]': ['PB1'], 'expiry_date[]': ['2030-01-01'],
+        'tax_percentage[]': ['5']})
+    check('purchase', response.status_code == 302, response.status_code)
+
+    # Two cashiers race for the last unit: the row lock lets exactly one through
+    clients = [login(app), login(app)]
+    barrier = threading.Barrier(len(clients))
+    results = []
+
+    def sell(c):
+        barrier.wait()
+        results.append(c.post('/sales/checkout', json={'items': [{'id': ids['PG4'], 'quantity': 1}]}).status_code)
+    threads = [threading.Thread(target=sell, args=(c,)) for c in clients]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    check('concurrent checkout of the last unit', sorted(results) == [200, 400], results)
+
+    with app.app_context():
+        quantities = {p.sku: p.quantity for p in Product.query.filter_by(company_id=company_id)}
+        expected = {'PG1': 5, 'PG2': 4, 'PG3': 15, 'PG4': 0}
+        check('stock levels', quantities == expected, quantities)
+        drift = reconcile(company_id)
+        check('ledger matches stock', not drift, drift)
+        movements = StockMovement.query.count()
+        check('sales recorded', Sale.query.filter_by(company_id=company_id).count() == 2)
+
+    # CSV export through COPY TO
+    response = client.get('/inventory/stock-movement-report?export=csv')
+    lines = response.get_data(as_text=True).splitlines()
+    check('movement export', response.status_code == 200 and len(lines) == movements + 1,
+          (response.status_code, len(lines), movements))
+    check('movement export used COPY', 'copy_query_to' in copies, copies)
+
+    # Foreign key rewrite on a PostgreSQL constraint
+    with app.app_context():
+        engine = db.engine
+        fk = next(f for f in inspect(engine).get_foreign_keys('cart') if f['constrained_columns'] == ['user_id'])
+        with engine.begin() as conn:
+            conn.exec_driver_sql(f'ALTER TABLE cart DROP CONSTRAINT {fk["name"]}')
+            conn.exec_driver_sql(f'ALTER TABLE cart ADD CONSTRAINT {fk["name"]} '
+                                 'FOREIGN KEY (user_id) REFERENCES "user" (id)')
+        Operations(engine, db.metadata, log=lambda message: None).set_foreign_key_ondelete(
+            'cart', 'user_id', 'SET NULL')
+        fk = next(f for f in inspect(engine).get_foreign_keys('cart') if f['constrained_columns'] == ['user_id'])
+        check('set_foreign_key_ondelete', fk['options'].get('ondelete') == 'SET NULL', fk)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--reset', action='store_true', help='drop and recreate the public schema first')
+    args = parser.parse_args()
+
+    if not os.environ.get('TEST_DATABASE_URL'):
+        sys.exit('Set TEST_DATABASE_URL to a PostgreSQL database')
+    prepare_database(database_url('', 'TEST_DATABASE_URL'), args.reset)
+
+    from app import create_app
+    app, _ = create_app('testing')
+    app.config['WTF_CSRF_ENABLED'] = False
+    run_checks(app)
+
+    print(f'{len(failures)} failed' if failures else 'all checks passed')
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,32 @@
+"""Take a stock snapshot for every active company and report ledger drift.
+
+Intended to run from cron (e.g. nightly). Each run only replays the stock
+movements recorded since the previous snapshot.
+
+Run: python scripts/stock_snapshot.py [--correct]
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app import create_app
+from app.models import Company
+from app.stock import take_snapshot, reconcile, correct_drift
+
+
+def main(correct=False):
+    app, _ = create_app(os.environ.get('FLASK_ENV', 'development'))
+    with app.app_context():
+        for company in Company.query.filter_by(is_active=True).all():
+            drift = reconcile(company.id)
+            if drift and correct:
+                correct_drift(company.id, drift)
+            written = take_snapshot(company.id)
+            print(f'{company.company_name}: {written} snapshot rows, {len(drift)} products drifted')
+            for row in drift[:20]:
+                print(f"  {row['sku']}: ledger={row['ledger_quantity']} stock={row['product_quantity']}")
+
+
+if __name__ == '__main__':
+    main(correct='--correct' in sys.argv)